@@ -0,0 +1,260 @@
+"""
+Timing benchmarks for the Graph search backends
+Run with `python benchmarks.py`; each benchmark prints one line per variant
+"""
+
+import random
+import time
+from typing import Callable, List, Tuple
+
+import numpy as np
+
+from solution import Graph, Vertex, PriorityQueue, IndexedHeap, route_batch
+
+ASTAR_CSVS = ['test_csvs/astar/test_astar_2.csv', 'test_csvs/astar/test_astar_3.csv']
+
+
+def random_dense_graph(size: int, density: float, seed: int = 331, integer: bool = False) -> Graph:
+    """
+    Builds a random directed graph in the style of test_astar_2.csv / test_astar_3.csv
+    :param size: number of vertices
+    :param density: probability that any given edge exists
+    :param seed: random seed
+    :param integer: if true, weights are integers in [1, 1000]; else floats in [1, 1000)
+    :return: Graph
+    """
+    rng = random.Random(seed)
+    graph = Graph()
+    ids = [f"v{i}" for i in range(size)]
+    for v_id in ids:
+        graph.vertices[v_id] = Vertex(v_id, rng.uniform(0, 100), rng.uniform(0, 100))
+        graph.size += 1
+    for begin in ids:
+        for end in ids:
+            if begin != end and rng.random() < density:
+                graph.add_to_graph(begin, end, rng.randint(1, 1000) if integer else rng.uniform(1, 1000))
+    return graph
+
+
+def grid_graph(size: int, max_weight: int = 9, seed: int = 331) -> Graph:
+    """
+    Builds a bidirected size x size grid road network with random integer weights and coordinates
+    :param size: number of vertices along each side
+    :param max_weight: largest edge weight
+    :param seed: random seed
+    :return: Graph
+    """
+    rng = random.Random(seed)
+    graph = Graph()
+    for x in range(size):
+        for y in range(size):
+            graph.vertices[f"{x},{y}"] = Vertex(f"{x},{y}", x, y)
+            graph.size += 1
+    for x in range(size):
+        for y in range(size):
+            for dx, dy in ((1, 0), (0, 1)):
+                if x + dx < size and y + dy < size:
+                    graph.add_to_graph(f"{x},{y}", f"{x + dx},{y + dy}", rng.randint(1, max_weight))
+                    graph.add_to_graph(f"{x + dx},{y + dy}", f"{x},{y}", rng.randint(1, max_weight))
+    return graph
+
+
+def random_queries(graph: Graph, count: int, seed: int = 331) -> List[Tuple[str, str]]:
+    """
+    :param graph: Graph whose vertex ids are sampled
+    :param count: number of queries
+    :param seed: random seed
+    :return: count random (begin, end) pairs of vertex ids
+    """
+    rng = random.Random(seed)
+    ids = list(graph.vertices)
+    return [(rng.choice(ids), rng.choice(ids)) for _ in range(count)]
+
+
+def all_pairs(graph: Graph, limit: int = None) -> List[Tuple[str, str]]:
+    """
+    :param graph: Graph whose vertex ids are paired
+    :param limit: optional number of leading vertices to pair up
+    :return: every ordered (begin, end) pair of distinct vertex ids
+    """
+    ids = list(graph.vertices)[:limit]
+    return [(begin, end) for begin in ids for end in ids if begin != end]
+
+
+def timed(label: str, queries: List[Tuple[str, str]], search: Callable[[str, str], object]) -> float:
+    """
+    Runs search over every query, prints and returns the elapsed wall time
+    :param label: name printed in front of the timing
+    :param queries: (begin, end) pairs
+    :param search: callable running one query
+    :return: elapsed seconds
+    """
+    start = time.perf_counter()
+    for begin, end in queries:
+        search(begin, end)
+    elapsed = time.perf_counter() - start
+    print(f"  {label:<32} {elapsed * 1000:10.1f} ms  ({len(queries)} queries)")
+    return elapsed
+
+
+def bench_queues() -> None:
+    """
+    Compares PriorityQueue (Graph.dijkstra) against the CSR lazy heap and the IndexedHeap
+    on test_dijkstra_large style graphs, then times the queues alone on one decrease-key workload
+    """
+    graphs = [(csvf, Graph(csvf=csvf), None) for csvf in ASTAR_CSVS]
+    graphs.append(("random dense V=200", random_dense_graph(200, 0.5), 20))
+    for name, graph, limit in graphs:
+        print(f"dijkstra on {name}")
+        queries = all_pairs(graph, limit)
+        csr = graph.to_csr()
+        timed("Graph + PriorityQueue", queries, graph.dijkstra)
+        timed("CSRGraph + lazy heapq", queries, lambda b, e: csr.dijkstra(b, e, queue='lazy'))
+        timed("CSRGraph + IndexedHeap", queries, lambda b, e: csr.dijkstra(b, e, queue='indexed'))
+
+    print("queue operations only (20000 vertices, 200000 updates)")
+    rng = random.Random(331)
+    ops = [(rng.randrange(20000), rng.random()) for _ in range(200000)]
+    vertices = [Vertex(str(i)) for i in range(20000)]
+
+    start = time.perf_counter()
+    queue = PriorityQueue()
+    for v, priority in ops:
+        if vertices[v].id in queue.locator:
+            queue.update(priority, vertices[v])
+        else:
+            queue.push(priority, vertices[v])
+    while not queue.empty():
+        queue.pop()
+    print(f"  {'PriorityQueue':<32} {(time.perf_counter() - start) * 1000:10.1f} ms")
+
+    start = time.perf_counter()
+    heap = IndexedHeap(20000)
+    for v, priority in ops:
+        if v in heap:
+            heap.update(priority, v)
+        else:
+            heap.push(priority, v)
+    while not heap.empty():
+        heap.pop()
+    print(f"  {'IndexedHeap':<32} {(time.perf_counter() - start) * 1000:10.1f} ms")
+
+
+def bench_bucket_queue() -> None:
+    """
+    Compares Graph.dijkstra with a PriorityQueue against a BucketQueue on integer-weighted graphs
+    """
+    graphs = [('test_csvs/astar/test_astar_3.csv', Graph(csvf='test_csvs/astar/test_astar_3.csv'), None),
+              ('random integer V=200', random_dense_graph(200, 0.5, integer=True), 20)]
+    for name, graph, limit in graphs:
+        print(f"dijkstra on {name} (max weight {graph.integer_weight_bound()})")
+        queries = all_pairs(graph, limit)
+        timed("PriorityQueue", queries, lambda b, e: graph.dijkstra(b, e, queue='heap'))
+        timed("BucketQueue", queries, lambda b, e: graph.dijkstra(b, e, queue='bucket'))
+
+
+def bench_contraction_hierarchy() -> None:
+    """
+    Compares Graph.dijkstra against ContractionHierarchy.query on a 40 x 40 grid
+    """
+    graph = grid_graph(40)
+    start = time.perf_counter()
+    hierarchy = graph.contraction_hierarchy()
+    print(f"contraction hierarchy on 40x40 grid: built {hierarchy} in {time.perf_counter() - start:.1f} s")
+    queries = random_queries(graph, 200)
+    timed("Graph.dijkstra", queries, graph.dijkstra)
+    timed("ContractionHierarchy.query", queries, hierarchy.query)
+
+
+def bench_route_batch() -> None:
+    """
+    Compares one-at-a-time Graph.dijkstra against route_batch in process and on a process pool
+    """
+    graph = grid_graph(40)
+    queries = random_queries(graph, 2000)
+    print("route_batch on 40x40 grid")
+    timed("Graph.dijkstra", queries, graph.dijkstra)
+    for workers in (0, 4):
+        start = time.perf_counter()
+        for _ in route_batch(graph, queries, workers=workers):
+            pass
+        print(f"  {f'route_batch workers={workers}':<32} {(time.perf_counter() - start) * 1000:10.1f} ms")
+
+
+def bench_all_pairs() -> None:
+    """
+    Compares V^2 calls to Graph.dijkstra against one vectorized Floyd-Warshall
+    """
+    graphs = [('test_csvs/astar/test_astar_2.csv', Graph(csvf='test_csvs/astar/test_astar_2.csv'), None),
+              ("random dense V=200", random_dense_graph(200, 0.5), 20)]
+    for name, graph, limit in graphs:
+        print(f"all pairs on {name}")
+        queries = all_pairs(graph, limit)
+        timed("Graph.dijkstra", queries, graph.dijkstra)
+        start = time.perf_counter()
+        graph.all_pairs_shortest_paths()
+        print(f"  {'all_pairs_shortest_paths':<32} {(time.perf_counter() - start) * 1000:10.1f} ms")
+
+
+def bench_heuristic_table() -> None:
+    """
+    Compares a_star with a plain callable metric against the vectorized euclidean heuristic on a 60 x 60 grid
+    """
+    graph = grid_graph(60)
+    csr = graph.to_csr()
+    queries = random_queries(graph, 300)
+    print("a_star heuristics on 60x60 grid")
+    for name, search in [("Graph", graph.a_star), ("CSRGraph", csr.a_star)]:
+        timed(f"{name} + callable metric", queries,
+              lambda b, e: search(b, e, lambda v1, v2: Vertex.euclidean_distance(v1, v2)))
+        timed(f"{name} + vectorized metric", queries, lambda b, e: search(b, e, Vertex.euclidean_distance))
+
+
+def bench_bulk_construction() -> None:
+    """
+    Compares add_to_graph per edge against arrays2graph on lists and on NumPy arrays (200000 and 2000000 edges)
+    """
+    for count in [200000, 2000000]:
+        rng = np.random.default_rng(331)
+        begins, ends = rng.integers(0, count // 10, count), rng.integers(0, count // 10, count)
+        weights = rng.uniform(1, 1000, count)
+        print(f"bulk construction of {count} edges")
+        start = time.perf_counter()
+        graph = Graph()
+        for begin, end, weight in zip(begins.tolist(), ends.tolist(), weights.tolist()):
+            graph.add_to_graph(begin, end, weight)
+        print(f"  {'add_to_graph':<32} {(time.perf_counter() - start) * 1000:10.1f} ms")
+        for name, columns in [("arrays2graph (lists)", (begins.tolist(), ends.tolist(), weights.tolist())),
+                              ("arrays2graph (arrays)", (begins, ends, weights))]:
+            start = time.perf_counter()
+            Graph().arrays2graph(*columns)
+            print(f"  {name:<32} {(time.perf_counter() - start) * 1000:10.1f} ms")
+
+
+def bench_spatial_index() -> None:
+    """
+    Compares snapping points to their nearest vertex by scanning every vertex against SpatialIndex.nearest
+    """
+    graph = grid_graph(150)
+    rng = random.Random(331)
+    points = [(rng.uniform(0, 149), rng.uniform(0, 149)) for _ in range(200)]
+    print("nearest vertex on 150x150 grid")
+    start = time.perf_counter()
+    for x, y in points:
+        point = Vertex('point', x, y)
+        min(graph.get_all_vertices(), key=lambda vertex: vertex.euclidean_distance(point))
+    print(f"  {'scan get_all_vertices':<32} {(time.perf_counter() - start) * 1000:10.1f} ms  ({len(points)} points)")
+    start = time.perf_counter()
+    index = graph.spatial_index()
+    for x, y in points:
+        index.nearest(x, y)
+    elapsed = (time.perf_counter() - start) * 1000
+    print(f"  {'SpatialIndex (with build)':<32} {elapsed:10.1f} ms  ({len(points)} points)")
+
+
+BENCHMARKS = [bench_queues, bench_bucket_queue, bench_contraction_hierarchy, bench_route_batch, bench_all_pairs,
+              bench_heuristic_table, bench_bulk_construction, bench_spatial_index]
+
+if __name__ == '__main__':
+    for benchmark in BENCHMARKS:
+        benchmark()
@@ -0,0 +1,232 @@
+"""
+Asyncio front-end serving route queries over a loaded Graph
+RouteService answers requests on worker threads (Graph searches are reentrant, see SearchContext),
+coalesces identical in-flight requests and applies backpressure through a bounded request queue;
+LocalClient calls it in-process so the service can be load-tested without a network
+"""
+
+import asyncio
+from concurrent import futures
+from typing import TypeVar, Callable, Tuple, List, Dict, Any, Iterable
+
+from solution import Graph, Vertex, route_query, check_route_algorithm
+
+RouteService = TypeVar('RouteService')  # RouteService Class Instance
+Coupon = Tuple[Callable[[str], bool], float]
+
+
+class RouteService:
+    """
+    Asyncio route service holding one Graph
+    Requests wait in a queue of at most max_pending entries (so callers are slowed down, not buffered
+    without bound, when the service falls behind) and are answered by `concurrency` worker tasks,
+    each running one search at a time on the executor. Requests equal to one already queued or
+    running share its result instead of searching again
+    """
+
+    def __init__(self, graph: Graph, concurrency: int = 4, max_pending: int = 256,
+                 executor: futures.Executor = None) -> None:
+        """
+        Instantiates a RouteService; call start() (or use `async with`) before routing
+        :param graph: graph to be searched (a Graph or a CSRGraph); it must not be mutated while serving
+        :param concurrency: number of searches running at once
+        :param max_pending: maximum number of distinct requests waiting for a worker
+        :param executor: executor running the searches; defaults to a ThreadPoolExecutor of concurrency
+                         threads, owned and shut down by the service
+        """
+        self.graph = graph
+        self.concurrency = concurrency
+        self.max_pending = max_pending
+        self.executor = executor
+        self.requests = 0  # number of route() calls
+        self.coalesced = 0  # number of route() calls answered by an identical in-flight request
+        self.completed = 0  # number of searches run
+        self._owns_executor = executor is None
+        self._queue = None
+        self._admission = None  # asyncio.Semaphore of max_pending: one slot per queued request
+        self._workers = []
+        self._in_flight = {}  # request key -> asyncio.Future shared by every identical request
+
+    def __repr__(self) -> str:
+        """
+        :return: String representation of the service for debugging
+        """
+        return f"RouteService({self.graph!r}, running={bool(self._workers)}, stats={self.stats()})"
+
+    __str__ = __repr__
+
+    async def __aenter__(self) -> RouteService:
+        """
+        Starts the service, see start
+        :return: this RouteService
+        """
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        """
+        Closes the service, see close
+        :param exc_info: exception type, value and traceback, if the block raised
+        :return: None
+        """
+        await self.close()
+
+    async def start(self) -> None:
+        """
+        Starts the worker tasks on the running event loop
+        :return: None
+        """
+        if self._workers:
+            return
+        if self.executor is None:
+            self.executor = futures.ThreadPoolExecutor(max_workers=self.concurrency,
+                                                       thread_name_prefix='route-service')
+        self._queue = asyncio.Queue(maxsize=self.max_pending)
+        self._admission = asyncio.Semaphore(self.max_pending)
+        self._workers = [asyncio.create_task(self._work()) for _ in range(self.concurrency)]
+
+    async def close(self) -> None:
+        """
+        Stops the worker tasks; requests still pending fail with asyncio.CancelledError
+        :return: None
+        """
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        for future in self._in_flight.values():
+            future.cancel()
+        self._in_flight.clear()
+        if self._owns_executor and self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+
+    def stats(self) -> Dict[str, int]:
+        """
+        :return: dict of request, coalesced and completed counts and the current queue depth
+        """
+        return {'requests': self.requests, 'coalesced': self.coalesced, 'completed': self.completed,
+                'pending': self._queue.qsize() if self._queue is not None else 0,
+                'in_flight': len(self._in_flight)}
+
+    async def route(self, algorithm: str, begin_id: str, end_id: str,
+                    metric: Callable[[Vertex, Vertex], float] = None, coupon: Coupon = None) -> Tuple[List[str], float]:
+        """
+        Answers one route query, waiting for room in the request queue if the service is saturated
+        Requests are identical when algorithm, ids, metric and coupon are equal (callables by identity)
+        :param algorithm: 'dijkstra', 'a_star' or 'coupon', see solution.route_query
+        :param begin_id: a string representing the starting vertex
+        :param end_id: a string representing the ending vertex
+        :param metric: a callable that returns the taxicab or euclidean distance from one vertex to another
+        :param coupon: a tuple containing the coupon predicate on vertex ids and the cost multiplier
+        :return: a tuple containing the path from begin_id to end_id and its weight, or ([], 0)
+        """
+        if not self._workers:
+            raise RuntimeError("RouteService is not running; call start() first")
+        self.requests += 1
+        key = (algorithm, begin_id, end_id, metric, coupon)
+        future = self._in_flight.get(key)
+        if future is None:
+            check_route_algorithm(algorithm, metric, coupon)
+            # no shared future exists until the request is admitted, so a caller cancelled while the queue is
+            # full leaves nothing behind for identical callers, who wait for admission on their own
+            await self._admission.acquire()
+            future = self._in_flight.get(key)  # an identical request may have been admitted meanwhile
+            if future is None:
+                future = self._in_flight[key] = asyncio.get_running_loop().create_future()
+                self._queue.put_nowait(key)  # never full: every queued key holds one admission
+            else:
+                self._admission.release()
+                self.coalesced += 1
+        else:
+            self.coalesced += 1
+        path, dist = await asyncio.shield(future)  # one caller giving up must not cancel the others
+        return list(path), dist  # callers share the search result, so each gets its own path list
+
+    async def _work(self) -> None:
+        """
+        Worker task: runs queued requests on the executor and resolves their shared futures
+        :return: None
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            key = await self._queue.get()
+            self._admission.release()
+            future = self._in_flight.get(key)
+            try:
+                result = await loop.run_in_executor(self.executor, route_query, self.graph, *key)
+            except asyncio.CancelledError:
+                if future is not None:
+                    future.cancel()
+                raise
+            except Exception as exc:
+                if future is not None and not future.done():
+                    future.set_exception(exc)
+            else:
+                self.completed += 1
+                if future is not None and not future.done():
+                    future.set_result(result)
+            finally:
+                self._in_flight.pop(key, None)
+                self._queue.task_done()
+
+
+class LocalClient:
+    """
+    In-process client of a RouteService, with the same calls a network client would make
+    """
+
+    def __init__(self, service: RouteService) -> None:
+        """
+        Instantiates a LocalClient
+        :param service: running RouteService to send requests to
+        """
+        self.service = service
+
+    def __repr__(self) -> str:
+        """
+        :return: String representation of the client for debugging
+        """
+        return f"LocalClient({self.service!r})"
+
+    __str__ = __repr__
+
+    async def dijkstra(self, begin_id: str, end_id: str) -> Tuple[List[str], float]:
+        """
+        :return: the result of Graph.dijkstra(begin_id, end_id) on the service's graph
+        """
+        return await self.service.route('dijkstra', begin_id, end_id)
+
+    async def a_star(self, begin_id: str, end_id: str,
+                     metric: Callable[[Vertex, Vertex], float]) -> Tuple[List[str], float]:
+        """
+        :return: the result of Graph.a_star(begin_id, end_id, metric) on the service's graph
+        """
+        return await self.service.route('a_star', begin_id, end_id, metric)
+
+    async def tollway(self, begin_id: str, end_id: str, metric: Callable[[Vertex, Vertex], float],
+                      coupon: Coupon) -> Tuple[List[str], float]:
+        """
+        :return: the result of tollway_algorithm_again(graph, begin_id, end_id, metric, coupon)
+        """
+        return await self.service.route('coupon', begin_id, end_id, metric, coupon)
+
+    async def route_many(self, queries: Iterable[Tuple[str, str]], algorithm: str = 'dijkstra',
+                         metric: Callable[[Vertex, Vertex], float] = None, coupon: Coupon = None,
+                         concurrency: int = 64) -> List[Tuple[List[str], float]]:
+        """
+        Sends many requests at once, keeping at most concurrency of them outstanding (a load generator)
+        :param queries: iterable of (begin_id, end_id) tuples
+        :param algorithm: 'dijkstra', 'a_star' or 'coupon'
+        :param metric: metric callable for 'a_star' and 'coupon'
+        :param coupon: coupon tuple for 'coupon'
+        :param concurrency: maximum number of outstanding requests
+        :return: list of results in query order
+        """
+        limit = asyncio.Semaphore(concurrency)
+
+        async def one(begin_id: str, end_id: str) -> Tuple[List[str], float]:
+            async with limit:
+                return await self.service.route(algorithm, begin_id, end_id, metric, coupon)
+
+        return await asyncio.gather(*(one(begin_id, end_id) for begin_id, end_id in queries))
@@ -8,11 +8,18 @@ import itertools
 import math
 import os
 import random
+import threading
 import time
 import csv
 import queue
+import struct
+import warnings
+import weakref
+import zipfile
+from collections import OrderedDict
+from concurrent import futures
 from typing import TypeVar, Callable, Tuple, \
-    List, Set, Dict, Any
+    List, Set, Dict, Any, Iterable, Iterator
 
 import numpy as np
 
@@ -20,6 +27,20 @@ T = TypeVar('T')
 Matrix = TypeVar('Matrix')  # Adjacency Matrix
 Vertex = TypeVar('Vertex')  # Vertex Class Instance
 Graph = TypeVar('Graph')  # Graph Class Instance
+ShortestPathTree = TypeVar('ShortestPathTree')  # ShortestPathTree Class Instance
+DynamicShortestPathTree = TypeVar('DynamicShortestPathTree')  # DynamicShortestPathTree Class Instance
+ContractionHierarchy = TypeVar('ContractionHierarchy')  # ContractionHierarchy Class Instance
+Landmarks = TypeVar('Landmarks')  # Landmarks Class Instance
+PredicateMask = TypeVar('PredicateMask')  # PredicateMask Class Instance
+SearchContext = TypeVar('SearchContext')  # SearchContext Class Instance
+SearchStats = TypeVar('SearchStats')  # SearchStats Class Instance
+CountingQueue = TypeVar('CountingQueue')  # CountingQueue Class Instance
+RouteCache = TypeVar('RouteCache')  # RouteCache Class Instance
+AllPairsShortestPaths = TypeVar('AllPairsShortestPaths')  # AllPairsShortestPaths Class Instance
+ReachabilityMatrix = TypeVar('ReachabilityMatrix')  # ReachabilityMatrix Class Instance
+Condensation = TypeVar('Condensation')  # Condensation Class Instance
+SpatialIndex = TypeVar('SpatialIndex')  # SpatialIndex Class Instance
+CSRGraph = TypeVar('CSRGraph')  # CSRGraph Class Instance
 
 
 class Vertex:
@@ -124,7 +145,9 @@ class Vertex:
 class Graph:
     """ Class implementing the Graph ADT using an Adjacency Map structure """
 
-    __slots__ = ['size', 'vertices', 'plot_show', 'plot_delay']
+    __slots__ = ['size', 'vertices', 'plot_show', 'plot_delay', 'version', '_structure', '_geometry', '_weight_profile',
+                 '_reverse', '_vertex_index', '_predicate_masks', 'route_cache', '_condensation', '_coordinates',
+                 '_spatial_index']
 
     def __init__(self, plt_show: bool = False, matrix: Matrix = None, csvf: str = "") -> None:
         """
@@ -132,16 +155,35 @@ class Graph:
         Instantiates a Graph class instance
         :param: plt_show : if true, render plot when plot() is called; else, ignore calls to plot()
         :param: matrix : optional matrix parameter used for fast construction
-        :param: csvf : optional filepath to a csv containing a matrix
+        :param: csvf : optional filepath to a matrix csv, edge-list csv or npz file (see detect_graph_format)
         """
-        matrix = matrix if matrix else np.loadtxt(csvf, delimiter=',', dtype=str).tolist() if csvf else None
         self.size = 0
         self.vertices = {}
 
         self.plot_show = plt_show
         self.plot_delay = 0.2
 
-        if matrix is not None:
+        self.version = 0  # bumped on every mutation through the Graph API; keys derived caches
+        self._structure = 0  # bumped only when the Graph API adds a vertex or an edge, see condensation
+        self._geometry = 0  # bumped when the Graph API moves vertices, see coordinate_arrays
+        self._weight_profile = (0, 0)  # (max integer weight, number of other weights) or None, see integer_weight_bound
+        self._reverse = None  # (version, reverse adjacency), see reverse_adjacency
+        self._condensation = None  # ((structure, vertex count), Condensation), see condensation
+        self._coordinates = None  # ((geometry, vertex count), x array, y array), see coordinate_arrays
+        self._spatial_index = None  # ((geometry, vertex count), SpatialIndex), see spatial_index
+        self._vertex_index = {}  # vertex id -> insertion position, see vertex_index
+        self._predicate_masks = PredicateMaskCache()  # coupon predicate -> PredicateMask
+        self.route_cache = None  # optional RouteCache of search results, see enable_route_cache
+
+        if not matrix and csvf:
+            file_format = detect_graph_format(csvf)
+            if file_format == 'npz':
+                self.csr2graph(CSRGraph.load(csvf))
+            elif file_format == 'edgelist':
+                self.edgelist2graph(csvf)
+            else:
+                self.csv2graph(csvf)
+        elif matrix is not None:
             for i in range(1, len(matrix)):
                 for j in range(1, len(matrix)):
                     if matrix[i][j] == "None" or matrix[i][j] == "":
@@ -258,13 +300,36 @@ class Graph:
         if self.vertices.get(begin_id) is None:
             self.vertices[begin_id] = Vertex(begin_id)
             self.size += 1
+            self.version += 1
+            self._structure += 1
         if end_id is not None:
             if self.vertices.get(end_id) is None:
                 self.vertices[end_id] = Vertex(end_id)
                 self.size += 1
-            self.vertices.get(begin_id).adj[end_id] = weight
+                self.version += 1
+                self._structure += 1
+            adj = self.vertices.get(begin_id).adj
+            if adj.get(end_id) != weight or end_id not in adj:
+                if self._weight_profile is not None:
+                    self._weight_profile = _profile_weight(self._weight_profile, weight, adj.get(end_id))
+                if end_id not in adj:
+                    self._structure += 1
+                adj[end_id] = weight
+                self.version += 1
+
+    def invalidate_caches(self) -> None:
+        """
+        Declares that vertices, edges or coordinates were edited directly on Vertex objects instead of through
+        the Graph API, so that every cache derived from them (condensation, weight bound, packed coordinates,
+        route cache, ...) is rebuilt
+        :return: None
+        """
+        self.version += 1
+        self._structure += 1
+        self._weight_profile = None
+        self._geometry += 1
 
-    def matrix2graph(self, matrix: Matrix) -> None:
+    def matrix2graph(self, matrix: Matrix, x: Iterable[float] = None, y: Iterable[float] = None) -> None:
         """
         Given an adjacency matrix, construct a graph
         matrix[i][j] will be the weight of an edge between the vertex_ids
@@ -274,14 +339,106 @@ class Graph:
         Guaranteed that matrix will be square
         If matrix is nonempty, matrix[0][0] will be None
         :param matrix: an n x n square matrix (list of lists) representing Graph as adjacency map
+        :param x: optional x coordinates of the vertices, in matrix row order
+        :param y: optional y coordinates of the vertices, in matrix row order
         :return: None
         """
         for i in range(1, len(matrix)):  # add all vertices to begin with
             self.add_to_graph(matrix[i][0])
         for i in range(1, len(matrix)):  # go back through and add all edges
+            adj = self.vertices[matrix[i][0]].adj
             for j in range(1, len(matrix)):
                 if matrix[i][j] is not None:
-                    self.add_to_graph(matrix[i][0], matrix[j][0], matrix[i][j])
+                    adj[matrix[j][0]] = matrix[i][j]
+        if x is not None or y is not None:
+            self.arrays2graph([], [], [], ids=[matrix[i][0] for i in range(1, len(matrix))], x=x, y=y)
+        self.version += 1
+        self._structure += 1
+        self._weight_profile = None
+        self._geometry += 1
+
+    def edges2graph(self, edges: Iterable[Tuple[str, str, float]], ids: Iterable[str] = None,
+                    x: Iterable[float] = None, y: Iterable[float] = None) -> None:
+        """
+        Adds many (begin_id, end_id, weight) edges at once
+        The result equals calling add_to_graph for every id in ids and then for every edge in order
+        (a repeated edge keeps its last weight), but the caches are invalidated once at the end
+        instead of being maintained edge by edge
+        :param edges: iterable of (begin_id, end_id, weight) tuples
+        :param ids: optional vertex ids to add first, e.g. isolated vertices or to fix the vertex order
+        :param x: optional x coordinates aligned with ids
+        :param y: optional y coordinates aligned with ids
+        :return: None
+        """
+        if (x is None) != (y is None) or (x is not None and ids is None):
+            raise ValueError("x and y must be given together, aligned with ids")
+        vertices, count = self.vertices, len(self.vertices)
+        ids = [] if ids is None else _as_list(ids)
+        for v_id in ids:
+            if v_id not in vertices:
+                vertices[v_id] = Vertex(v_id)
+        if x is not None:
+            for v_id, v_x, v_y in zip(ids, np.asarray(x, dtype=np.float64).tolist(),
+                                      np.asarray(y, dtype=np.float64).tolist()):
+                vertices[v_id].x, vertices[v_id].y = v_x, v_y
+        for begin_id, end_id, weight in edges:
+            begin = vertices.get(begin_id)
+            if begin is None:
+                begin = vertices[begin_id] = Vertex(begin_id)
+            if end_id not in vertices:
+                vertices[end_id] = Vertex(end_id)
+            begin.adj[end_id] = weight
+        self.size += len(vertices) - count
+        self.version += 1
+        self._structure += 1
+        self._weight_profile = None
+        self._geometry += 1
+
+    def arrays2graph(self, begins: Iterable[str], ends: Iterable[str], weights: Iterable[float],
+                     ids: Iterable[str] = None, x: Iterable[float] = None, y: Iterable[float] = None) -> None:
+        """
+        Adds many edges given as parallel columns (lists or NumPy arrays) in bulk, see edges2graph
+        When the id columns are NumPy arrays of integers or of strings, ids are numbered and edges grouped
+        by begin vertex in NumPy, so the Python work is one dict.update per begin vertex instead of a loop
+        iteration per edge; other columns are zipped into edges2graph. Either way numeric ids become ints
+        This is about 4x faster than add_to_graph per edge, not 10x: every vertex still needs its own Vertex
+        and every edge an entry in a Python dict, and building those alone takes over half of the time
+        :param begins: begin vertex id of every edge
+        :param ends: end vertex id of every edge
+        :param weights: weight of every edge
+        :param ids: optional vertex ids to add first, e.g. isolated vertices or to fix the vertex order
+        :param x: optional x coordinates aligned with ids
+        :param y: optional y coordinates aligned with ids
+        :return: None
+        """
+        if not len(begins) == len(ends) == len(weights):
+            raise ValueError("begins, ends and weights must have the same length")
+        columns = [column for column in (ids, begins, ends) if column is not None]
+        kinds = {column.dtype.kind if isinstance(column, np.ndarray) else None for column in columns}
+        if not len(begins) or len(kinds) != 1 or not kinds <= {'i', 'u', 'U'}:
+            self.edges2graph(zip(_as_list(begins), _as_list(ends), _as_list(weights)), ids=ids, x=x, y=y)
+            return
+        # number every id in order of first appearance, as successive add_to_graph calls would insert them
+        codes, order = _first_appearance_codes(np.concatenate(
+            [column.ravel() for column in columns[:-2]] + [np.column_stack((begins, ends)).ravel()]))
+        begin_codes = codes[len(codes) - 2 * len(begins)::2]
+        # group edges by begin vertex in input order; the keys are distinct, so an unstable sort keeps that order
+        permutation = np.argsort(begin_codes * len(begin_codes) + np.arange(len(begin_codes)))
+        begin_codes = begin_codes[permutation]
+        ends, weights = ends[permutation].tolist(), np.asarray(weights)[permutation].tolist()
+        bounds = (np.flatnonzero(np.diff(begin_codes)) + 1).tolist()
+        self.edges2graph((), ids=ids, x=x, y=y)
+        vertices, count = self.vertices, len(self.vertices)
+        for v_id in order:
+            if v_id not in vertices:
+                vertices[v_id] = Vertex(v_id)
+        for head, start, stop in zip(begin_codes[[0] + bounds].tolist(), [0] + bounds, bounds + [len(ends)]):
+            vertices[order[head]].adj.update(zip(ends[start:stop], weights[start:stop]))
+        self.size += len(vertices) - count
+        self.version += 1
+        self._structure += 1
+        self._weight_profile = None
+        self._geometry += 1
 
     def graph2matrix(self) -> Matrix:
         """
@@ -293,10 +450,146 @@ class Graph:
             matrix.append([v_id] + [outgoing.adj.get(v) for v in self.vertices])
         return matrix if self.size else None
 
-    def graph2csv(self, filepath: str) -> None:
+    def weight_array(self) -> np.ndarray:
+        """
+        Returns the adjacency matrix of graph2matrix as a float array, without the id row and column
+        Rows and columns follow vertex insertion order; missing edges (None) become inf
+        :return: V x V float64 array of edge weights
+        """
+        index = self.vertex_index()
+        weights = np.full((self.size, self.size), np.inf)
+        for begin_id, vertex in self.vertices.items():
+            if vertex.adj:
+                weights[index[begin_id], [index[end_id] for end_id in vertex.adj]] = list(vertex.adj.values())
+        return weights
+
+    def all_pairs_shortest_paths(self) -> AllPairsShortestPaths:
+        """
+        Computes the distance between every pair of vertices with a vectorized Floyd-Warshall
+        Meant for dense graphs of up to a few thousand vertices: O(V^3) work in V NumPy passes,
+        O(V^2) memory. Later changes to the graph are not reflected in the returned table
+        :return: AllPairsShortestPaths holding the distance and predecessor matrices
+        """
+        return AllPairsShortestPaths(self)
+
+    def strongly_connected_components(self) -> List[List[str]]:
+        """
+        Finds the strongly connected components with an iterative Tarjan's algorithm (no recursion limit)
+        :return: list of components, each a list of vertex ids, in reverse topological order of the
+                 condensation: no component has an edge into a component listed after it
+        """
+        order, low = {}, {}  # discovery position and low-link of every visited vertex
+        stack, on_stack, components = [], set(), []
+        for root in self.vertices:
+            if root in order:
+                continue
+            order[root] = low[root] = len(order)
+            stack.append(root)
+            on_stack.add(root)
+            work = [(root, iter(self.vertices[root].adj))]
+            while work:
+                v_id, neighbors = work[-1]
+                for adj in neighbors:
+                    if adj not in order:
+                        order[adj] = low[adj] = len(order)
+                        stack.append(adj)
+                        on_stack.add(adj)
+                        work.append((adj, iter(self.vertices[adj].adj)))
+                        break
+                    if adj in on_stack:
+                        low[v_id] = min(low[v_id], order[adj])
+                else:  # every neighbor explored: v_id is finished
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        low[parent] = min(low[parent], low[v_id])
+                    if low[v_id] == order[v_id]:
+                        component = []
+                        while not component or component[-1] != v_id:
+                            component.append(stack.pop())
+                            on_stack.discard(component[-1])
+                        components.append(component)
+        return components
+
+    def condensation(self) -> Condensation:
+        """
+        Returns the strongly connected components and the DAG between them
+        Weight changes keep the cached result; adding a vertex or an edge through the Graph API rebuilds it.
+        Edges added straight to Vertex.adj are not tracked, so call invalidate_caches after such edits.
+        dijkstra, a_star and coupon_route consult it to reject unreachable targets before searching
+        :return: Condensation of this graph
+        """
+        key, cached = (self._structure, len(self.vertices)), self._condensation
+        if cached is None or cached[0] != key:
+            cached = self._condensation = (key, Condensation(self))
+        return cached[1]
+
+    def transitive_closure(self, reflexive: bool = False) -> ReachabilityMatrix:
+        """
+        Computes which vertices can reach which, as packed bitset rows (see ReachabilityMatrix.closure)
+        :param reflexive: if true, every vertex is also related to itself
+        :return: ReachabilityMatrix whose to_csv writes the relation in the graph2csv matrix shape
+        """
+        return ReachabilityMatrix.closure(self, reflexive)
+
+    def equivalence_closure(self) -> ReachabilityMatrix:
+        """
+        Computes the smallest equivalence relation containing the edges of this graph: two vertices
+        are related exactly when they are connected ignoring edge directions
+        :return: ReachabilityMatrix whose to_csv writes the relation in the graph2csv matrix shape
+        """
+        return ReachabilityMatrix.equivalence(self)
+
+    def csv2graph(self, csvf: str, progress: Callable[[int, int], None] = None, chunk_size: int = 1024,
+                  coordinates: bool = True) -> None:
+        """
+        Streams an adjacency matrix csv (as written by graph2csv) into the graph one row at a time
+        Both "None" and empty cells mark missing edges; only non-null edges are stored, so peak
+        memory is O(V + E) rather than the O(V^2) strings of a dense matrix
+        :param csvf: filepath to a csv containing a matrix
+        :param progress: optional callable receiving (rows_read, total_rows) after every chunk and at the end
+        :param chunk_size: number of rows between progress callbacks
+        :param coordinates: if true, also read vertex coordinates from the sidecar file next to csvf when it
+                            exists (see coordinates_path)
+        :return: None
+        """
+        with open(csvf, newline='') as graph_csv:
+            rows = csv.reader(graph_csv, delimiter=',')
+            header = next(rows, None)
+            if header is None:
+                return
+            ids = header[1:]  # header row and column are guaranteed symmetric
+            for v_id in ids:
+                self.add_to_graph(v_id)
+
+            total, read = len(ids), 0
+            for row in rows:
+                if not row:
+                    continue
+                self.add_to_graph(row[0])
+                adj = self.vertices[row[0]].adj
+                for end_id, cell in zip(ids, itertools.islice(row, 1, None)):
+                    if cell != "None" and cell != "":
+                        adj[end_id] = float(cell)
+                read += 1
+                if progress is not None and read % chunk_size == 0:
+                    progress(read, total)
+            self.version += 1
+            self._structure += 1
+            self._weight_profile = None
+            self._geometry += 1
+            if progress is not None and read % chunk_size:
+                progress(read, total)
+        if coordinates and os.path.exists(coordinates_path(csvf)):
+            self.csv2coordinates(coordinates_path(csvf))
+
+    def graph2csv(self, filepath: str, coordinates: bool = True) -> None:
         """
         given a (non-empty) graph, creates a csv file containing data necessary to reconstruct that graph
+        Vertex coordinates do not fit the square matrix, so they go to a sidecar csv (see coordinates_path),
+        written only when some vertex is off the origin; a stale sidecar from an earlier save is removed
         :param filepath: location to save CSV
+        :param coordinates: if true, write the coordinate sidecar
         :return: None
         """
         if self.size == 0:
@@ -304,12 +597,123 @@ class Graph:
 
         with open(filepath, 'w+') as graph_csv:
             csv.writer(graph_csv, delimiter=',').writerows(self.graph2matrix())
+        sidecar = coordinates_path(filepath)
+        if coordinates and any(v.x or v.y for v in self.vertices.values()):
+            self.coordinates2csv(sidecar)
+        elif os.path.exists(sidecar):
+            os.remove(sidecar)
+
+    def coordinates2csv(self, filepath: str) -> None:
+        """
+        Writes the x, y coordinates of every vertex as a csv with header "id,x,y"
+        :param filepath: location to save CSV
+        :return: None
+        """
+        with open(filepath, 'w', newline='') as coordinates_csv:
+            writer = csv.writer(coordinates_csv, delimiter=',')
+            writer.writerow(COORDINATES_HEADER)
+            writer.writerows([v_id, v.x, v.y] for v_id, v in self.vertices.items())
+
+    def csv2coordinates(self, filepath: str) -> None:
+        """
+        Sets vertex coordinates from a csv written by coordinates2csv, adding vertices not yet in the graph
+        The file is parsed by NumPy in one call and the x, y columns are converted to floats as whole arrays
+        :param filepath: location of the coordinate CSV
+        :return: None
+        """
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', UserWarning)  # a header-only file is an empty table, not an error
+            table = np.loadtxt(filepath, delimiter=',', dtype=str, skiprows=1, ndmin=2, quotechar='"',
+                               comments=None, encoding='utf-8')
+        if table.size:
+            self.arrays2graph([], [], [], ids=table[:, 0].tolist(), x=table[:, 1].astype(np.float64),
+                              y=table[:, 2].astype(np.float64))
+
+    def graph2edgelist(self, filepath: str, coordinates: bool = True) -> None:
+        """
+        Writes the graph as a sparse edge-list csv with header "begin,end,weight[,x,y]"
+        Every vertex is written first as a row with an empty end (carrying its x, y coordinates),
+        followed by one "begin,end,weight" row per edge, so the file is O(V + E) in size
+        :param filepath: location to save CSV
+        :param coordinates: if true, include the x, y columns holding vertex coordinates
+        :return: None
+        """
+        with open(filepath, 'w', newline='') as graph_csv:
+            writer = csv.writer(graph_csv, delimiter=',')
+            if coordinates:
+                writer.writerow(EDGELIST_HEADER + ['x', 'y'])
+                writer.writerows([v_id, '', '', v.x, v.y] for v_id, v in self.vertices.items())
+                writer.writerows([begin_id, end_id, weight, '', '']
+                                 for begin_id, v in self.vertices.items() for end_id, weight in v.adj.items())
+            else:
+                writer.writerow(EDGELIST_HEADER)
+                writer.writerows([v_id, '', ''] for v_id in self.vertices)
+                writer.writerows([begin_id, end_id, weight]
+                                 for begin_id, v in self.vertices.items() for end_id, weight in v.adj.items())
+
+    def edgelist2graph(self, filepath: str) -> None:
+        """
+        Streams an edge-list csv (as written by graph2edgelist) into the graph
+        Rows with an empty end add a vertex (setting x, y when present); all other rows add an edge
+        :param filepath: location of the edge-list CSV
+        :return: None
+        """
+        with open(filepath, newline='') as graph_csv:
+            rows = csv.reader(graph_csv, delimiter=',')
+            next(rows, None)  # header
+            for row in rows:
+                if not row:
+                    continue
+                if len(row) < 2 or row[1] == "":
+                    self.add_to_graph(row[0])
+                    if len(row) >= 5 and row[3] != "" and row[4] != "":
+                        vertex = self.vertices[row[0]]
+                        vertex.x, vertex.y = float(row[3]), float(row[4])
+                else:
+                    self.add_to_graph(row[0], row[1], float(row[2]))
+
+    def graph2npz(self, filepath: str) -> None:
+        """
+        Writes the graph as a binary NumPy .npz archive of its CSR arrays (see CSRGraph.save)
+        :param filepath: location to save the archive
+        :return: None
+        """
+        self.to_csr().save(filepath)
+
+    def csr2graph(self, csr: CSRGraph) -> None:
+        """
+        Adds every vertex (with coordinates) and edge of a CSR view to the graph
+        :param csr: CSRGraph to thaw into this graph
+        :return: None
+        """
+        ids, xs, ys = [str(v_id) for v_id in csr.ids], csr.x.tolist(), csr.y.tolist()
+        for i, v_id in enumerate(ids):
+            if v_id not in self.vertices:
+                self.vertices[v_id] = Vertex(v_id, xs[i], ys[i])
+                self.size += 1
+        for i, v_id in enumerate(ids):
+            lo, hi = int(csr.indptr[i]), int(csr.indptr[i + 1])
+            self.vertices[v_id].adj.update(zip([ids[j] for j in csr.indices[lo:hi].tolist()],
+                                               csr.weights[lo:hi].tolist()))
+        self.version += 1
+        self._structure += 1
+        self._weight_profile = None
+        self._geometry += 1
+
+    def to_csr(self) -> CSRGraph:
+        """
+        Builds a frozen compressed sparse row (CSR) view of this graph
+        Later changes to the graph are not reflected in the returned view
+        :return: CSRGraph with the same vertices, edges and coordinates as this graph
+        """
+        return CSRGraph.from_graph(self)
 
     # ============== Graph Methods from Project 9 ==============#
 
     def reset_vertices(self) -> None:
         """
         Resets all visited flags of vertices in Graph to false
+        Searches no longer set these flags (see SearchContext.mark_visited), so this only undoes mark_visited
         :return: None
         """
         for vertex in self.vertices.values():
@@ -365,69 +769,163 @@ class Graph:
         return list(reversed(path)), dist
 
     # ============== Modify Graph Methods Below ==============#
-    def dijkstra(self, begin_id: str, end_id: str) -> Tuple[List[str], float]:
+    def integer_weight_bound(self) -> int:
+        """
+        Bounds the edge weights if every weight is a non-negative integer (int or integral float)
+        add_to_graph keeps the bound up to date in O(1), raising it as weights are added (lowered weights
+        leave it as a looser upper bound); bulk loaders reset it and the next call rescans every edge.
+        Weights edited directly on Vertex.adj are not seen, which BucketQueue catches at push time (see dijkstra)
+        :return: an upper bound on the edge weights as an int, or None if some weight is fractional or negative
+        """
+        if self._weight_profile is None:
+            profile = (0, 0)
+            for vertex in self.vertices.values():
+                for weight in vertex.adj.values():
+                    profile = _profile_weight(profile, weight)
+            self._weight_profile = profile
+        bound, irregular = self._weight_profile
+        return bound if not irregular else None
+
+    def search_queue(self, queue: str = 'auto') -> Any:
+        """
+        Builds the priority queue used by dijkstra
+        :param queue: 'heap' for a PriorityQueue, 'bucket' for a BucketQueue (Dial's algorithm), or 'auto'
+                      to use a BucketQueue whenever every weight is a non-negative integer at most
+                      BUCKET_QUEUE_MAX_WEIGHT and a PriorityQueue otherwise
+        :return: PriorityQueue or BucketQueue
+        """
+        if queue == 'heap':
+            return PriorityQueue()
+        if queue not in ('auto', 'bucket'):
+            raise ValueError(f"unknown queue {queue!r}; expected 'auto', 'heap' or 'bucket'")
+        bound = self.integer_weight_bound()
+        if bound is not None and (queue == 'bucket' or bound <= BUCKET_QUEUE_MAX_WEIGHT):
+            return BucketQueue(bound)
+        if queue == 'bucket':
+            raise ValueError("bucket queue needs non-negative integer edge weights")
+        return PriorityQueue()
+
+    def dijkstra(self, begin_id: str, end_id: str, queue: str = 'auto',
+                 context: SearchContext = None) -> Tuple[List[str], float]:
         """
         Searches through a graph using Dijkstra's Algorithm
+        All search state lives in a SearchContext, so concurrent searches on one Graph do not interfere
 
         :param begin_id: a string representing the starting vertex of the search
         :param end_id: a string representing the ending vertex of the search
+        :param queue: which priority queue to search with, see search_queue; every choice returns the same path
+        :param context: optional SearchContext receiving the search state, e.g. to record visited vertices or
+                        collect SearchStats; searches given a context bypass the route cache
         :return: a tuple containing a list of strings (begin vertex --> end vertex) and a float representing
                 the weight of the path
         """
-
-        if begin_id in self.vertices and end_id in self.vertices:
-            path = dict()  # dict[key] = (pred,
-            queue = PriorityQueue()
+        if self.route_cache is not None and context is None:
+            return self.route_cache.lookup(self.version, ('dijkstra', begin_id, end_id),
+                                           lambda: self.dijkstra(begin_id, end_id, queue, SearchContext()))
+
+        stats = context.stats if context is not None else None
+        if stats is not None:
+            snapshot = stats.snapshot()
+            stats.start()
+        if begin_id in self.vertices and end_id in self.vertices and self.condensation().can_reach(begin_id, end_id):
+            context = context if context is not None else SearchContext()
+            path, visited = context.path, context.visited  # path[key] = (pred, distance)
+            queue = self.search_queue(queue)
+            if stats is not None:
+                queue, visited = stats.watch(queue), [] if visited is None else visited
             queue.push(0, self.vertices[begin_id])
             for vert in self.vertices:
                 path[vert] = (None, float("inf"))
 
             path[begin_id] = (None, 0)
+            if stats is not None:
+                stats.lap('setup')
+
+            try:
+                while not queue.empty():
+                    wgt, curr = queue.pop()
+                    if visited is not None:
+                        visited.append(curr.id)
+                    if curr.id != end_id:
+                        for adj in self.vertices[curr.id].adj:
+                            if path[adj][-1] > wgt + self.vertices[curr.id].adj[adj]:
+                                if adj not in queue.locator:
+                                    queue.push(wgt + self.vertices[curr.id].adj[adj], self.vertices[adj])
+                                    path[adj] = (curr.id, wgt + self.vertices[curr.id].adj[adj])
+                                else:
+                                    queue.update(wgt + self.vertices[curr.id].adj[adj], self.vertices[adj])
+                                    path[adj] = (curr.id, wgt + self.vertices[curr.id].adj[adj])
 
-            while not queue.empty():
-                wgt, curr = queue.pop()
-                if curr.id != end_id:
-                    for adj in self.vertices[curr.id].adj:
-                        if path[adj][-1] > wgt + self.vertices[curr.id].adj[adj]:
-                            if adj not in queue.locator:
-                                queue.push(wgt + self.vertices[curr.id].adj[adj], self.vertices[adj])
-                                path[adj] = (curr.id, wgt + self.vertices[curr.id].adj[adj])
-                            else:
-                                queue.update(wgt + self.vertices[curr.id].adj[adj], self.vertices[adj])
-                                path[adj] = (curr.id, wgt + self.vertices[curr.id].adj[adj])
-
-                else:
-                    return self.build_path(path, begin_id, end_id)
-
+                    else:
+                        if stats is not None:
+                            return self._finish_stats(stats, queue, visited, path, begin_id, end_id)
+                        return self.build_path(path, begin_id, end_id)
+            except BucketRangeError:
+                # a weight edited directly on Vertex.adj broke the bucket bound; rescan later, search with the heap
+                self._weight_profile = None
+                path.clear()
+                if context.visited is not None:
+                    context.visited.clear()
+                if stats is not None:  # the heap search reports alone, as if the bucket attempt never ran
+                    stats.restore(snapshot)
+                return self.dijkstra(begin_id, end_id, 'heap', context)
+            if stats is not None:
+                return self._finish_stats(stats, queue, visited, path, begin_id, None)
+
+        if stats is not None:
+            stats.reject()
         return ([], 0)
 
     def a_star(self, begin_id: str, end_id: str,
-               metric: Callable[[Vertex, Vertex], float]) -> Tuple[List[str], float]:
+               metric: Callable[[Vertex, Vertex], float], context: SearchContext = None) -> Tuple[List[str], float]:
         """
         Searches a graph using A* algorithm
+        All search state lives in a SearchContext, so concurrent searches on one Graph do not interfere
 
         :param begin_id: a string representing the starting vertex
         :param end_id: a string representing the ending vertex
-        :param metric: a callable that will either compute the taxicab or euclidean distance
+        :param metric: a callable that will either compute the taxicab or euclidean distance; metrics with a
+                       vectorized form (see register_vectorized_metric) are evaluated for every vertex at once
+        :param context: optional SearchContext receiving the search state, e.g. to record visited vertices or
+                        collect SearchStats; searches given a context bypass the route cache
         :return: A tuple containing a list of strings (the path begin_id to end_id) and a float (weight of path)
         """
-
-        if begin_id in self.vertices and end_id in self.vertices:
-            path = dict()  # dict[key] = (pred,
+        if self.route_cache is not None and context is None:
+            return self.route_cache.lookup(self.version, ('a_star', begin_id, end_id, metric),
+                                           lambda: self.a_star(begin_id, end_id, metric, SearchContext()))
+
+        stats = context.stats if context is not None else None
+        if stats is not None:
+            stats.start()
+        if begin_id in self.vertices and end_id in self.vertices and self.condensation().can_reach(begin_id, end_id):
+            context = context if context is not None else SearchContext()
+            path, visited = context.path, context.visited  # path[key] = (pred, distance)
             queue = PriorityQueue()
+            if stats is not None:
+                queue, visited = stats.watch(queue), [] if visited is None else visited
             queue.push(0, self.vertices[begin_id])
             for vert in self.vertices:
                 path[vert] = (None, float("inf"))
 
             path[begin_id] = (None, 0)
+            if stats is not None:
+                stats.lap('setup')
+            table, index = self.heuristic_table(end_id, metric), self.vertex_index()
+            if stats is not None:
+                stats.lap('heuristic')
 
             while not queue.empty():
                 wgt, curr = queue.pop()
+                if visited is not None:
+                    visited.append(curr.id)
                 if curr.id != end_id:
                     for adj in self.vertices[curr.id].adj:
                         new_cost = path[curr.id][-1] + self.vertices[curr.id].adj[adj]
                         if path[adj][-1] > new_cost:
-                            metric_cost = metric(self.vertices[adj], self.vertices[end_id])
+                            if table is not None:
+                                metric_cost = table[index[adj]]
+                            else:
+                                metric_cost = metric(self.vertices[adj], self.vertices[end_id])
                             if adj not in queue.locator:
                                 queue.push(new_cost + metric_cost, self.vertices[adj])
                                 path[adj] = (curr.id, new_cost)
@@ -437,58 +935,566 @@ class Graph:
                                 path[adj] = (curr.id, new_cost)
 
                 else:
+                    if stats is not None:
+                        return self._finish_stats(stats, queue, visited, path, begin_id, end_id)
                     return self.build_path(path, begin_id, end_id)
+            if stats is not None:
+                return self._finish_stats(stats, queue, visited, path, begin_id, None)
 
+        if stats is not None:
+            stats.reject()
         return ([], 0)
 
+    def _finish_stats(self, stats: SearchStats, queue: CountingQueue, visited: List[str],
+                      path: Dict[str, Tuple[str, float]], begin_id: str, end_id: str) -> Tuple[List[str], float]:
+        """
+        Ends an instrumented dijkstra or a_star: times the search and path phases and reports the counters
+        :param stats: SearchStats of the search
+        :param queue: the CountingQueue the search used
+        :param visited: ids of the settled vertices, in order
+        :param path: back-edges of the search
+        :param begin_id: id of the starting vertex
+        :param end_id: id of the ending vertex, or None if the search ran out of vertices without reaching it
+        :return: the search result, see dijkstra
+        """
+        stats.lap('search')
+        result = self.build_path(path, begin_id, end_id) if end_id is not None else ([], 0)
+        stats.lap('path')
+        # every settled vertex but the target had all of its out-edges examined
+        relaxed = sum(len(self.vertices[v_id].adj) for v_id in visited) - (len(self.vertices[end_id].adj)
+                                                                            if end_id is not None else 0)
+        stats.finish(len(visited), relaxed, queue.stale_pops())
+        return result
+
+    def shortest_path_tree(self, begin_id: str, targets: Iterable[str] = None,
+                           queue: str = 'auto') -> ShortestPathTree:
+        """
+        Runs one Dijkstra search from begin_id and keeps its state as a shortest-path tree
+        The search stops once every vertex in targets is settled, or explores everything reachable
+        if targets is None; paths to any settled vertex are then extracted without searching again
+
+        :param begin_id: a string representing the source vertex of the search
+        :param targets: optional iterable of vertex ids that must be settled before stopping
+        :param queue: which priority queue to search with, see search_queue
+        :return: ShortestPathTree rooted at begin_id (empty if begin_id is not in the graph)
+        """
+        tree = ShortestPathTree(begin_id)
+        if begin_id not in self.vertices:
+            return tree
+        targets = None if targets is None else [t for t in targets if t in self.vertices]
+        remaining = None if targets is None else set(targets)
+        path = {begin_id: (None, 0, 0)}  # dict[key] = (pred, distance, weight of edge pred -> key)
+        queue = self.search_queue(queue)
+        queue.push(0, self.vertices[begin_id])
+
+        try:
+            while not queue.empty():
+                wgt, curr = queue.pop()
+                tree.back_edges[curr.id] = path[curr.id]
+                if remaining is not None:
+                    remaining.discard(curr.id)
+                    if not remaining:
+                        break
+                for adj, weight in curr.adj.items():
+                    if adj not in tree.back_edges and path.get(adj, (None, math.inf))[1] > wgt + weight:
+                        path[adj] = (curr.id, wgt + weight, weight)
+                        if adj not in queue.locator:
+                            queue.push(wgt + weight, self.vertices[adj])
+                        else:
+                            queue.update(wgt + weight, self.vertices[adj])
+        except BucketRangeError:  # see dijkstra
+            self._weight_profile = None
+            return self.shortest_path_tree(begin_id, targets, 'heap')
+        return tree
+
+    def dynamic_shortest_path_tree(self, begin_id: str) -> DynamicShortestPathTree:
+        """
+        Builds a full shortest-path tree from begin_id that is repaired incrementally when edge weights
+        are changed through DynamicShortestPathTree.set_weight
+        :param begin_id: a string representing the source vertex
+        :return: DynamicShortestPathTree rooted at begin_id
+        """
+        return DynamicShortestPathTree(self, begin_id)
+
+    def reverse_adjacency(self) -> Dict[str, Dict[str, float]]:
+        """
+        Returns the incoming edges of every vertex as {end_id: {begin_id: weight}}
+        Vertex.adj only stores outgoing edges; the reverse map is cached until the next mutation
+        through the Graph API (see self.version)
+        :return: dict mapping every vertex id to a dict of its predecessors and edge weights
+        """
+        if self._reverse is None or self._reverse[0] != self.version:
+            reverse = {v_id: {} for v_id in self.vertices}
+            for begin_id, vertex in self.vertices.items():
+                for end_id, weight in vertex.adj.items():
+                    reverse[end_id][begin_id] = weight
+            self._reverse = (self.version, reverse)
+        return self._reverse[1]
+
+    def _bidirectional(self, begin_id: str, end_id: str,
+                       potential: Callable[[str], float] = None) -> Tuple[List[str], float]:
+        """
+        Bidirectional search meeting in the middle, shared by bidirectional_dijkstra and bidirectional_a_star
+        The forward search orders vertices by d_f(v) + p(v) and the backward search by d_b(v) - p(v);
+        with a consistent potential p both searches see non-negative reduced costs, and the search stops
+        once the two smallest keys sum to at least the best s-t distance found so far
+        :param begin_id: a string representing the starting vertex
+        :param end_id: a string representing the ending vertex
+        :param potential: optional callable p(v_id); None runs plain bidirectional Dijkstra
+        :return: a tuple containing the path from begin_id to end_id and its weight, or ([], 0)
+        """
+        if begin_id not in self.vertices or end_id not in self.vertices:
+            return ([], 0)
+        if begin_id == end_id:
+            return ([begin_id], 0)
+        potential = potential if potential is not None else (lambda v_id: 0)
+        adjacency = ({v_id: v.adj for v_id, v in self.vertices.items()}, self.reverse_adjacency())
+        dist = ({begin_id: 0}, {end_id: 0})
+        link = ({begin_id: (None, 0)}, {end_id: (None, 0)})  # (pred/succ id, weight of that edge)
+        settled = (set(), set())
+        sign = (1, -1)
+        counter = itertools.count()
+        heaps = ([(potential(begin_id), next(counter), begin_id)],
+                 [(-potential(end_id), next(counter), end_id)])
+        best, meet = math.inf, None
+
+        while heaps[0] and heaps[1]:
+            if heaps[0][0][0] + heaps[1][0][0] >= best:
+                break
+            side = 0 if heaps[0][0][0] <= heaps[1][0][0] else 1
+            _, _, curr = heapq.heappop(heaps[side])
+            if curr in settled[side]:
+                continue  # stale entry
+            settled[side].add(curr)
+            here, there = dist[side], dist[1 - side]
+            for adj, weight in adjacency[side][curr].items():
+                new_cost = here[curr] + weight
+                if new_cost < here.get(adj, math.inf):
+                    here[adj] = new_cost
+                    link[side][adj] = (curr, weight)
+                    heapq.heappush(heaps[side], (new_cost + sign[side] * potential(adj), next(counter), adj))
+                if adj in there and new_cost + there[adj] < best:
+                    best, meet = new_cost + there[adj], (curr, adj, weight) if side == 0 else (adj, curr, weight)
+
+        if meet is None:
+            return ([], 0)
+        # the best path is begin_id ~> meet[0] -> meet[1] ~> end_id
+        path, weights = [meet[0]], []
+        while link[0][path[-1]][0] is not None:
+            pred, weight = link[0][path[-1]]
+            path.append(pred)
+            weights.append(weight)
+        path.reverse()
+        weights.reverse()
+        path.append(meet[1])
+        weights.append(meet[2])
+        while link[1][path[-1]][0] is not None:
+            succ, weight = link[1][path[-1]]
+            path.append(succ)
+            weights.append(weight)
+        dist = 0
+        for weight in reversed(weights):  # summed from the end, like build_path
+            dist += weight
+        return path, dist
+
+    def bidirectional_dijkstra(self, begin_id: str, end_id: str) -> Tuple[List[str], float]:
+        """
+        Searches through a graph using Dijkstra's Algorithm from both ends at once
+        Returns a shortest path like dijkstra; when several paths tie, the one returned may differ
+
+        :param begin_id: a string representing the starting vertex of the search
+        :param end_id: a string representing the ending vertex of the search
+        :return: a tuple containing a list of strings (begin vertex --> end vertex) and a float representing
+                the weight of the path
+        """
+        return self._bidirectional(begin_id, end_id)
+
+    def bidirectional_a_star(self, begin_id: str, end_id: str,
+                             metric: Callable[[Vertex, Vertex], float]) -> Tuple[List[str], float]:
+        """
+        Searches a graph using A* from both ends at once
+        Both searches share the average potential p(v) = (metric(v, end) - metric(v, begin)) / 2,
+        which is consistent for both directions whenever metric is (as euclidean_distance and
+        taxicab_distance are when no edge is shorter than the distance between its endpoints)
+
+        :param begin_id: a string representing the starting vertex
+        :param end_id: a string representing the ending vertex
+        :param metric: a callable that will either compute the taxicab or euclidean distance
+        :return: A tuple containing a list of strings (the path begin_id to end_id) and a float (weight of path)
+        """
+        if begin_id not in self.vertices or end_id not in self.vertices:
+            return ([], 0)
+        begin, end = self.vertices[begin_id], self.vertices[end_id]
+        cache = {}
+
+        def potential(v_id: str) -> float:
+            if v_id not in cache:
+                vertex = self.vertices[v_id]
+                cache[v_id] = (metric(vertex, end) - metric(vertex, begin)) / 2
+            return cache[v_id]
+
+        return self._bidirectional(begin_id, end_id, potential)
+
+    def contraction_hierarchy(self, witness_limit: int = 500) -> ContractionHierarchy:
+        """
+        Preprocesses this graph into a contraction hierarchy for fast repeated point-to-point queries
+        Later changes to the graph are not reflected in the returned hierarchy
+        :param witness_limit: maximum vertices settled by each witness search, see ContractionHierarchy.build
+        :return: ContractionHierarchy whose query matches dijkstra
+        """
+        return ContractionHierarchy.build(self, witness_limit)
+
+    def landmarks(self, count: int = 4) -> Landmarks:
+        """
+        Preprocesses ALT landmark distance tables for use as an a_star metric
+        Later changes to the graph are not reflected in the returned heuristic
+        :param count: number of landmarks to pick
+        :return: Landmarks, callable as metric(vertex, target)
+        """
+        return Landmarks(self, count)
+
+    def set_coordinates(self, v_id: str, x: float, y: float) -> None:
+        """
+        Moves a vertex, keeping the packed coordinates and the spatial index in step
+        Assigning Vertex.x and Vertex.y directly after a query needs a call to invalidate_caches instead
+        :param v_id: id of a vertex in the graph
+        :param x: new x coordinate
+        :param y: new y coordinate
+        :return: None
+        """
+        vertex = self.vertices[v_id]
+        if (vertex.x, vertex.y) != (x, y):
+            vertex.x, vertex.y = x, y
+            self.version += 1
+            self._geometry += 1
+
+    def coordinate_arrays(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the x and y coordinates of every vertex packed into float arrays in vertex_index order
+        Cached until vertices are added or moved through the Graph API (see set_coordinates); coordinates
+        assigned directly on Vertex objects are picked up after invalidate_caches. The returned arrays
+        must not be modified
+        :return: tuple of the x array and the y array
+        """
+        key, cached = (self._geometry, len(self.vertices)), self._coordinates
+        if cached is None or cached[0] != key:
+            vertices, count = self.vertices.values(), len(self.vertices)
+            cached = self._coordinates = (key, np.fromiter((v.x for v in vertices), dtype=np.float64, count=count),
+                                          np.fromiter((v.y for v in vertices), dtype=np.float64, count=count))
+        return cached[1], cached[2]
+
+    def spatial_index(self) -> SpatialIndex:
+        """
+        Returns a grid index over the vertex coordinates for nearest-vertex and radius queries
+        Cached like coordinate_arrays: rebuilt once vertices are added or moved through the Graph API (see
+        set_coordinates), or after invalidate_caches when Vertex.x and Vertex.y were assigned directly
+        :return: SpatialIndex of this graph's vertices
+        """
+        key, cached = (self._geometry, len(self.vertices)), self._spatial_index
+        if cached is None or cached[0] != key:
+            cached = self._spatial_index = (key, SpatialIndex(list(self.vertices), *self.coordinate_arrays()))
+        return cached[1]
+
+    def nearest_vertex(self, x: float, y: float) -> str:
+        """
+        :param x: x coordinate of a point
+        :param y: y coordinate of a point
+        :return: id of the vertex closest to (x, y) by euclidean distance, or None if the graph is empty
+        """
+        nearest = self.spatial_index().nearest(x, y)
+        return nearest[0][0] if nearest else None
+
+    def dijkstra_xy(self, begin: Tuple[float, float], end: Tuple[float, float],
+                    queue: str = 'auto') -> Tuple[List[str], float]:
+        """
+        Runs dijkstra between the vertices nearest to two points, see nearest_vertex
+        :param begin: (x, y) of the starting point
+        :param end: (x, y) of the ending point
+        :param queue: which priority queue to search with, see search_queue
+        :return: a tuple containing the path between the snapped vertices and its weight, or ([], 0)
+        """
+        if not self.vertices:
+            return ([], 0)
+        return self.dijkstra(self.nearest_vertex(*begin), self.nearest_vertex(*end), queue)
+
+    def a_star_xy(self, begin: Tuple[float, float], end: Tuple[float, float],
+                  metric: Callable[[Vertex, Vertex], float]) -> Tuple[List[str], float]:
+        """
+        Runs a_star between the vertices nearest to two points, see nearest_vertex
+        :param begin: (x, y) of the starting point
+        :param end: (x, y) of the ending point
+        :param metric: a callable that will either compute the taxicab or euclidean distance
+        :return: a tuple containing the path between the snapped vertices and its weight, or ([], 0)
+        """
+        if not self.vertices:
+            return ([], 0)
+        return self.a_star(self.nearest_vertex(*begin), self.nearest_vertex(*end), metric)
+
+    def heuristic_table(self, end_id: str, metric: Callable[[Vertex, Vertex], float]) -> List[float]:
+        """
+        Evaluates metric(vertex, end) for every vertex in one NumPy operation, if metric has a vectorized form
+        :param end_id: id of the target vertex
+        :param metric: a_star metric, e.g. Vertex.euclidean_distance
+        :return: list of heuristic values in vertex_index order, or None if metric is not vectorized
+        """
+        vectorized = vectorized_metric(metric)
+        if vectorized is None:
+            return None
+        x, y = self.coordinate_arrays()
+        end = self.vertex_index()[end_id]
+        return vectorized(x, y, x[end], y[end]).tolist()
+
+    def vertex_index(self) -> Dict[str, int]:
+        """
+        Returns the insertion position of every vertex id, extended as vertices are added
+        Vertices are never removed through the Graph API, so positions are stable
+        :return: dict mapping vertex id to its integer index
+        """
+        index = self._vertex_index
+        if len(index) != len(self.vertices):
+            with _CACHE_LOCK:  # concurrent searches must not hand out the same position twice
+                for v_id in itertools.islice(self.vertices, len(index), None):
+                    index[v_id] = len(index)
+        return index
+
+    def predicate_mask(self, predicate: Callable[[str], bool]) -> PredicateMask:
+        """
+        Returns the per-vertex cache of a vertex id predicate (such as a coupon predicate)
+        Masks are cached on the graph by predicate identity for as long as the predicate is alive,
+        so repeated queries with the same predicate evaluate it at most once per vertex
+        :param predicate: callable taking a vertex id
+        :return: PredicateMask for predicate
+        """
+        return self._predicate_masks.get(predicate, lambda v_id: self.vertex_index()[v_id])
+
+    def enable_route_cache(self, maxsize: int = 1024) -> RouteCache:
+        """
+        Turns on an LRU cache of dijkstra, a_star and coupon_route results on this graph
+        Results are keyed by (algorithm, begin_id, end_id, metric, coupon policy), with callables compared
+        by identity, and are dropped as soon as the graph changes through the Graph API (see self.version)
+        :param maxsize: maximum number of cached results
+        :return: the new RouteCache, whose counters can be read with stats()
+        """
+        self.route_cache = RouteCache(maxsize)
+        return self.route_cache
+
+    def disable_route_cache(self) -> None:
+        """
+        Turns off and discards the route cache
+        :return: None
+        """
+        self.route_cache = None
+
+
+def _as_list(column: Iterable[Any]) -> List[Any]:
+    """
+    :param column: list, NumPy array or other iterable
+    :return: column as a list of Python objects
+    """
+    return column.tolist() if isinstance(column, np.ndarray) else list(column)
 
-def tollway_algorithm_again(graph: Graph, begin, end, metric: Callable[[Vertex, Vertex], float], coupon):
+
+def _first_appearance_codes(values: np.ndarray) -> Tuple[np.ndarray, List[Any]]:
+    """
+    Numbers the distinct values of an array in order of first appearance
+    Integers from a range at most a few times longer than the array are looked up in a table indexed by
+    value instead of being sorted, which is the common case of ids numbered 0..V-1
+    :param values: 1-d array of integers or fixed-width strings
+    :return: tuple of the number of every entry and the list of distinct values in number order
     """
-    Searches for the minimum path from params begin to end using A* search while applying a coupon once if applicable
+    if values.dtype.kind in 'iu' and int(values.max()) - int(values.min()) < 4 * len(values):
+        slot = (values - values.min()).astype(np.int64)
+        first = np.full(int(slot.max()) + 1, len(values))
+    else:
+        _, slot = np.unique(values, return_inverse=True)
+        slot = slot.reshape(-1)
+        first = np.full(int(slot.max()) + 1, len(values))
+    np.minimum.at(first, slot, np.arange(len(values)))  # position where every slot's value first appears
+    present = np.flatnonzero(first < len(values))
+    present = present[np.argsort(first[present])]
+    number = np.empty(len(first), dtype=np.int64)
+    number[present] = np.arange(len(present))
+    return number[slot], values[first[present]].tolist()
+
+
+def tollway_algorithm_again(graph: Graph, begin, end, metric: Callable[[Vertex, Vertex], float], coupon,
+                            stats: SearchStats = None):
+    """
+    Searches for the minimum path from params begin to end using A* search while applying the coupon
+    on every road it makes cheaper (see coupon_route)
 
-    :param graph: graph to be searched
+    :param graph: graph to be searched (a Graph, or a CSRGraph such as one opened with CSRGraph.open)
     :param begin: a str representing the starting vertex of the graph
     :param end: a str representing the ending vertex of the graph
     :param metric: a callable that returns the taxicab or euclidean distance from one vertex to another
     :param coupon: a tuple containing: a lambda function to check if the coupon can be applied to the current vertex,
                     and an int multiplier representing the modifier of the mystery coupon
+    :param stats: optional SearchStats collecting the search's counters and phase timings
     :return: a tuple containing: a list representing the shortest path from begin to end, and a number representing
             the weight of that path
     """
+    path, dist, _ = coupon_route(graph, begin, end, metric, coupon, stats=stats)
+    return path, dist
 
-    if begin in graph.vertices and end in graph.vertices:
-        path = dict()  # dict[key] = (pred, weight)
-        discount = (None, None, float("inf"))
-        queue = PriorityQueue()
-        queue.push(0, graph.vertices[begin])
 
-        for vert in graph.vertices:
-            path[vert] = (None, float("inf"))
+def coupon_route(graph: Graph, begin: str, end: str, metric: Callable[[Vertex, Vertex], float],
+                 coupon: Tuple[Callable[[str], bool], float], max_coupons: int = None,
+                 stats: SearchStats = None) -> Tuple[List[str], float, List[Tuple[str, str]]]:
+    """
+    Searches for the cheapest path from begin to end when a coupon may discount roads
+    A coupon applies to a road leaving any vertex whose id satisfies coupon[0], multiplying its cost by
+    coupon[1]; it is only used where that makes the road cheaper. With a limited number of coupons the
+    search runs once over the product space of (vertex, coupons used) states, so all
+    (max_coupons + 1) layers share one queue: O((V + E) * k log(V * k)) instead of one search per
+    candidate discounted road
 
-        path[begin] = (None, 0)
+    The metric is scaled by min(1, coupon[1]) so it stays a lower bound on discounted costs, and the
+    predicate is evaluated through the graph's predicate_mask cache, at most once per vertex
 
-        while not queue.empty():
-            wgt, curr = queue.pop()
-            if curr.id != end:
-                for adj in graph.vertices[curr.id].adj:
-                    new_cost = path[curr.id][-1] + graph.vertices[curr.id].adj[adj]
+    :param graph: graph to be searched (a Graph or a CSRGraph)
+    :param begin: a str representing the starting vertex of the graph
+    :param end: a str representing the ending vertex of the graph
+    :param metric: a callable that returns the taxicab or euclidean distance from one vertex to another
+    :param coupon: a tuple containing the predicate on vertex ids and the cost multiplier
+    :param max_coupons: maximum number of roads to discount, or None for unlimited coupons
+    :param stats: optional SearchStats collecting the search's counters and phase timings; instrumented
+                  searches bypass the route cache
+    :return: a tuple containing the path from begin to end, its discounted cost, and the list of
+             (begin_id, end_id) roads the coupon was applied to; ([], 0, []) if no path exists
+    """
+    if isinstance(graph, Graph) and graph.route_cache is not None and stats is None:
+        return graph.route_cache.lookup(graph.version, ('coupon', begin, end, metric, coupon, max_coupons),
+                                        lambda: _coupon_search(graph, begin, end, metric, coupon, max_coupons))
+    return _coupon_search(graph, begin, end, metric, coupon, max_coupons, stats)
 
-                    if path[adj][-1] > new_cost:
-                        metric_cost = metric(graph.vertices[adj], graph.vertices[end])
-                        if adj not in queue.locator:
-                            queue.push(new_cost + metric_cost, graph.vertices[adj])
-                            path[adj] = (curr.id, new_cost)
 
-                        else:
-                            queue.update(new_cost + metric_cost, graph.vertices[adj])
-                            path[adj] = (curr.id, new_cost)
+def _coupon_search(graph: Graph, begin: str, end: str, metric: Callable[[Vertex, Vertex], float],
+                   coupon: Tuple[Callable[[str], bool], float], max_coupons: int,
+                   stats: SearchStats = None) -> Tuple[List[str], float, List[Tuple[str, str]]]:
+    """
+    Runs the layered search of coupon_route, bypassing the route cache
+    :return: see coupon_route
+    """
+    if stats is not None:
+        stats.start()
+    if isinstance(graph, CSRGraph):
+        if graph.lookup(begin) < 0 or graph.lookup(end) < 0:
+            return _coupon_rejected(stats)
+        vertex, out_edges, index_of = graph.vertex_by_id, graph.out_edges, graph.lookup
+    else:
+        if begin not in graph.vertices or end not in graph.vertices or not graph.condensation().can_reach(begin, end):
+            return _coupon_rejected(stats)
+        vertex, out_edges = graph.vertices.__getitem__, lambda v_id: graph.vertices[v_id].adj.items()
+        index_of = graph.vertex_index().__getitem__
+
+    applies, multiplier = graph.predicate_mask(coupon[0]), coupon[1]
+    layers = math.inf if max_coupons is None else max_coupons  # coupons that may still be spent
+    scale = min(1, multiplier)
+    target = vertex(end)
+    if stats is not None:
+        stats.lap('setup')
+    table = graph.heuristic_table(end, metric)
+    heuristic = {}
+
+    start = (begin, 0)  # state = (vertex id, coupons used); unlimited coupons collapse to layer 0
+    path = {start: (None, 0, 0, False)}  # dict[state] = (pred state, cost, road cost, discounted)
+    settled = set()
+    counter = itertools.count()
+    heap = [(0, next(counter), start)]
+    push = heapq.heappush if stats is None else stats.heap_push
+    if stats is not None:
+        stats.lap('heuristic')
+
+    while heap:
+        _, _, state = heapq.heappop(heap)
+        if state in settled:
+            continue  # superseded by a cheaper entry for the same state
+        settled.add(state)
+        curr, used = state
+        if curr == end:
+            if stats is not None:
+                return _coupon_stats(stats, path, state, settled, heap, counter, out_edges)
+            return _coupon_path(path, state)
+        cost = path[state][1]
+        eligible = multiplier < 1 and applies(curr)
+        for adj, weight in out_edges(curr):
+            moves = [((adj, used), weight, False)]
+            if eligible and weight * multiplier < weight:
+                if max_coupons is None:
+                    moves = [((adj, used), weight * multiplier, True)]
+                elif used < layers:
+                    moves.append(((adj, used + 1), weight * multiplier, True))
+            for nxt, road, discounted in moves:
+                new_cost = cost + road
+                if nxt not in settled and new_cost < path.get(nxt, (None, math.inf))[1]:
+                    if adj not in heuristic:
+                        h = metric(vertex(adj), target) if table is None else table[index_of(adj)]
+                        heuristic[adj] = math.inf if h == math.inf else scale * h  # 0 * inf would be NaN
+                    if heuristic[adj] == math.inf:
+                        continue  # the metric proves adj cannot reach end (e.g. Landmarks), so never queue it
+                    path[nxt] = (state, new_cost, road, discounted)
+                    push(heap, (new_cost + heuristic[adj], next(counter), nxt))
+
+    if stats is not None:
+        return _coupon_stats(stats, path, None, settled, heap, counter, out_edges)
+    return ([], 0, [])
+
+
+def _coupon_rejected(stats: SearchStats) -> Tuple[List[str], float, List[Tuple[str, str]]]:
+    """
+    :param stats: SearchStats of a coupon_route search rejected before searching, or None
+    :return: the empty coupon_route result
+    """
+    if stats is not None:
+        stats.reject()
+    return ([], 0, [])
 
-            else:
-                if discount[0] is not None:
-                    graph.vertices[discount[0]].adj[1] = discount[-1]
-                return graph.build_path(path, begin, end)
 
-    return ([], 0)
+def _coupon_stats(stats: SearchStats, path: Dict[Tuple[str, int], Tuple[Any, float, float, bool]],
+                  state: Tuple[str, int], settled: Set[Tuple[str, int]], heap: List[Tuple[float, int, Any]],
+                  counter: Iterator[int], out_edges: Callable[[str], Iterable[Tuple[str, float]]]
+                  ) -> Tuple[List[str], float, List[Tuple[str, str]]]:
+    """
+    Ends an instrumented coupon_route search: times the search and path phases and reports the counters
+    Pushes are read off the tie-break counter, and every popped entry that did not settle a state was stale
+    :param stats: SearchStats of the search
+    :param path: back-edges of the search
+    :param state: final state reached, or None if the search ran out of states
+    :param settled: states settled by the search
+    :param heap: entries left in the heap
+    :param counter: the search's tie-break counter, drawn from once per push
+    :param out_edges: callable listing the (end id, weight) edges leaving a vertex
+    :return: see coupon_route
+    """
+    stats.lap('search')
+    result = _coupon_path(path, state) if state is not None else ([], 0, [])
+    stats.lap('path')
+    pushes = next(counter)
+    stats.pushes += pushes
+    # every settled state but the final one had all of its out-edges examined
+    relaxed = sum(sum(1 for _ in out_edges(v_id)) for v_id, used in settled if (v_id, used) != state)
+    stats.finish(len(settled), relaxed, pushes - len(heap) - len(settled))
+    return result
+
+
+def _coupon_path(path: Dict[Tuple[str, int], Tuple[Any, float, float, bool]],
+                 state: Tuple[str, int]) -> Tuple[List[str], float, List[Tuple[str, str]]]:
+    """
+    Reconstructs the result of coupon_route from its back-edges
+    :param path: dict mapping each state to (pred state, cost, road cost, discounted)
+    :param state: final (vertex id, coupons used) state
+    :return: tuple of the path, its cost summed from the end like Graph.build_path, and the discounted roads
+    """
+    ids, dist, discounted = [state[0]], 0, []
+    pred, _, road, used = path[state]
+    while pred is not None:
+        dist += road
+        if used:
+            discounted.append((pred[0], ids[-1]))
+        ids.append(pred[0])
+        pred, _, road, used = path[pred]
+    discounted.reverse()
+    return list(reversed(ids)), dist, discounted
 
 
 class PriorityQueue:
@@ -554,7 +1560,6 @@ class PriorityQueue:
             # keep popping until we have valid entry
             priority, count, vertex = heapq.heappop(self.data)
         del self.locator[vertex.id]  # remove from locator dict
-        vertex.visited = True  # indicate that this vertex was visited
         while len(self.data) > 0 and self.data[0][2] is None:
             heapq.heappop(self.data)  # delete trailing Nones
         return priority, vertex
@@ -569,3 +1574,2301 @@ class PriorityQueue:
         node = self.locator.pop(vertex.id)  # delete from dictionary
         node[-1] = None  # invalidate old node
         self.push(new_priority, vertex)  # push new node
+
+
+class BucketRangeError(ValueError):
+    """
+    Raised by BucketQueue.push for a priority its buckets cannot order, i.e. an edge weight that is
+    fractional, negative or above the max_weight the queue was built for
+    """
+
+
+class BucketQueue:
+    """
+    Bucket queue for Dijkstra's algorithm on non-negative integer weights (Dial's algorithm)
+    Drop-in replacement for PriorityQueue: every live key lies within max_weight of the last popped
+    key, so a circular array of max_weight + 1 FIFO buckets orders vertices in O(1) per operation
+    FIFO buckets pop equal keys in push order, so ties are broken exactly like PriorityQueue
+    """
+
+    __slots__ = ['buckets', 'locator', 'cursor', 'head', 'count']
+
+    def __init__(self, max_weight: int) -> None:
+        """
+        Construct a BucketQueue
+        :param max_weight: largest edge weight of the searched graph
+        """
+        self.buckets = [[] for _ in range(max_weight + 1)]  # circular array of [priority, vertex] nodes
+        self.locator = {}  # dictionary to locate vertices within the bucket queue
+        self.cursor = 0  # key of the bucket currently being drained
+        self.head = 0  # read position within the current bucket
+        self.count = 0  # number of live (not invalidated) nodes
+
+    def __repr__(self) -> str:
+        """
+        Represent BucketQueue as a string
+        :return: string representation of BucketQueue object
+        """
+        return ", ".join(f"[{priority}, {vertex}]" for priority, vertex in self.locator.values())
+
+    __str__ = __repr__
+
+    def empty(self) -> bool:
+        """
+        Determine whether bucket queue is empty
+        :return: True if queue is empty, else false
+        """
+        return self.count == 0
+
+    def push(self, priority: float, vertex: Vertex) -> None:
+        """
+        Push a vertex onto the bucket queue with a given integral priority
+        :param priority: priority key upon which to order vertex
+        :param vertex: Vertex object to be stored in the bucket queue
+        :return: None
+        """
+        if not self.cursor <= priority < self.cursor + len(self.buckets) or priority != int(priority):
+            raise BucketRangeError(f"priority {priority} is not an integer within {len(self.buckets) - 1} "
+                                   f"of the last popped key {self.cursor}")
+        node = [priority, vertex]
+        self.locator[vertex.id] = node
+        self.buckets[int(priority) % len(self.buckets)].append(node)
+        self.count += 1
+
+    def pop(self) -> Tuple[float, Vertex]:
+        """
+        Remove and return the (priority, vertex) tuple with lowest priority key
+        :return: (priority, vertex) tuple where priority is key,
+        and vertex is Vertex object stored in bucket queue
+        """
+        buckets = self.buckets
+        while True:
+            bucket = buckets[self.cursor % len(buckets)]
+            while self.head < len(bucket):
+                priority, vertex = bucket[self.head]
+                self.head += 1
+                if vertex is not None:
+                    del self.locator[vertex.id]
+                    self.count -= 1
+                    return priority, vertex
+            bucket.clear()
+            self.head = 0
+            self.cursor += 1
+
+    def update(self, new_priority: float, vertex: Vertex) -> None:
+        """
+        Update given Vertex object in the bucket queue to have new priority
+        :param new_priority: new priority on which to order vertex
+        :param vertex: Vertex object for which priority is to be updated
+        :return: None
+        """
+        node = self.locator.pop(vertex.id)
+        node[-1] = None  # invalidate old node
+        self.count -= 1
+        self.push(new_priority, vertex)
+
+
+class RouteCache:
+    """
+    Size-bounded LRU cache of route results (see Graph.enable_route_cache)
+    Entries are only valid for the graph version they were computed at; the first lookup after the
+    graph changes drops them all. Cached paths are copied on the way out, so callers may modify them
+    """
+
+    __slots__ = ['maxsize', 'entries', 'version', 'hits', 'misses', 'evictions', 'invalidations', 'lock']
+
+    def __init__(self, maxsize: int = 1024) -> None:
+        """
+        Instantiates an empty RouteCache
+        :param maxsize: maximum number of cached results
+        """
+        self.maxsize = maxsize
+        self.entries = OrderedDict()  # key -> result, least recently used first
+        self.version = None  # graph version the entries belong to
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0  # entries dropped to make room
+        self.invalidations = 0  # times the entries were dropped because the graph changed
+        self.lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        """
+        :return: String representation of the cache for debugging
+        """
+        return f"RouteCache({len(self.entries)}/{self.maxsize}, {self.stats()})"
+
+    __str__ = __repr__
+
+    def __len__(self) -> int:
+        """
+        :return: number of cached results
+        """
+        return len(self.entries)
+
+    def __reduce__(self) -> Tuple[type, tuple]:
+        """
+        Entries are not pickled (their keys hold arbitrary callables); a copied graph starts with an empty cache
+        :return: reconstruction tuple for pickle
+        """
+        return RouteCache, (self.maxsize,)
+
+    def lookup(self, version: int, key: tuple, search: Callable[[], tuple]) -> tuple:
+        """
+        Returns the cached result for key, running search to compute it on a miss
+        :param version: current Graph.version
+        :param key: (algorithm, begin_id, end_id, ...) tuple identifying the query
+        :param search: callable computing the result without consulting the cache
+        :return: result tuple, with its lists copied
+        """
+        with self.lock:
+            if version != self.version:
+                if self.entries:
+                    self.invalidations += 1
+                    self.entries.clear()
+                self.version = version
+            result = self.entries.get(key)
+            if result is not None:
+                self.hits += 1
+                self.entries.move_to_end(key)
+            else:
+                self.misses += 1
+        if result is None:
+            result = search()
+            with self.lock:
+                if version == self.version and self.maxsize > 0:
+                    self.entries[key] = result
+                    if len(self.entries) > self.maxsize:
+                        self.entries.popitem(last=False)
+                        self.evictions += 1
+        return tuple(list(item) if isinstance(item, list) else item for item in result)
+
+    def clear(self) -> None:
+        """
+        Drops every entry, keeping the counters
+        :return: None
+        """
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """
+        :return: dict of the hit, miss, eviction and invalidation counters and the current size
+        """
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'invalidations': self.invalidations, 'size': len(self.entries)}
+
+
+class SearchContext:
+    """
+    Per-query state of a Graph search (see Graph.dijkstra and Graph.a_star)
+    Searches keep distances and predecessors here rather than on the shared Vertex objects, so the
+    graph is never written to while it is queried and one Graph can serve many threads at once
+    """
+
+    __slots__ = ['path', 'visited', 'stats']
+
+    def __init__(self, record_visited: bool = False, stats: SearchStats = None) -> None:
+        """
+        Instantiates an empty SearchContext
+        :param record_visited: if true, the search lists the ids of the vertices it settles in visited
+        :param stats: optional SearchStats collecting the search's counters and phase timings
+        """
+        self.path = {}  # dict[vertex id] = (pred id, distance) of every vertex reached by the search
+        self.visited = [] if record_visited else None
+        self.stats = stats
+
+    def __repr__(self) -> str:
+        """
+        :return: String representation of the context for debugging
+        """
+        visited = "not recorded" if self.visited is None else len(self.visited)
+        return f"SearchContext(reached={len(self.path)}, visited={visited})"
+
+    __str__ = __repr__
+
+    def mark_visited(self, graph: Graph) -> None:
+        """
+        Sets the visited flag of every recorded vertex, so Graph.plot can show what the search explored
+        This writes to the shared vertices; call graph.reset_vertices() to clear the flags again
+        :param graph: the Graph that was searched
+        :return: None
+        """
+        if self.visited is None:
+            raise ValueError("visited vertices were not recorded; use SearchContext(record_visited=True)")
+        for v_id in self.visited:
+            graph.vertices[v_id].visited = True
+
+
+class SearchStats:
+    """
+    Opt-in counters and phase timings of Graph.dijkstra, Graph.a_star and tollway_algorithm_again
+    Searches look for a SearchStats only between phases, and given one they swap in counting versions
+    of their queue operations, so the loops of uninstrumented searches are unchanged
+    Counters add up over every search given the same object; peak_heap is the largest of any search
+    """
+
+    __slots__ = ['searches', 'settled', 'relaxed', 'pushes', 'updates', 'stale_pops', 'peak_heap', 'phases',
+                 'callback', '_clock']
+
+    def __init__(self, callback: Callable[[Dict[str, Any]], None] = None) -> None:
+        """
+        Instantiates zeroed SearchStats
+        :param callback: optional callable receiving as_dict() after every search, e.g. to feed a metrics pipeline
+        """
+        self.callback = callback
+        self.reset()
+
+    def __repr__(self) -> str:
+        """
+        :return: String representation of the stats for debugging
+        """
+        return f"SearchStats({self.as_dict()})"
+
+    __str__ = __repr__
+
+    def reset(self) -> None:
+        """
+        Zeroes every counter and timing
+        :return: None
+        """
+        self.searches = 0  # number of searches reported
+        self.settled = 0  # vertices (or coupon states) popped and finalized
+        self.relaxed = 0  # edges examined out of settled vertices
+        self.pushes = 0  # queue insertions
+        self.updates = 0  # PriorityQueue.update (decrease-key) calls
+        self.stale_pops = 0  # invalidated or superseded queue entries popped and skipped
+        self.peak_heap = 0  # most entries held by one search's queue, stale ones included (live ones for buckets)
+        self.phases = {}  # phase name -> wall seconds; 'setup', 'heuristic' (A* only), 'search' and 'path'
+        self._clock = 0.0
+
+    def as_dict(self) -> Dict[str, Any]:
+        """
+        :return: dict of every counter plus 'phase_seconds', a dict of the wall time spent in each phase
+        """
+        return {'searches': self.searches, 'settled': self.settled, 'relaxed': self.relaxed, 'pushes': self.pushes,
+                'updates': self.updates, 'stale_pops': self.stale_pops, 'peak_heap': self.peak_heap,
+                'phase_seconds': dict(self.phases)}
+
+    def snapshot(self) -> Tuple[Any, ...]:
+        """
+        :return: every counter and timing, to be handed back to restore
+        """
+        return (self.searches, self.settled, self.relaxed, self.pushes, self.updates, self.stale_pops,
+                self.peak_heap, dict(self.phases))
+
+    def restore(self, snapshot: Tuple[Any, ...]) -> None:
+        """
+        Rolls the counters and timings back to a snapshot, e.g. to forget a search that was abandoned and redone
+        :param snapshot: value returned by snapshot
+        :return: None
+        """
+        (self.searches, self.settled, self.relaxed, self.pushes, self.updates, self.stale_pops,
+         self.peak_heap, phases) = snapshot
+        self.phases = dict(phases)
+
+    def start(self) -> None:
+        """
+        Starts timing a search's first phase
+        :return: None
+        """
+        self._clock = time.perf_counter()
+
+    def lap(self, phase: str) -> None:
+        """
+        Charges the time since the last lap (or start) to phase
+        :param phase: name of the phase that just ended
+        :return: None
+        """
+        now = time.perf_counter()
+        self.phases[phase] = self.phases.get(phase, 0.0) + now - self._clock
+        self._clock = now
+
+    def watch(self, queue: PriorityQueue) -> CountingQueue:
+        """
+        :param queue: a PriorityQueue or BucketQueue
+        :return: queue wrapped so that its operations are counted into these stats
+        """
+        return CountingQueue(queue, self)
+
+    def heap_push(self, heap: List[Any], item: Any) -> None:
+        """
+        heapq.heappush that tracks the peak heap size, for searches on a bare heapq list
+        :param heap: heap list
+        :param item: entry to push
+        :return: None
+        """
+        heapq.heappush(heap, item)
+        if len(heap) > self.peak_heap:
+            self.peak_heap = len(heap)
+
+    def finish(self, settled: int, relaxed: int, stale_pops: int) -> None:
+        """
+        Adds one finished search's counts and reports them to the callback
+        :param settled: vertices settled by the search
+        :param relaxed: edges examined by the search
+        :param stale_pops: stale queue entries popped by the search
+        :return: None
+        """
+        self.searches += 1
+        self.settled += settled
+        self.relaxed += relaxed
+        self.stale_pops += stale_pops
+        if self.callback is not None:
+            self.callback(self.as_dict())
+
+    def reject(self) -> None:
+        """
+        Reports a search that ended in setup, e.g. because its target is unreachable
+        :return: None
+        """
+        self.lap('setup')
+        self.finish(0, 0, 0)
+
+
+class CountingQueue:
+    """
+    Wrapper counting the pushes, updates and pops of a PriorityQueue or BucketQueue into SearchStats
+    Stale entries are never seen by the caller, so they are counted once the search ends from the
+    number of entries pushed, popped and still held
+    """
+
+    __slots__ = ['queue', 'stats', 'locator', 'pushed', 'popped']
+
+    def __init__(self, queue: PriorityQueue, stats: SearchStats) -> None:
+        """
+        :param queue: the PriorityQueue or BucketQueue to wrap
+        :param stats: SearchStats to count into
+        """
+        self.queue = queue
+        self.stats = stats
+        self.locator = queue.locator  # searches test membership on the locator directly
+        self.pushed = 0  # entries added by push and update
+        self.popped = 0  # live entries returned by pop
+
+    def __repr__(self) -> str:
+        """
+        :return: String representation of the wrapped queue
+        """
+        return repr(self.queue)
+
+    __str__ = __repr__
+
+    def empty(self) -> bool:
+        """
+        :return: True if the wrapped queue holds no live entries
+        """
+        return self.queue.empty()
+
+    def push(self, priority: float, vertex: Vertex) -> None:
+        """
+        Pushes onto the wrapped queue, counting one push
+        :param priority: priority of the vertex
+        :param vertex: Vertex to queue
+        :return: None
+        """
+        self.queue.push(priority, vertex)
+        self.stats.pushes += 1
+        self._added()
+
+    def update(self, new_priority: float, vertex: Vertex) -> None:
+        """
+        Updates a queued vertex in the wrapped queue, counting one update
+        :param new_priority: new priority of the vertex
+        :param vertex: queued Vertex
+        :return: None
+        """
+        self.queue.update(new_priority, vertex)
+        self.stats.updates += 1
+        self._added()
+
+    def pop(self) -> Tuple[float, Vertex]:
+        """
+        Pops from the wrapped queue, counting one live pop
+        :return: tuple of the priority and the Vertex popped
+        """
+        self.popped += 1
+        return self.queue.pop()
+
+    def _added(self) -> None:
+        """
+        Counts one added entry and tracks the peak queue size
+        :return: None
+        """
+        self.pushed += 1
+        # a BucketQueue's stale entries take O(max_weight) to count, so its peak counts live entries only
+        held = len(self.queue.data) if isinstance(self.queue, PriorityQueue) else len(self.locator)
+        if held > self.stats.peak_heap:
+            self.stats.peak_heap = held
+
+    def held(self) -> int:
+        """
+        :return: entries held by the queue, stale ones included
+        """
+        if isinstance(self.queue, PriorityQueue):
+            return len(self.queue.data)
+        return sum(map(len, self.queue.buckets)) - self.queue.head  # the current bucket is drained from head
+
+    def stale_pops(self) -> int:
+        """
+        :return: stale entries popped and skipped so far
+        """
+        return self.pushed - self.popped - self.held()
+
+
+def euclidean_distances(x: np.ndarray, y: np.ndarray, target_x: float, target_y: float) -> np.ndarray:
+    """
+    Vectorized Vertex.euclidean_distance from every vertex to one target
+    May differ from Vertex.euclidean_distance in the last bit, since math.pow and NumPy square differently
+    :param x: x coordinates of the vertices
+    :param y: y coordinates of the vertices
+    :param target_x: x coordinate of the target
+    :param target_y: y coordinate of the target
+    :return: float array of distances
+    """
+    return np.sqrt((x - target_x) ** 2 + (y - target_y) ** 2)
+
+
+def taxicab_distances(x: np.ndarray, y: np.ndarray, target_x: float, target_y: float) -> np.ndarray:
+    """
+    Vectorized Vertex.taxicab_distance from every vertex to one target
+    :param x: x coordinates of the vertices
+    :param y: y coordinates of the vertices
+    :param target_x: x coordinate of the target
+    :param target_y: y coordinate of the target
+    :return: float array of distances
+    """
+    return np.abs(x - target_x) + np.abs(y - target_y)
+
+
+VECTORIZED_METRICS = {Vertex.euclidean_distance: euclidean_distances,
+                      Vertex.taxicab_distance: taxicab_distances}  # metric -> fn(x, y, target_x, target_y)
+
+
+def register_vectorized_metric(metric: Callable[[Vertex, Vertex], float],
+                               vectorized: Callable[[np.ndarray, np.ndarray, float, float], np.ndarray]) -> None:
+    """
+    Registers the vectorized form of an a_star metric, used whenever that metric is passed to a search
+    :param metric: a callable metric(vertex, target) -> float
+    :param vectorized: a callable vectorized(x, y, target_x, target_y) returning metric for every vertex as an array
+    :return: None
+    """
+    VECTORIZED_METRICS[metric] = vectorized
+
+
+def vectorized_metric(metric: Callable[[Vertex, Vertex], float]) -> Callable[..., np.ndarray]:
+    """
+    :param metric: a callable metric(vertex, target) -> float
+    :return: its registered vectorized form, or None
+    """
+    try:
+        return VECTORIZED_METRICS.get(metric)
+    except TypeError:  # unhashable metric objects cannot be registered
+        return None
+
+
+_CACHE_LOCK = threading.RLock()  # guards in-place growth of caches shared by concurrent searches
+
+BUCKET_QUEUE_MAX_WEIGHT = 256  # largest edge weight for which dijkstra picks a BucketQueue automatically
+
+
+def _profile_weight(profile: Tuple[int, int], weight: float, old: float = None) -> Tuple[int, int]:
+    """
+    Updates the weight profile of a graph (see Graph.integer_weight_bound) for one edge weight
+    :param profile: tuple of the largest non-negative integer weight and the number of other weights
+    :param weight: new weight of the edge
+    :param old: weight the edge replaces, or None for a new edge
+    :return: the updated profile
+    """
+    bound, irregular = profile
+    if old is not None and (old < 0 or (isinstance(old, float) and not old.is_integer())):
+        irregular -= 1
+    if weight < 0 or (isinstance(weight, float) and not weight.is_integer()):
+        return bound, irregular + 1
+    return max(bound, int(weight)), irregular
+
+EDGELIST_HEADER = ['begin', 'end', 'weight']
+
+COORDINATES_HEADER = ['id', 'x', 'y']
+
+
+def coordinates_path(filepath: str) -> str:
+    """
+    :param filepath: location of a matrix csv
+    :return: location of its coordinate sidecar, e.g. "graph.xy.csv" for "graph.csv"
+    """
+    root, extension = os.path.splitext(filepath)
+    return f"{root}.xy{extension or '.csv'}"
+
+
+def detect_graph_format(filepath: str) -> str:
+    """
+    Sniffs the format of a saved graph from its first bytes
+    :param filepath: location of the saved graph
+    :return: 'npz' for a NumPy archive, 'edgelist' for an edge-list csv, else 'matrix'
+    """
+    with open(filepath, 'rb') as graph_file:
+        head = graph_file.read(64)
+    if head.startswith(b'PK'):
+        return 'npz'
+    first_row = next(csv.reader([head.decode('utf-8', 'replace').splitlines()[0] if head else '']), [])
+    return 'edgelist' if first_row[:3] == EDGELIST_HEADER else 'matrix'
+
+
+class CSRGraph:
+    """
+    Frozen compressed sparse row (CSR) view of a Graph
+    Vertex ids are interned to integer indices in Graph insertion order; the outgoing edges of
+    vertex i are indices[indptr[i]:indptr[i + 1]] with matching weights, in Vertex.adj order
+    """
+
+    __slots__ = ['size', 'ids', 'index', 'order', 'indptr', 'indices', 'weights', 'x', 'y', '_predicate_masks',
+                 '_spatial_index']
+
+    def __init__(self, ids: List[str], indptr: np.ndarray, indices: np.ndarray, weights: np.ndarray,
+                 x: np.ndarray = None, y: np.ndarray = None, order: np.ndarray = None) -> None:
+        """
+        Instantiates a CSRGraph from already interned arrays
+        :param ids: vertex id strings; position i holds the id of vertex index i
+        :param indptr: int array of length V + 1 holding the edge offsets of every vertex
+        :param indices: int array of length E holding the destination index of every edge
+        :param weights: float array of length E holding the weight of every edge
+        :param x: optional float array of length V holding x coordinates (defaults to zeros)
+        :param y: optional float array of length V holding y coordinates (defaults to zeros)
+        :param order: optional argsort of ids; when given, ids stay an array and ids are found by
+                      binary search instead of through an id -> index dict (used by memory-mapped views)
+        """
+        self.size = len(ids)
+        if order is None:
+            self.ids = list(ids)
+            self.index = {v_id: i for i, v_id in enumerate(self.ids)}
+        else:
+            self.ids = ids
+            self.index = None
+        self.order = order
+        self._predicate_masks = PredicateMaskCache()
+        self._spatial_index = None  # SpatialIndex built on first use, see spatial_index
+        self.indptr = indptr
+        self.indices = indices
+        self.weights = weights
+        self.x = x if x is not None else np.zeros(self.size, dtype=np.float64)
+        self.y = y if y is not None else np.zeros(self.size, dtype=np.float64)
+
+    def __repr__(self) -> str:
+        """
+        :return: String representation of the CSR view for debugging
+        """
+        return f"CSRGraph(V={self.size}, E={len(self.indices)})"
+
+    __str__ = __repr__
+
+    @classmethod
+    def from_graph(cls, graph: Graph) -> CSRGraph:
+        """
+        Interns the vertex ids of a Graph and packs its adjacency maps into CSR arrays
+        :param graph: Graph to freeze
+        :return: CSRGraph view of graph
+        """
+        ids = list(graph.vertices)
+        index = {v_id: i for i, v_id in enumerate(ids)}
+        indptr = np.zeros(len(ids) + 1, dtype=np.int64)
+        indices, weights = [], []
+        for i, vertex in enumerate(graph.vertices.values()):
+            indices.extend(index[end_id] for end_id in vertex.adj)
+            weights.extend(vertex.adj.values())
+            indptr[i + 1] = len(indices)
+        x = np.fromiter((v.x for v in graph.vertices.values()), dtype=np.float64, count=len(ids))
+        y = np.fromiter((v.y for v in graph.vertices.values()), dtype=np.float64, count=len(ids))
+        return cls(ids, indptr, np.array(indices, dtype=np.int64),
+                   np.array(weights, dtype=np.float64), x, y)
+
+    def to_graph(self) -> Graph:
+        """
+        Thaws this CSR view back into a mutable Graph of Vertex objects
+        :return: Graph with the same vertices, edges and coordinates
+        """
+        graph = Graph()
+        graph.csr2graph(self)
+        return graph
+
+    def save(self, filepath: str) -> None:
+        """
+        Writes the CSR arrays to an uncompressed NumPy .npz archive
+        Members are stored uncompressed so the archive can also be memory-mapped by open
+        :param filepath: location to save the archive
+        :return: None
+        """
+        ids = np.array([str(v_id) for v_id in self.ids], dtype=str)
+        with open(filepath, 'wb') as npz:
+            np.savez(npz, ids=ids, indptr=self.indptr, indices=self.indices, weights=self.weights,
+                     x=self.x, y=self.y, order=np.argsort(ids, kind='stable'))
+
+    @classmethod
+    def open(cls, filepath: str) -> CSRGraph:
+        """
+        Memory-maps a CSRGraph previously written by save as a read-only view
+        No array is copied into the process: pages are loaded lazily and shared through the OS page
+        cache, so any number of worker processes opening the same file hold a single copy of the graph
+        :param filepath: location of the archive
+        :return: read-only CSRGraph backed by np.memmap arrays
+        """
+        arrays = {}
+        with open(filepath, 'rb') as npz, zipfile.ZipFile(npz) as archive:
+            for info in archive.infolist():
+                if info.compress_type != zipfile.ZIP_STORED:
+                    raise ValueError(f"cannot memory-map compressed member {info.filename!r} of {filepath}")
+                npz.seek(info.header_offset)
+                local_header = npz.read(30)  # fixed-size part of the zip local file header
+                name_len, extra_len = struct.unpack('<2H', local_header[26:30])
+                npz.seek(info.header_offset + 30 + name_len + extra_len)
+                version = np.lib.format.read_magic(npz)
+                if version == (1, 0):
+                    shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(npz)
+                else:
+                    shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(npz)
+                name = info.filename[:-4] if info.filename.endswith('.npy') else info.filename
+                if int(np.prod(shape)) == 0:
+                    arrays[name] = np.empty(shape, dtype=dtype)
+                else:
+                    arrays[name] = np.memmap(filepath, dtype=dtype, mode='r', offset=npz.tell(), shape=shape,
+                                             order='F' if fortran_order else 'C')
+        order = arrays['order'] if 'order' in arrays else np.argsort(arrays['ids'], kind='stable')
+        return cls(arrays['ids'], arrays['indptr'], arrays['indices'], arrays['weights'],
+                   arrays['x'], arrays['y'], order=order)
+
+    @classmethod
+    def load(cls, filepath: str) -> CSRGraph:
+        """
+        Reads a CSRGraph previously written by save
+        :param filepath: location of the archive
+        :return: CSRGraph
+        """
+        with np.load(filepath, allow_pickle=False) as data:
+            return cls(data['ids'].tolist(), data['indptr'], data['indices'], data['weights'],
+                       data['x'], data['y'])
+
+    def lookup(self, v_id: str) -> int:
+        """
+        Finds the integer index of a vertex id
+        :param v_id: unique string id of a vertex
+        :return: index of the vertex, or -1 if no such vertex exists
+        """
+        if self.index is not None:
+            return self.index.get(v_id, -1)
+        lo, hi = 0, self.size
+        while lo < hi:  # binary search over the sorted ids, touching O(log V) pages
+            mid = (lo + hi) // 2
+            if str(self.ids[self.order[mid]]) < v_id:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.size and str(self.ids[self.order[lo]]) == v_id:
+            return int(self.order[lo])
+        return -1
+
+    def build_path(self, pred: List[int], pred_edge: List[int], begin: int, end: int) -> Tuple[List[str], float]:
+        """
+        Reconstructs the path from begin to end out of predecessor indices, without any edge lookups
+        Summation order matches Graph.build_path, so both return identical distances
+        :param pred: list mapping vertex index to the index of its predecessor
+        :param pred_edge: list mapping vertex index to the CSR index of the edge it was reached by
+        :param begin: index of the starting vertex
+        :param end: index of the ending vertex
+        :return: Tuple of the list of vertex IDs from begin to end and the cost of this path
+        """
+        path, dist, curr = [str(self.ids[end])], 0, end
+        while curr != begin:
+            dist += float(self.weights[pred_edge[curr]])
+            curr = pred[curr]
+            path.append(str(self.ids[curr]))
+        return list(reversed(path)), dist
+
+    def _search(self, begin: int, end: int, heuristic: Callable[[int], float] = None) -> Tuple[List[str], float]:
+        """
+        Shared Dijkstra / A* search over integer indices
+        Ties are broken by push order exactly like PriorityQueue, so paths match the Graph searches
+        :param begin: index of the starting vertex
+        :param end: index of the ending vertex
+        :param heuristic: optional callable giving h(v) for a vertex index; None runs Dijkstra
+        :return: Tuple of the list of vertex IDs from begin to end and the cost of this path
+        """
+        dist = [math.inf] * self.size
+        pred, pred_edge = [-1] * self.size, [-1] * self.size
+        stamp = [-1] * self.size  # counter of the live heap entry of each vertex, -1 if none
+        indptr, indices, weights = self.indptr, self.indices, self.weights
+        counter = itertools.count()
+        dist[begin] = 0
+        stamp[begin] = next(counter)
+        heap = [(0, stamp[begin], begin)]
+
+        while heap:
+            priority, count, curr = heapq.heappop(heap)
+            if stamp[curr] != count:
+                continue  # superseded by a later push for the same vertex
+            stamp[curr] = -1
+            if curr == end:
+                return self.build_path(pred, pred_edge, begin, end)
+            lo, hi = int(indptr[curr]), int(indptr[curr + 1])
+            base = dist[curr]
+            for edge, adj, weight in zip(range(lo, hi), indices[lo:hi].tolist(), weights[lo:hi].tolist()):
+                new_cost = base + weight
+                if dist[adj] > new_cost:
+                    dist[adj] = new_cost
+                    pred[adj], pred_edge[adj] = curr, edge
+                    stamp[adj] = next(counter)
+                    key = new_cost if heuristic is None else new_cost + heuristic(adj)
+                    heapq.heappush(heap, (key, stamp[adj], adj))
+
+        return ([], 0)
+
+    def _search_indexed(self, begin: int, end: int,
+                        heuristic: Callable[[int], float] = None) -> Tuple[List[str], float]:
+        """
+        Same search as _search, driven by an IndexedHeap with in-place decrease-key instead of lazy deletion
+        :param begin: index of the starting vertex
+        :param end: index of the ending vertex
+        :param heuristic: optional callable giving h(v) for a vertex index; None runs Dijkstra
+        :return: Tuple of the list of vertex IDs from begin to end and the cost of this path
+        """
+        dist = [math.inf] * self.size
+        pred, pred_edge = [-1] * self.size, [-1] * self.size
+        indptr, indices, weights = self.indptr, self.indices, self.weights
+        queue = IndexedHeap(self.size)
+        dist[begin] = 0
+        queue.push(0, begin)
+
+        while not queue.empty():
+            priority, curr = queue.pop()
+            if curr == end:
+                return self.build_path(pred, pred_edge, begin, end)
+            lo, hi = int(indptr[curr]), int(indptr[curr + 1])
+            base = dist[curr]
+            for edge, adj, weight in zip(range(lo, hi), indices[lo:hi].tolist(), weights[lo:hi].tolist()):
+                new_cost = base + weight
+                if dist[adj] > new_cost:
+                    dist[adj] = new_cost
+                    pred[adj], pred_edge[adj] = curr, edge
+                    key = new_cost if heuristic is None else new_cost + heuristic(adj)
+                    if adj in queue:
+                        queue.update(key, adj)
+                    else:
+                        queue.push(key, adj)
+
+        return ([], 0)
+
+    def _run(self, begin: int, end: int, heuristic: Callable[[int], float], queue: str) -> Tuple[List[str], float]:
+        """
+        Dispatches a search to the kernel for the requested queue
+        :param begin: index of the starting vertex
+        :param end: index of the ending vertex
+        :param heuristic: optional callable giving h(v) for a vertex index; None runs Dijkstra
+        :param queue: 'lazy' for a heapq with lazy deletion, 'indexed' for an IndexedHeap
+        :return: Tuple of the list of vertex IDs from begin to end and the cost of this path
+        """
+        if queue == 'lazy':
+            return self._search(begin, end, heuristic)
+        if queue == 'indexed':
+            return self._search_indexed(begin, end, heuristic)
+        raise ValueError(f"unknown queue {queue!r}; expected 'lazy' or 'indexed'")
+
+    def dijkstra(self, begin_id: str, end_id: str, queue: str = 'lazy') -> Tuple[List[str], float]:
+        """
+        Searches the CSR view using Dijkstra's Algorithm
+        :param begin_id: a string representing the starting vertex of the search
+        :param end_id: a string representing the ending vertex of the search
+        :param queue: 'lazy' (heapq with lazy deletion) or 'indexed' (IndexedHeap with decrease-key)
+        :return: a tuple containing a list of strings (begin vertex --> end vertex) and a float representing
+                the weight of the path, or ([], 0) if no path exists
+        """
+        begin, end = self.lookup(begin_id), self.lookup(end_id)
+        if begin >= 0 and end >= 0:
+            return self._run(begin, end, None, queue)
+        return ([], 0)
+
+    def a_star(self, begin_id: str, end_id: str,
+               metric: Callable[[Vertex, Vertex], float], queue: str = 'lazy') -> Tuple[List[str], float]:
+        """
+        Searches the CSR view using A* algorithm
+        metric receives lightweight Vertex objects carrying each vertex's id and coordinates
+        :param begin_id: a string representing the starting vertex
+        :param end_id: a string representing the ending vertex
+        :param metric: a callable that will either compute the taxicab or euclidean distance
+        :param queue: 'lazy' (heapq with lazy deletion) or 'indexed' (IndexedHeap with decrease-key)
+        :return: A tuple containing a list of strings (the path begin_id to end_id) and a float (weight of path)
+        """
+        begin, end = self.lookup(begin_id), self.lookup(end_id)
+        if begin >= 0 and end >= 0:
+            table = self.heuristic_table(end_id, metric)
+            if table is not None:
+                return self._run(begin, end, table.__getitem__, queue)
+            target = self.vertex(end)
+            return self._run(begin, end, lambda i: metric(self.vertex(i), target), queue)
+        return ([], 0)
+
+    def spatial_index(self) -> SpatialIndex:
+        """
+        :return: grid index over the vertex coordinates, built once since the view is frozen
+        """
+        if self._spatial_index is None:
+            self._spatial_index = SpatialIndex(self.ids, self.x, self.y)
+        return self._spatial_index
+
+    def dijkstra_xy(self, begin: Tuple[float, float], end: Tuple[float, float],
+                    queue: str = 'lazy') -> Tuple[List[str], float]:
+        """
+        Runs dijkstra between the vertices nearest to two points, see Graph.dijkstra_xy
+        """
+        if not self.size:
+            return ([], 0)
+        index = self.spatial_index()
+        return self.dijkstra(index.nearest(*begin)[0][0], index.nearest(*end)[0][0], queue)
+
+    def a_star_xy(self, begin: Tuple[float, float], end: Tuple[float, float],
+                  metric: Callable[[Vertex, Vertex], float], queue: str = 'lazy') -> Tuple[List[str], float]:
+        """
+        Runs a_star between the vertices nearest to two points, see Graph.a_star_xy
+        """
+        if not self.size:
+            return ([], 0)
+        index = self.spatial_index()
+        return self.a_star(index.nearest(*begin)[0][0], index.nearest(*end)[0][0], metric, queue)
+
+    def heuristic_table(self, end_id: str, metric: Callable[[Vertex, Vertex], float]) -> List[float]:
+        """
+        Evaluates metric(vertex, end) for every vertex in one NumPy operation, if metric has a vectorized form
+        :param end_id: id of the target vertex
+        :param metric: a_star metric, e.g. Vertex.euclidean_distance
+        :return: list of heuristic values indexed by vertex index, or None if metric is not vectorized
+        """
+        vectorized = vectorized_metric(metric)
+        if vectorized is None:
+            return None
+        end = self.lookup(end_id)
+        return vectorized(self.x, self.y, self.x[end], self.y[end]).tolist()
+
+    def out_edges(self, v_id: str) -> List[Tuple[str, float]]:
+        """
+        Returns the outgoing edges of a vertex in Vertex.adj order
+        :param v_id: unique string id of a vertex in the graph
+        :return: list of (end_id, weight) tuples
+        """
+        i = self.lookup(v_id)
+        lo, hi = int(self.indptr[i]), int(self.indptr[i + 1])
+        return [(str(self.ids[j]), weight) for j, weight in zip(self.indices[lo:hi].tolist(),
+                                                                 self.weights[lo:hi].tolist())]
+
+    def predicate_mask(self, predicate: Callable[[str], bool]) -> PredicateMask:
+        """
+        Returns the per-vertex cache of a vertex id predicate, see Graph.predicate_mask
+        :param predicate: callable taking a vertex id
+        :return: PredicateMask for predicate
+        """
+        return self._predicate_masks.get(predicate, self.lookup)
+
+    def vertex_by_id(self, v_id: str) -> Vertex:
+        """
+        Builds a detached Vertex (id and coordinates only, no adjacency) for a vertex id
+        :param v_id: unique string id of a vertex in the graph
+        :return: Vertex object
+        """
+        return self.vertex(self.lookup(v_id))
+
+    def vertex(self, i: int) -> Vertex:
+        """
+        Builds a detached Vertex (id and coordinates only, no adjacency) for index i
+        :param i: vertex index
+        :return: Vertex object
+        """
+        return Vertex(str(self.ids[i]), float(self.x[i]), float(self.y[i]))
+
+
+class IndexedHeap:
+    """
+    Binary min-heap over integer vertex indices with in-place decrease-key
+    Every vertex holds at most one entry and pos tracks its slot, so update re-sifts the entry in
+    O(log V) instead of leaving a tombstone behind; entries are ordered by (priority, push order)
+    so ties are broken exactly like PriorityQueue
+    """
+
+    __slots__ = ['heap', 'key', 'pos', 'counter']
+
+    def __init__(self, capacity: int) -> None:
+        """
+        Construct an IndexedHeap for vertex indices 0 .. capacity - 1
+        :param capacity: number of vertices that may be stored
+        """
+        self.heap = []  # vertex indices in heap order
+        self.key = [None] * capacity  # (priority, count) of every queued vertex
+        self.pos = [-1] * capacity  # slot of every vertex in self.heap, -1 if not queued
+        self.counter = itertools.count()  # used to break ties in prioritization
+
+    def __repr__(self) -> str:
+        """
+        Represent IndexedHeap as a string
+        :return: string representation of IndexedHeap object
+        """
+        return ", ".join(f"[{self.key[v][0]}, {v}]" for v in self.heap)
+
+    __str__ = __repr__
+
+    def __len__(self) -> int:
+        """
+        :return: number of queued vertices
+        """
+        return len(self.heap)
+
+    def __contains__(self, v: int) -> bool:
+        """
+        :param v: vertex index
+        :return: True if v is currently queued
+        """
+        return self.pos[v] >= 0
+
+    def empty(self) -> bool:
+        """
+        Determine whether the heap is empty
+        :return: True if heap is empty, else False
+        """
+        return not self.heap
+
+    def push(self, priority: float, v: int) -> None:
+        """
+        Push a vertex index that is not yet queued with a given priority
+        :param priority: priority key upon which to order v
+        :param v: vertex index
+        :return: None
+        """
+        self.key[v] = (priority, next(self.counter))
+        self.heap.append(v)
+        self._sift_up(len(self.heap) - 1)
+
+    def pop(self) -> Tuple[float, int]:
+        """
+        Remove and return the (priority, vertex index) pair with lowest priority key
+        :return: (priority, v) tuple
+        """
+        heap, pos = self.heap, self.pos
+        top, last = heap[0], heap.pop()
+        pos[top] = -1
+        if heap:
+            heap[0] = last
+            self._sift_down(0)
+        return self.key[top][0], top
+
+    def update(self, new_priority: float, v: int) -> None:
+        """
+        Change the priority of a queued vertex index in place
+        :param new_priority: new priority on which to order v
+        :param v: vertex index
+        :return: None
+        """
+        old = self.key[v]
+        self.key[v] = (new_priority, next(self.counter))
+        if self.key[v] < old:
+            self._sift_up(self.pos[v])
+        else:
+            self._sift_down(self.pos[v])
+
+    def _sift_up(self, i: int) -> None:
+        """
+        Moves the entry at slot i towards the root until the heap property holds
+        :param i: slot in self.heap
+        :return: None
+        """
+        heap, key, pos = self.heap, self.key, self.pos
+        v = heap[i]
+        v_key = key[v]
+        while i > 0:
+            parent = (i - 1) >> 1
+            p = heap[parent]
+            if v_key >= key[p]:
+                break
+            heap[i] = p
+            pos[p] = i
+            i = parent
+        heap[i] = v
+        pos[v] = i
+
+    def _sift_down(self, i: int) -> None:
+        """
+        Moves the entry at slot i towards the leaves until the heap property holds
+        :param i: slot in self.heap
+        :return: None
+        """
+        heap, key, pos = self.heap, self.key, self.pos
+        n = len(heap)
+        v = heap[i]
+        v_key = key[v]
+        child = 2 * i + 1
+        while child < n:
+            if child + 1 < n and key[heap[child + 1]] < key[heap[child]]:
+                child += 1
+            c = heap[child]
+            if v_key <= key[c]:
+                break
+            heap[i] = c
+            pos[c] = i
+            i = child
+            child = 2 * i + 1
+        heap[i] = v
+        pos[v] = i
+
+
+class ShortestPathTree:
+    """
+    Settled state of a single-source Dijkstra search (see Graph.shortest_path_tree)
+    back_edges maps every settled vertex id to (predecessor id, distance, weight of the tree edge)
+    """
+
+    __slots__ = ['source', 'back_edges']
+
+    def __init__(self, source: str) -> None:
+        """
+        Instantiates an empty ShortestPathTree
+        :param source: id of the vertex the search started from
+        """
+        self.source = source
+        self.back_edges = {}
+
+    def __repr__(self) -> str:
+        """
+        :return: String representation of the tree for debugging
+        """
+        return f"ShortestPathTree(source={self.source!r}, settled={len(self.back_edges)})"
+
+    __str__ = __repr__
+
+    def __contains__(self, v_id: str) -> bool:
+        """
+        :param v_id: vertex id
+        :return: True if the shortest path to v_id is known
+        """
+        return v_id in self.back_edges
+
+    def distance(self, v_id: str) -> float:
+        """
+        Returns the shortest distance from the source to v_id
+        :param v_id: vertex id
+        :return: distance, or inf if v_id was not settled
+        """
+        return self.back_edges[v_id][1] if v_id in self.back_edges else math.inf
+
+    def path_to(self, end_id: str) -> Tuple[List[str], float]:
+        """
+        Extracts the shortest path from the source to end_id in O(path length)
+        Mirrors Graph.build_path (including its summation order), so the result equals dijkstra(source, end_id)
+        :param end_id: vertex id of the target
+        :return: Tuple of the list of vertex IDs from source to end_id and the cost of this path,
+                 or ([], 0) if end_id was not settled
+        """
+        if end_id not in self.back_edges:
+            return ([], 0)
+        path, dist = [end_id], 0
+        while path[-1] != self.source:
+            pred, _, weight = self.back_edges[path[-1]]
+            dist += weight
+            path.append(pred)
+        return list(reversed(path)), dist
+
+    def paths(self, targets: Iterable[str]) -> Dict[str, Tuple[List[str], float]]:
+        """
+        Extracts the shortest paths to several targets
+        :param targets: iterable of vertex ids
+        :return: dict mapping each target to its (path, distance) tuple
+        """
+        return {end_id: self.path_to(end_id) for end_id in targets}
+
+
+class DynamicShortestPathTree(ShortestPathTree):
+    """
+    Complete shortest-path tree of a Graph kept up to date under edge weight changes
+    (Ramalingam-Reps style): a decrease propagates only from the edge's head through the vertices it
+    improves, and an increase of a tree edge only re-settles the subtree hanging below it, seeded from
+    the incoming edges of the rest of the tree. Each update costs time in the affected region and its
+    edges rather than a search over the whole graph
+
+    Distances always equal those of a fresh search; where several shortest paths tie, the tree may
+    keep a different one than dijkstra would pick
+    """
+
+    __slots__ = ['graph', 'version', 'children', 'reverse']
+
+    def __init__(self, graph: Graph, source: str) -> None:
+        """
+        Builds the tree with one full Dijkstra search
+        :param graph: Graph to search and update
+        :param source: id of the vertex the tree is rooted at
+        """
+        super().__init__(source)
+        self.graph = graph
+        self.rebuild()
+
+    def __repr__(self) -> str:
+        """
+        :return: String representation of the tree for debugging
+        """
+        return f"DynamicShortestPathTree(source={self.source!r}, settled={len(self.back_edges)})"
+
+    __str__ = __repr__
+
+    def rebuild(self) -> None:
+        """
+        Recomputes the tree from scratch, e.g. after the graph was changed other than through set_weight
+        :return: None
+        """
+        self.back_edges = self.graph.shortest_path_tree(self.source).back_edges
+        self.version = self.graph.version
+        self.children = {}  # vertex id -> set of ids whose tree predecessor it is
+        for v_id, (pred, _, _) in self.back_edges.items():
+            if pred is not None:
+                self.children.setdefault(pred, set()).add(v_id)
+        self.reverse = {v_id: dict(preds) for v_id, preds in self.graph.reverse_adjacency().items()}
+
+    def set_weight(self, begin_id: str, end_id: str, weight: float) -> int:
+        """
+        Sets the weight of edge begin_id -> end_id in the graph (adding the edge and its vertices if
+        needed, like Graph.add_to_graph) and repairs the tree
+        :param begin_id: unique string id of starting vertex
+        :param end_id: unique string id of ending vertex
+        :param weight: new non-negative weight of the edge
+        :return: number of vertices whose tree entry was recomputed
+        """
+        if self.version != self.graph.version:
+            self.rebuild()
+        start = self.graph.vertices.get(begin_id)
+        old = start.adj.get(end_id) if start is not None else None
+        self.graph.add_to_graph(begin_id, end_id, weight)
+        self.version = self.graph.version
+        self.reverse.setdefault(begin_id, {})
+        self.reverse.setdefault(end_id, {})[begin_id] = weight
+        if old is None or weight < old:
+            return self._decrease(begin_id, end_id, weight)
+        if weight > old:
+            return self._increase(begin_id, end_id)
+        return 0
+
+    def _attach(self, v_id: str, pred: str, dist: float, weight: float) -> None:
+        """
+        Makes pred the tree predecessor of v_id
+        :param v_id: vertex id
+        :param pred: id of its new predecessor
+        :param dist: new distance of v_id
+        :param weight: weight of edge pred -> v_id
+        :return: None
+        """
+        if v_id in self.back_edges:
+            self.children[self.back_edges[v_id][0]].discard(v_id)
+        self.back_edges[v_id] = (pred, dist, weight)
+        self.children.setdefault(pred, set()).add(v_id)
+
+    def _decrease(self, begin_id: str, end_id: str, weight: float) -> int:
+        """
+        Propagates a cheaper (or new) edge begin_id -> end_id through the vertices it brings closer
+        :return: number of vertices whose tree entry changed
+        """
+        if begin_id not in self.back_edges or self.back_edges[begin_id][1] + weight >= self.distance(end_id):
+            return 0
+        counter = itertools.count()
+        best = {end_id: self.back_edges[begin_id][1] + weight}
+        heap = [(best[end_id], next(counter), end_id, begin_id, weight)]
+        done = set()
+        while heap:
+            dist, _, curr, pred, edge = heapq.heappop(heap)
+            if curr in done or dist > best[curr]:
+                continue  # superseded by a cheaper entry
+            done.add(curr)
+            self._attach(curr, pred, dist, edge)
+            for adj, w in self.graph.vertices[curr].adj.items():
+                if dist + w < min(self.distance(adj), best.get(adj, math.inf)):
+                    best[adj] = dist + w
+                    heapq.heappush(heap, (dist + w, next(counter), adj, curr, w))
+        return len(done)
+
+    def _increase(self, begin_id: str, end_id: str) -> int:
+        """
+        Re-settles the subtree below a tree edge begin_id -> end_id that became more expensive
+        :return: number of vertices in that subtree
+        """
+        if end_id not in self.back_edges or self.back_edges[end_id][0] != begin_id:
+            return 0  # not a tree edge, so no shortest path used it
+        affected, stack = set(), [end_id]
+        while stack:
+            curr = stack.pop()
+            affected.add(curr)
+            stack.extend(self.children.pop(curr, ()))
+        self.children[begin_id].discard(end_id)
+        for v_id in affected:
+            del self.back_edges[v_id]
+
+        counter = itertools.count()
+        best, heap = {}, []
+        for v_id in affected:  # best way into the subtree from the unaffected part of the tree
+            for pred, w in self.reverse[v_id].items():
+                if pred in self.back_edges and self.back_edges[pred][1] + w < best.get(v_id, math.inf):
+                    best[v_id] = self.back_edges[pred][1] + w
+                    heapq.heappush(heap, (best[v_id], next(counter), v_id, pred, w))
+        while heap:
+            dist, _, curr, pred, edge = heapq.heappop(heap)
+            if curr in self.back_edges or dist > best[curr]:
+                continue  # superseded by a cheaper entry
+            self._attach(curr, pred, dist, edge)
+            for adj, w in self.graph.vertices[curr].adj.items():
+                if adj in affected and adj not in self.back_edges and dist + w < best.get(adj, math.inf):
+                    best[adj] = dist + w
+                    heapq.heappush(heap, (dist + w, next(counter), adj, curr, w))
+        return len(affected)
+
+
+class AllPairsShortestPaths:
+    """
+    Distance and predecessor matrices of every pair of vertices (see Graph.all_pairs_shortest_paths)
+    dist[i, j] is the shortest distance from ids[i] to ids[j] (inf if unreachable) and pred[i, j] the
+    index of the vertex before ids[j] on that path (-1 if there is none)
+    """
+
+    __slots__ = ['ids', 'index', 'dist', 'pred', 'graph']
+
+    def __init__(self, graph: Graph) -> None:
+        """
+        Runs Floyd-Warshall over graph.weight_array(), relaxing through one pivot per NumPy pass:
+        dist[i, j] = min(dist[i, j], dist[i, k] + dist[k, j]) for all i, j at once
+        :param graph: Graph to compute the tables of
+        """
+        self.graph = graph
+        self.ids = list(graph.vertices)
+        self.index = {v_id: i for i, v_id in enumerate(self.ids)}
+        dist = graph.weight_array()
+        n = len(self.ids)
+        pred = np.where(np.isfinite(dist), np.arange(n)[:, None], -1)
+        np.fill_diagonal(dist, np.minimum(0, dist.diagonal()))
+        np.fill_diagonal(pred, -1)
+        via, better = np.empty_like(dist), np.empty(dist.shape, dtype=bool)
+        for k in range(n):
+            # row and column k cannot improve through k, so both can be updated in place
+            np.add(dist[:, k, None], dist[k], out=via)
+            np.less(via, dist, out=better)
+            np.copyto(dist, via, where=better)
+            np.copyto(pred, pred[k], where=better)
+        self.dist = dist
+        self.pred = pred
+
+    def __repr__(self) -> str:
+        """
+        :return: String representation of the tables for debugging
+        """
+        return f"AllPairsShortestPaths(vertices={len(self.ids)})"
+
+    __str__ = __repr__
+
+    def distance(self, begin_id: str, end_id: str) -> float:
+        """
+        :param begin_id: a string representing the starting vertex
+        :param end_id: a string representing the ending vertex
+        :return: the shortest distance from begin_id to end_id, or inf if there is no path
+        """
+        if begin_id not in self.index or end_id not in self.index:
+            return math.inf
+        return float(self.dist[self.index[begin_id], self.index[end_id]])
+
+    def path(self, begin_id: str, end_id: str) -> Tuple[List[str], float]:
+        """
+        Rebuilds the shortest path from the predecessor matrix in O(path length)
+        The cost is summed from the end over the graph's edge weights like Graph.build_path
+        :param begin_id: a string representing the starting vertex
+        :param end_id: a string representing the ending vertex
+        :return: a tuple containing the path from begin_id to end_id and its weight, or ([], 0)
+        """
+        if not math.isfinite(self.distance(begin_id, end_id)):
+            return ([], 0)
+        i, path, dist = self.index[begin_id], [self.index[end_id]], 0
+        while path[-1] != i:
+            path.append(int(self.pred[i, path[-1]]))
+            dist += self.graph.vertices[self.ids[path[-1]]].adj[self.ids[path[-2]]]
+        return [self.ids[j] for j in reversed(path)], dist
+
+
+class ReachabilityMatrix:
+    """
+    Binary relation over the vertices of a Graph stored as packed bitset rows
+    Vertices in one component share a row: rows[component[i]] holds bit j (bit j % 64 of word j // 64)
+    when vertex i is related to vertex j, so memory is O(components * V / 64) words
+    """
+
+    __slots__ = ['ids', 'index', 'component', 'rows', 'reflexive']
+
+    def __init__(self, ids: List[str], component: np.ndarray, rows: np.ndarray, reflexive: bool) -> None:
+        """
+        Instantiates a ReachabilityMatrix from its packed rows
+        :param ids: vertex ids in index order
+        :param component: int array mapping every vertex index to its row
+        :param rows: little-endian uint64 array of shape (components, ceil(V / 64))
+        :param reflexive: if true, every vertex is related to itself whatever its row says
+        """
+        self.ids = ids
+        self.index = {v_id: i for i, v_id in enumerate(ids)}
+        self.component = component
+        self.rows = rows
+        self.reflexive = reflexive
+
+    def __repr__(self) -> str:
+        """
+        :return: String representation of the relation for debugging
+        """
+        return f"ReachabilityMatrix(vertices={len(self.ids)}, rows={len(self.rows)})"
+
+    __str__ = __repr__
+
+    @staticmethod
+    def _member_bits(component: np.ndarray, count: int) -> np.ndarray:
+        """
+        :param component: int array mapping every vertex index to its component
+        :param count: number of components
+        :return: packed rows with the bits of every component's own vertices set
+        """
+        members = np.zeros((count, (len(component) + 63) // 64), dtype='<u8')
+        positions = np.arange(len(component))
+        np.bitwise_or.at(members, (component, positions >> 6),
+                         np.left_shift(np.uint64(1), (positions & 63).astype(np.uint64)))
+        return members
+
+    @classmethod
+    def closure(cls, graph: Graph, reflexive: bool = False) -> ReachabilityMatrix:
+        """
+        Computes the transitive closure over the condensation of graph: vertices of one strongly connected
+        component reach the same set, so each component's row is the OR of the rows of the components it
+        has edges into, filled in reverse topological order in one pass. Entering a successor also reaches
+        its own vertices; a cyclic successor's row already holds them and any other is a single vertex, so
+        only one bit per acyclic successor is set on top and no member rows are kept besides the result
+        :param graph: Graph to compute reachability of
+        :param reflexive: if true, every vertex is also related to itself
+        :return: ReachabilityMatrix
+        """
+        ids, index = list(graph.vertices), graph.vertex_index()
+        components = graph.strongly_connected_components()
+        component = np.empty(len(ids), dtype=np.int64)
+        for c, members in enumerate(components):
+            component[[index[v_id] for v_id in members]] = c
+        rows = np.zeros((len(components), (len(ids) + 63) // 64), dtype='<u8')
+        cyclic = []  # component -> whether its vertices reach each other (and so themselves)
+        for c, vertices in enumerate(components):
+            successors = {int(component[index[adj]]) for v_id in vertices for adj in graph.vertices[v_id].adj}
+            cyclic.append(len(vertices) > 1 or vertices[0] in graph.vertices[vertices[0]].adj)
+            successors.discard(c)
+            if successors:
+                rows[c] = np.bitwise_or.reduce(rows[list(successors)], axis=0)
+            bits = [index[components[d][0]] for d in successors if not cyclic[d]]
+            if cyclic[c]:
+                bits.extend(index[v_id] for v_id in vertices)
+            if bits:
+                bits = np.array(bits, dtype=np.uint64)
+                np.bitwise_or.at(rows[c], (bits >> np.uint64(6)).astype(np.int64),
+                                 np.left_shift(np.uint64(1), bits & np.uint64(63)))
+        return cls(ids, component, rows, reflexive)
+
+    @classmethod
+    def equivalence(cls, graph: Graph) -> ReachabilityMatrix:
+        """
+        Computes the smallest equivalence relation containing graph's edges with a union-find over
+        vertex indices; each row is the member set of one weakly connected component
+        :param graph: Graph to compute the relation of
+        :return: ReachabilityMatrix
+        """
+        ids, index = list(graph.vertices), graph.vertex_index()
+        parent = list(range(len(ids)))
+
+        def find(i: int) -> int:
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        for begin_id, vertex in graph.vertices.items():
+            for end_id in vertex.adj:
+                parent[find(index[begin_id])] = find(index[end_id])
+        roots = np.array([find(i) for i in range(len(ids))], dtype=np.int64)
+        _, component = np.unique(roots, return_inverse=True)
+        component = component.reshape(-1).astype(np.int64)
+        return cls(ids, component, cls._member_bits(component, int(component.max(initial=-1)) + 1), True)
+
+    def related(self, begin_id: str, end_id: str) -> bool:
+        """
+        :param begin_id: vertex id of the first element
+        :param end_id: vertex id of the second element
+        :return: True if begin_id is related to end_id (e.g. can reach it)
+        """
+        if begin_id not in self.index or end_id not in self.index:
+            return False
+        i, j = self.index[begin_id], self.index[end_id]
+        if self.reflexive and i == j:
+            return True
+        return bool(int(self.rows[self.component[i], j >> 6]) >> (j & 63) & 1)
+
+    def row(self, v_id: str) -> np.ndarray:
+        """
+        Unpacks the row of one vertex
+        :param v_id: vertex id
+        :return: boolean array whose position j tells whether v_id is related to ids[j]
+        """
+        i = self.index[v_id]
+        row = np.unpackbits(self.rows[self.component[i]].view(np.uint8), bitorder='little')[:len(self.ids)]
+        row = row.astype(bool)
+        if self.reflexive:
+            row[i] = True
+        return row
+
+    def to_matrix(self) -> Matrix:
+        """
+        Expands the relation into the adjacency matrix shape of Graph.graph2matrix (1 if related, else None)
+        :return: Matrix, or None if there are no vertices
+        """
+        matrix = [[None] + self.ids]
+        for v_id in self.ids:
+            matrix.append([v_id] + [1 if related else None for related in self.row(v_id)])
+        return matrix if self.ids else None
+
+    def to_csv(self, filepath: str) -> None:
+        """
+        Writes the relation as a matrix csv like Graph.graph2csv, one row at a time
+        :param filepath: location to save CSV
+        :return: None
+        """
+        if not self.ids:
+            return
+        with open(filepath, 'w+') as relation_csv:
+            writer = csv.writer(relation_csv, delimiter=',')
+            writer.writerow([None] + self.ids)
+            for v_id in self.ids:
+                writer.writerow([v_id] + [1 if related else None for related in self.row(v_id)])
+
+
+class Condensation:
+    """
+    Strongly connected components of a Graph and the DAG between them (see Graph.condensation)
+    Components are numbered in reverse topological order, so every edge leads from a component to
+    one with an equal or lower number and a query towards a higher-numbered component is impossible
+    """
+
+    __slots__ = ['components', 'component', 'dag', 'labels']
+
+    def __init__(self, graph: Graph) -> None:
+        """
+        Computes the components with Graph.strongly_connected_components, links them and labels the DAG
+        :param graph: Graph to condense
+        """
+        self.components = graph.strongly_connected_components()
+        self.component = {v_id: c for c, members in enumerate(self.components) for v_id in members}
+        self.dag = [set() for _ in self.components]  # component -> components it has edges into
+        for begin_id, vertex in graph.vertices.items():
+            c = self.component[begin_id]
+            for end_id in vertex.adj:
+                if self.component[end_id] != c:
+                    self.dag[c].add(self.component[end_id])
+        self.labels = [self._intervals(False), self._intervals(True)]  # (rank, low) of two DFS orders
+
+    def __repr__(self) -> str:
+        """
+        :return: String representation of the condensation for debugging
+        """
+        return f"Condensation(components={len(self.components)}, dag_edges={sum(map(len, self.dag))})"
+
+    __str__ = __repr__
+
+    def _intervals(self, descending: bool) -> Tuple[List[int], List[int]]:
+        """
+        Labels the DAG with one depth-first traversal: rank[c] is c's post-order position and low[c] the lowest
+        rank reachable from c, so a component reachable from c has its [low, rank] interval inside c's
+        :param descending: visit successors in descending instead of ascending order, for a second labelling
+        :return: tuple of the rank list and the low list, indexed by component
+        """
+        children = [sorted(successors, reverse=descending) for successors in self.dag]
+        rank, low = [-1] * len(children), [0] * len(children)
+        position = 0
+        for root in reversed(range(len(children))):  # sources carry the highest numbers
+            if rank[root] != -1:
+                continue
+            rank[root], stack = -2, [(root, 0)]  # -2 marks components entered but not yet finished
+            while stack:
+                c, i = stack[-1]
+                if i < len(children[c]):
+                    stack[-1] = (c, i + 1)
+                    if rank[children[c][i]] == -1:
+                        rank[children[c][i]] = -2
+                        stack.append((children[c][i], 0))
+                else:
+                    stack.pop()
+                    rank[c] = position
+                    low[c] = min([position] + [low[d] for d in children[c]])
+                    position += 1
+        return rank, low
+
+    def can_reach(self, begin_id: str, end_id: str) -> bool:
+        """
+        Decides in O(1) whether a path from begin_id to end_id can be ruled out
+        False proves there is none: end_id's component comes later in topological order, or its interval
+        is outside begin_id's in one of the labellings. True means no label rules a path out, which holds
+        for every reachable pair and most unreachable ones, so a search is still needed to be sure
+        :param begin_id: id of a vertex in the graph
+        :param end_id: id of a vertex in the graph
+        :return: False if end_id is certainly unreachable from begin_id
+        """
+        begin, end = self.component[begin_id], self.component[end_id]
+        if begin == end:
+            return True
+        if end > begin:
+            return False
+        return all(low[begin] <= low[end] and rank[end] < rank[begin] for rank, low in self.labels)
+
+
+class SpatialIndex:
+    """
+    Uniform grid of buckets over vertex coordinates, for snapping points to nearby vertices
+    The bounding box of the vertices is cut into square cells holding about bucket_size vertices on
+    average, so a query looks at the few cells around its point instead of at every vertex
+    """
+
+    __slots__ = ['ids', 'x', 'y', 'origin_x', 'origin_y', 'cell', 'columns', 'rows', 'order', 'buckets']
+
+    def __init__(self, ids: Iterable[str], x: np.ndarray, y: np.ndarray, bucket_size: int = 4) -> None:
+        """
+        Buckets every vertex by the grid cell its coordinates fall in
+        :param ids: vertex ids; position i holds the id of the vertex at (x[i], y[i])
+        :param x: float array of x coordinates
+        :param y: float array of y coordinates
+        :param bucket_size: average number of vertices per cell
+        """
+        self.ids = list(ids)
+        self.x, self.y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+        self.origin_x = self.origin_y = 0.0
+        self.cell, self.columns, self.rows = 1.0, 1, 1
+        self.order, self.buckets = np.zeros(0, dtype=np.int64), {}  # cell key -> (lo, hi) slice of order
+        if not self.ids:
+            return
+        self.origin_x, self.origin_y = float(self.x.min()), float(self.y.min())
+        width, height = float(self.x.max()) - self.origin_x, float(self.y.max()) - self.origin_y
+        cells = max(1, len(self.ids) // bucket_size)
+        # the second term keeps a long thin box from being cut into far more cells than vertices
+        self.cell = max(math.sqrt(width * height / cells), max(width, height) / cells) or 1.0
+        self.columns, self.rows = int(width // self.cell) + 1, int(height // self.cell) + 1
+        keys = self._column(self.x) * self.rows + self._row(self.y)
+        self.order = np.argsort(keys, kind='stable')
+        cell_keys, starts, counts = np.unique(keys[self.order], return_index=True, return_counts=True)
+        self.buckets = dict(zip(cell_keys.tolist(), zip(starts.tolist(), (starts + counts).tolist())))
+
+    def __repr__(self) -> str:
+        """
+        :return: String representation of the index for debugging
+        """
+        return f"SpatialIndex(V={len(self.ids)}, grid={self.columns}x{self.rows}, cell={self.cell:g})"
+
+    __str__ = __repr__
+
+    def __len__(self) -> int:
+        """
+        :return: number of indexed points
+        """
+        return len(self.ids)
+
+    def _column(self, x: np.ndarray) -> np.ndarray:
+        """
+        :param x: x coordinates
+        :return: grid column of every coordinate, clamped to the grid
+        """
+        return np.clip(np.floor_divide(x - self.origin_x, self.cell), 0, self.columns - 1).astype(np.int64)
+
+    def _row(self, y: np.ndarray) -> np.ndarray:
+        """
+        :param y: y coordinates
+        :return: grid row of every coordinate, clamped to the grid
+        """
+        return np.clip(np.floor_divide(y - self.origin_y, self.cell), 0, self.rows - 1).astype(np.int64)
+
+    def _gather(self, cells: Iterable[Tuple[int, int]]) -> np.ndarray:
+        """
+        :param cells: (column, row) pairs inside the grid
+        :return: positions of the vertices bucketed in those cells
+        """
+        slices = [self.buckets.get(column * self.rows + row) for column, row in cells]
+        return np.concatenate([self.order[lo:hi] for lo, hi in filter(None, slices)] or [self.order[:0]])
+
+    def _ranked(self, positions: np.ndarray, x: float, y: float) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        :param positions: vertex positions
+        :param x: x coordinate of the query point
+        :param y: y coordinate of the query point
+        :return: positions and their euclidean distances to (x, y), sorted by distance then position
+        """
+        distances = euclidean_distances(self.x[positions], self.y[positions], x, y)
+        ranking = np.lexsort((positions, distances))
+        return positions[ranking], distances[ranking]
+
+    def nearest(self, x: float, y: float, k: int = 1) -> List[Tuple[str, float]]:
+        """
+        Finds the k vertices closest to a point by euclidean distance, nearest first
+        Searches rings of cells outwards from the point's cell, and stops once no cell left unsearched
+        can hold a vertex closer than the k-th one found so far
+        :param x: x coordinate of the query point
+        :param y: y coordinate of the query point
+        :param k: number of vertices to return
+        :return: list of (vertex id, distance) tuples, shorter than k only if the index is smaller
+        """
+        k = min(k, len(self.ids))
+        if k <= 0:
+            return []
+        column, row = int(self._column(np.float64(x))), int(self._row(np.float64(y)))
+        found, count, radius = [], 0, 0
+        while True:
+            ring = [(c, r) for c in range(column - radius, column + radius + 1)
+                    for r in {row - radius, row + radius}]
+            ring += [(c, r) for c in {column - radius, column + radius} for r in range(row - radius + 1, row + radius)]
+            positions = self._gather((c, r) for c, r in ring if 0 <= c < self.columns and 0 <= r < self.rows)
+            if len(positions):
+                found.append(positions)
+                count += len(positions)
+            # distance from the point to the searched square's sides, on the sides where the grid goes on
+            low_x, low_y = self.origin_x + (column - radius) * self.cell, self.origin_y + (row - radius) * self.cell
+            high_x, high_y = low_x + (2 * radius + 1) * self.cell, low_y + (2 * radius + 1) * self.cell
+            margins = [margin for margin, more in ((x - low_x, column - radius > 0),
+                                                   (high_x - x, column + radius < self.columns - 1),
+                                                   (y - low_y, row - radius > 0),
+                                                   (high_y - y, row + radius < self.rows - 1)) if more]
+            if not margins:
+                break
+            if count >= k:
+                found = [np.concatenate(found)]
+                distances = euclidean_distances(self.x[found[0]], self.y[found[0]], x, y)
+                if np.partition(distances, k - 1)[k - 1] <= min(margins):
+                    break
+            radius += 1
+        positions, distances = self._ranked(np.concatenate(found), x, y)
+        return list(zip([self.ids[p] for p in positions[:k].tolist()], distances[:k].tolist()))
+
+    def within(self, x: float, y: float, radius: float) -> List[Tuple[str, float]]:
+        """
+        Finds every vertex within a euclidean distance of a point, nearest first
+        :param x: x coordinate of the query point
+        :param y: y coordinate of the query point
+        :param radius: largest distance to include
+        :return: list of (vertex id, distance) tuples
+        """
+        if radius < 0 or not self.ids:
+            return []
+        low_column, low_row = int(self._column(np.float64(x - radius))), int(self._row(np.float64(y - radius)))
+        high_column, high_row = int(self._column(np.float64(x + radius))), int(self._row(np.float64(y + radius)))
+        if (high_column - low_column + 1) * (high_row - low_row + 1) > len(self.buckets):
+            positions = self.order  # the circle covers more cells than are occupied, so test every vertex
+        else:
+            positions = self._gather(itertools.product(range(low_column, high_column + 1),
+                                                       range(low_row, high_row + 1)))
+        positions, distances = self._ranked(positions, x, y)
+        inside = distances <= radius
+        return list(zip([self.ids[p] for p in positions[inside].tolist()], distances[inside].tolist()))
+
+
+class ContractionHierarchy:
+    """
+    Contraction hierarchy (CH) over a static Graph for fast point-to-point shortest path queries
+    Vertices are contracted one at a time in order of increasing importance; each contraction adds
+    shortcut edges between the remaining neighbors unless a witness path is at least as short, so a
+    query only has to search upward in rank from both ends and meets near the top of the hierarchy
+    """
+
+    __slots__ = ['ids', 'index', 'rank', 'up_out', 'up_in', 'edges']
+
+    def __init__(self, ids: List[str], rank: List[int],
+                 up_out: List[List[Tuple[int, float, int]]], up_in: List[List[Tuple[int, float, int]]]) -> None:
+        """
+        Instantiates a ContractionHierarchy from its upward edges
+        :param ids: vertex id strings; position i holds the id of vertex index i
+        :param rank: contraction order of every vertex index (higher is more important)
+        :param up_out: up_out[v] lists (x, weight, middle) for every edge v -> x with rank[x] > rank[v]
+        :param up_in: up_in[v] lists (u, weight, middle) for every edge u -> v with rank[u] > rank[v]
+                      middle is the contracted vertex a shortcut bypasses, or -1 for an original edge
+        """
+        self.ids = list(ids)
+        self.index = {v_id: i for i, v_id in enumerate(self.ids)}
+        self.rank = list(rank)
+        self.up_out = up_out
+        self.up_in = up_in
+        self.edges = {}  # (begin, end) -> (weight, middle) for every edge of the hierarchy, used to unpack
+        for v, out in enumerate(up_out):
+            for x, weight, middle in out:
+                self.edges[(v, x)] = (weight, middle)
+        for v, incoming in enumerate(up_in):
+            for u, weight, middle in incoming:
+                self.edges[(u, v)] = (weight, middle)
+
+    def __repr__(self) -> str:
+        """
+        :return: String representation of the hierarchy for debugging
+        """
+        shortcuts = sum(1 for _, middle in self.edges.values() if middle >= 0)
+        return f"ContractionHierarchy(V={len(self.ids)}, E={len(self.edges)}, shortcuts={shortcuts})"
+
+    __str__ = __repr__
+
+    @classmethod
+    def build(cls, graph: Graph, witness_limit: int = 500) -> ContractionHierarchy:
+        """
+        Preprocesses a Graph into a contraction hierarchy
+        Vertices are ordered lazily by edge difference (shortcuts added minus edges removed) plus the
+        number of already contracted neighbors, which keeps the hierarchy sparse and balanced
+        :param graph: Graph to preprocess; later changes to the graph are not reflected
+        :param witness_limit: maximum vertices settled by each witness search; lower values build faster
+                              but may add unnecessary (still correct) shortcuts
+        :return: ContractionHierarchy
+        """
+        ids = list(graph.vertices)
+        index = {v_id: i for i, v_id in enumerate(ids)}
+        n = len(ids)
+        out_adj, in_adj = [{} for _ in range(n)], [{} for _ in range(n)]
+        middle = {}  # (begin, end) -> middle vertex of every edge in the remaining graph
+        for begin_id, vertex in graph.vertices.items():
+            u = index[begin_id]
+            for end_id, weight in vertex.adj.items():
+                x = index[end_id]
+                if u != x:
+                    out_adj[u][x], in_adj[x][u], middle[(u, x)] = weight, weight, -1
+
+        def shortcuts(v: int) -> List[Tuple[int, int, float]]:
+            found = []
+            for u, w_in in in_adj[v].items():
+                targets = {x: w_in + w_out for x, w_out in out_adj[v].items() if x != u}
+                if targets:
+                    witness = cls._witness_search(out_adj, u, v, targets, witness_limit)
+                    found.extend((u, x, cost) for x, cost in targets.items() if witness.get(x, math.inf) > cost)
+            return found
+
+        contracted_neighbors = [0] * n
+        rank = [0] * n
+        up_out, up_in = [[] for _ in range(n)], [[] for _ in range(n)]
+        heap = [(len(shortcuts(v)) - len(in_adj[v]) - len(out_adj[v]), v) for v in range(n)]
+        heapq.heapify(heap)
+        for next_rank in range(n):
+            while True:  # lazy updates: re-evaluate the cheapest vertex until it stays the cheapest
+                _, v = heapq.heappop(heap)
+                added = shortcuts(v)
+                priority = len(added) - len(in_adj[v]) - len(out_adj[v]) + contracted_neighbors[v]
+                if not heap or priority <= heap[0][0]:
+                    break
+                heapq.heappush(heap, (priority, v))
+
+            for u, x, cost in added:
+                if cost < out_adj[u].get(x, math.inf):
+                    out_adj[u][x], in_adj[x][u], middle[(u, x)] = cost, cost, v
+            rank[v] = next_rank
+            for x, weight in out_adj[v].items():
+                up_out[v].append((x, weight, middle[(v, x)]))
+                del in_adj[x][v]
+                contracted_neighbors[x] += 1
+            for u, weight in in_adj[v].items():
+                up_in[v].append((u, weight, middle[(u, v)]))
+                del out_adj[u][v]
+                contracted_neighbors[u] += 1
+            out_adj[v], in_adj[v] = {}, {}
+
+        return cls(ids, rank, up_out, up_in)
+
+    @staticmethod
+    def _witness_search(out_adj: List[Dict[int, float]], source: int, avoid: int,
+                        targets: Dict[int, float], limit: int) -> Dict[int, float]:
+        """
+        Bounded Dijkstra from source that never passes through avoid
+        :param out_adj: outgoing edges of the remaining (not yet contracted) graph
+        :param source: vertex index to search from
+        :param avoid: vertex index being contracted
+        :param targets: dict mapping target index to the cost of the path through avoid
+        :param limit: maximum number of vertices to settle
+        :return: dict of tentative distances from source; a target absent or farther than its cost needs a shortcut
+        """
+        bound = max(targets.values())
+        dist, settled, remaining = {source: 0}, set(), len(targets)
+        heap = [(0, source)]
+        while heap and len(settled) < limit:
+            d, curr = heapq.heappop(heap)
+            if curr in settled:
+                continue
+            if d > bound:
+                break
+            settled.add(curr)
+            if curr in targets:
+                remaining -= 1
+                if remaining == 0:
+                    break
+            for adj, weight in out_adj[curr].items():
+                if adj != avoid and d + weight < dist.get(adj, math.inf):
+                    dist[adj] = d + weight
+                    heapq.heappush(heap, (d + weight, adj))
+        return dist
+
+    def query(self, begin_id: str, end_id: str) -> Tuple[List[str], float]:
+        """
+        Answers a shortest path query with an upward bidirectional search and unpacks its shortcuts
+        Returns a shortest path like Graph.dijkstra; when several paths tie, the one returned may differ
+        :param begin_id: a string representing the starting vertex
+        :param end_id: a string representing the ending vertex
+        :return: a tuple containing a list of strings (begin vertex --> end vertex) and a float representing
+                the weight of the path, or ([], 0) if no path exists
+        """
+        if begin_id not in self.index or end_id not in self.index:
+            return ([], 0)
+        begin, end = self.index[begin_id], self.index[end_id]
+        if begin == end:
+            return ([begin_id], 0)
+
+        dist = ({begin: 0}, {end: 0})
+        pred = ({begin: -1}, {end: -1})
+        settled = (set(), set())
+        heaps = ([(0, begin)], [(0, end)])
+        upward = (self.up_out, self.up_in)
+        best, meet = math.inf, -1
+        while (heaps[0] and heaps[0][0][0] < best) or (heaps[1] and heaps[1][0][0] < best):
+            side = 0 if heaps[0] and (not heaps[1] or heaps[0][0][0] <= heaps[1][0][0]) else 1
+            d, curr = heapq.heappop(heaps[side])
+            if curr in settled[side] or d >= best:
+                continue
+            settled[side].add(curr)
+            if curr in dist[1 - side] and d + dist[1 - side][curr] < best:
+                best, meet = d + dist[1 - side][curr], curr
+            here = dist[side]
+            for adj, weight, _ in upward[side][curr]:
+                if d + weight < here.get(adj, math.inf):
+                    here[adj] = d + weight
+                    pred[side][adj] = curr
+                    heapq.heappush(heaps[side], (d + weight, adj))
+
+        if meet < 0:
+            return ([], 0)
+        hops = []  # hierarchy edges along the path, in travel order
+        curr = meet
+        while pred[0][curr] >= 0:
+            hops.append((pred[0][curr], curr))
+            curr = pred[0][curr]
+        hops.reverse()
+        curr = meet
+        while pred[1][curr] >= 0:
+            hops.append((curr, pred[1][curr]))
+            curr = pred[1][curr]
+
+        path, weights = [begin_id], []
+        for u, x in hops:
+            for v, weight in self._unpack(u, x):
+                path.append(self.ids[v])
+                weights.append(weight)
+        dist = 0
+        for weight in reversed(weights):  # summed from the end, like Graph.build_path
+            dist += weight
+        return path, dist
+
+    def _unpack(self, begin: int, end: int) -> List[Tuple[int, float]]:
+        """
+        Expands a hierarchy edge into the original edges it stands for
+        :param begin: index of the edge's starting vertex
+        :param end: index of the edge's ending vertex
+        :return: list of (vertex index, weight of the original edge into it) after begin, ending with end
+        """
+        unpacked, stack = [], [(begin, end)]
+        while stack:
+            u, x = stack.pop()
+            weight, middle = self.edges[(u, x)]
+            if middle < 0:
+                unpacked.append((x, weight))
+            else:
+                stack.append((middle, x))
+                stack.append((u, middle))
+        return unpacked
+
+    def save(self, filepath: str) -> None:
+        """
+        Writes the hierarchy to an uncompressed NumPy .npz archive
+        :param filepath: location to save the archive
+        :return: None
+        """
+        arrays = {'ids': np.array(self.ids, dtype=str), 'rank': np.array(self.rank, dtype=np.int64)}
+        for name, upward in (('up_out', self.up_out), ('up_in', self.up_in)):
+            flat = [edge for edges in upward for edge in edges]
+            arrays[f'{name}_indptr'] = np.cumsum([0] + [len(edges) for edges in upward], dtype=np.int64)
+            arrays[f'{name}_adj'] = np.array([edge[0] for edge in flat], dtype=np.int64)
+            arrays[f'{name}_weights'] = np.array([edge[1] for edge in flat], dtype=np.float64)
+            arrays[f'{name}_middle'] = np.array([edge[2] for edge in flat], dtype=np.int64)
+        with open(filepath, 'wb') as npz:
+            np.savez(npz, **arrays)
+
+    @classmethod
+    def load(cls, filepath: str) -> ContractionHierarchy:
+        """
+        Reads a ContractionHierarchy previously written by save
+        :param filepath: location of the archive
+        :return: ContractionHierarchy
+        """
+        with np.load(filepath, allow_pickle=False) as data:
+            upward = []
+            for name in ('up_out', 'up_in'):
+                indptr = data[f'{name}_indptr'].tolist()
+                flat = list(zip(data[f'{name}_adj'].tolist(), data[f'{name}_weights'].tolist(),
+                                data[f'{name}_middle'].tolist()))
+                upward.append([flat[indptr[v]:indptr[v + 1]] for v in range(len(indptr) - 1)])
+            return cls(data['ids'].tolist(), data['rank'].tolist(), upward[0], upward[1])
+
+
+def dijkstra_distances(adjacency: Dict[str, Dict[str, float]], source: str) -> Dict[str, float]:
+    """
+    Computes shortest distances from source to every reachable vertex of an adjacency map
+    :param adjacency: dict mapping vertex id to {neighbor id: weight}, e.g. Graph.reverse_adjacency()
+    :param source: vertex id to search from
+    :return: dict mapping every reachable vertex id to its distance from source
+    """
+    dist, heap = {}, [(0, source)]
+    while heap:
+        d, curr = heapq.heappop(heap)
+        if curr in dist:
+            continue
+        dist[curr] = d
+        for adj, weight in adjacency[curr].items():
+            if adj not in dist:
+                heapq.heappush(heap, (d + weight, adj))
+    return dist
+
+
+class Landmarks:
+    """
+    ALT (A*, landmarks, triangle inequality) heuristic for a_star and tollway_algorithm_again
+    For every landmark L the triangle inequality gives d(v, t) >= d(L, t) - d(L, v) and
+    d(v, t) >= d(v, L) - d(t, L); the heuristic is the largest of these bounds over all landmarks,
+    so it needs no coordinates and follows the edge weights (tolls) rather than geometry
+    Bounds hold for the weights at preprocessing time, so they are not admissible for discounted costs
+    """
+
+    __slots__ = ['ids', 'index', 'landmarks', 'forward', 'backward']
+
+    def __init__(self, graph: Graph, count: int = 4, landmarks: List[str] = None) -> None:
+        """
+        Picks landmarks and computes their distance tables
+        :param graph: Graph to preprocess; later changes to the graph are not reflected
+        :param count: number of landmarks to pick by farthest selection (ignored if landmarks is given)
+        :param landmarks: optional explicit list of landmark vertex ids
+        """
+        self.ids = list(graph.vertices)
+        self.index = {v_id: i for i, v_id in enumerate(self.ids)}
+        adjacency = {v_id: v.adj for v_id, v in graph.vertices.items()}
+        reverse = graph.reverse_adjacency()
+        n = len(self.ids)
+
+        forward, backward, chosen = [], [], []
+        separation = np.full(n, np.inf)  # smallest round trip distance from any chosen landmark
+        candidates = list(landmarks) if landmarks is not None else [None] * min(count, n)
+        for landmark in candidates:
+            if landmark is None:
+                # farthest selection: the vertex least covered by the landmarks chosen so far
+                landmark = self.ids[int(np.argmax(separation))] if chosen else self.ids[0]
+            chosen.append(landmark)
+            forward.append(self._table(dijkstra_distances(adjacency, landmark)))
+            backward.append(self._table(dijkstra_distances(reverse, landmark)))
+            round_trip = np.where(np.isfinite(forward[-1] + backward[-1]), forward[-1] + backward[-1], -1)
+            separation = np.minimum(separation, round_trip)
+            separation[self.index[landmark]] = -np.inf
+
+        self.landmarks = chosen
+        self.forward = np.array(forward).T.copy() if chosen else np.zeros((n, 0))  # forward[v, k] = d(L_k, v)
+        self.backward = np.array(backward).T.copy() if chosen else np.zeros((n, 0))  # backward[v, k] = d(v, L_k)
+
+    def __repr__(self) -> str:
+        """
+        :return: String representation of the landmarks for debugging
+        """
+        return f"Landmarks({self.landmarks})"
+
+    __str__ = __repr__
+
+    def _table(self, dist: Dict[str, float]) -> np.ndarray:
+        """
+        :param dist: dict of distances keyed by vertex id
+        :return: array of distances in vertex index order, inf where unreachable
+        """
+        table = np.full(len(self.ids), np.inf)
+        for v_id, d in dist.items():
+            table[self.index[v_id]] = d
+        return table
+
+    def bound(self, v_id: str, t_id: str) -> float:
+        """
+        Computes the landmark lower bound on the distance from v_id to t_id
+        :param v_id: vertex id
+        :param t_id: target vertex id
+        :return: lower bound (inf when a landmark proves t_id unreachable from v_id, 0 for unknown ids)
+        """
+        v, t = self.index.get(v_id), self.index.get(t_id)
+        if v is None or t is None or not self.landmarks:
+            return 0
+        with np.errstate(invalid='ignore'):
+            bounds = np.concatenate((self.forward[t] - self.forward[v], self.backward[v] - self.backward[t]))
+        return max(0.0, float(np.fmax.reduce(bounds)))
+
+    def __call__(self, vertex: Vertex, target: Vertex) -> float:
+        """
+        Metric interface for a_star: lower bound on the distance from vertex to target
+        :param vertex: Vertex to estimate from
+        :param target: Vertex the search is heading to
+        :return: lower bound on the distance
+        """
+        return self.bound(vertex.id, target.id)
+
+
+class PredicateMask:
+    """
+    Per-vertex cache of a predicate on vertex ids
+    Results live in a tri-state int8 array indexed by vertex index (-1 not evaluated yet, 0 false,
+    1 true), so the predicate runs at most once per vertex and only for vertices actually asked about
+    """
+
+    __slots__ = ['predicate', 'index_of', 'values', 'evaluations']
+
+    def __init__(self, predicate: Callable[[str], bool], index_of: Callable[[str], int]) -> None:
+        """
+        Instantiates an empty PredicateMask
+        :param predicate: callable taking a vertex id; held weakly when possible so that
+                          PredicateMaskCache entries can expire with their predicate
+        :param index_of: callable mapping a vertex id to its integer index
+        """
+        try:
+            self.predicate = weakref.ref(predicate)
+        except TypeError:
+            self.predicate = lambda: predicate
+        self.index_of = index_of
+        self.values = np.full(16, -1, dtype=np.int8)
+        self.evaluations = 0  # number of times predicate has been called
+
+    def __repr__(self) -> str:
+        """
+        :return: String representation of the mask for debugging
+        """
+        return f"PredicateMask({self.predicate()!r}, evaluated={self.evaluations})"
+
+    __str__ = __repr__
+
+    def __call__(self, v_id: str) -> bool:
+        """
+        Evaluates the predicate for a vertex id, consulting the mask first
+        :param v_id: unique string id of a vertex
+        :return: predicate(v_id)
+        """
+        i = self.index_of(v_id)
+        if i >= len(self.values):
+            with _CACHE_LOCK:
+                if i >= len(self.values):
+                    grown = np.full(max(2 * len(self.values), i + 1), -1, dtype=np.int8)
+                    grown[:len(self.values)] = self.values
+                    self.values = grown
+        value = self.values[i]
+        if value < 0:
+            value = self.values[i] = 1 if self.predicate()(v_id) else 0
+            self.evaluations += 1
+        return value == 1
+
+    def evaluate(self, ids: Iterable[str]) -> np.ndarray:
+        """
+        Evaluates the predicate for every vertex id not evaluated yet
+        :param ids: vertex ids in index order
+        :return: boolean array holding the predicate for every vertex index
+        """
+        return np.array([self(v_id) for v_id in ids], dtype=bool)
+
+
+class PredicateMaskCache:
+    """
+    PredicateMask store keyed by predicate identity
+    Entries are dropped once their predicate is garbage collected; predicates that cannot be weakly
+    referenced (e.g. some builtins) are cached with a strong reference instead
+    """
+
+    __slots__ = ['weak', 'strong']
+
+    def __init__(self) -> None:
+        """
+        Instantiates an empty PredicateMaskCache
+        """
+        self.weak = weakref.WeakKeyDictionary()
+        self.strong = {}
+
+    def __reduce__(self) -> Tuple[type, tuple]:
+        """
+        Masks are not pickled; a copied graph (e.g. one shipped to a worker process) starts with an empty cache
+        :return: reconstruction tuple for pickle
+        """
+        return PredicateMaskCache, ()
+
+    def get(self, predicate: Callable[[str], bool], index_of: Callable[[str], int]) -> PredicateMask:
+        """
+        Returns the mask of predicate, creating it on first use
+        :param predicate: callable taking a vertex id
+        :param index_of: callable mapping a vertex id to its integer index
+        :return: PredicateMask
+        """
+        with _CACHE_LOCK:
+            try:
+                store = self.weak
+                mask = store.get(predicate)
+            except TypeError:
+                store = self.strong
+                mask = store.get(predicate)
+            if mask is None:
+                mask = store[predicate] = PredicateMask(predicate, index_of)
+        return mask
+
+
+ROUTE_BATCH_ALGORITHMS = ('dijkstra', 'a_star', 'coupon')
+
+_ROUTE_BATCH_STATE = None  # (graph, algorithm, metric, coupon) of a route_batch worker process
+
+
+def route_batch(graph: Graph, queries: Iterable[Tuple[str, str]], algorithm: str = 'dijkstra',
+                metric: Callable[[Vertex, Vertex], float] = None, coupon: Tuple[Callable[[str], bool], float] = None,
+                workers: int = None, ordered: bool = True, chunk_size: int = 256) -> Iterator[Any]:
+    """
+    Answers many route queries, optionally across a pool of worker processes
+    Queries are grouped by source so that dijkstra queries from one source share a single
+    shortest-path tree; groups are packed into chunks of about chunk_size queries. The graph,
+    metric and coupon are sent to each worker once, when the worker starts, rather than with every
+    chunk (with the 'fork' start method they are inherited without pickling at all; otherwise they
+    must be picklable, so module-level functions rather than lambdas)
+
+    :param graph: graph to be searched (a Graph or a CSRGraph)
+    :param queries: iterable of (begin_id, end_id) tuples
+    :param algorithm: 'dijkstra', 'a_star' (needs metric) or 'coupon' (tollway_algorithm_again,
+                      needs metric and coupon)
+    :param metric: a callable that returns the taxicab or euclidean distance from one vertex to another
+    :param coupon: a tuple containing the coupon predicate on vertex ids and the cost multiplier
+    :param workers: number of worker processes, None for os.cpu_count(); 0 or 1 answers in this process
+    :param ordered: if true, yield results in query order; else yield (position, result) pairs as chunks complete
+    :param chunk_size: target number of queries sent to a worker at a time
+    :return: iterator over (path, distance) results, or (position, (path, distance)) pairs if not ordered
+    """
+    check_route_algorithm(algorithm, metric, coupon)
+
+    groups = {}  # begin_id -> [(position, end_id)]
+    for position, (begin_id, end_id) in enumerate(queries):
+        groups.setdefault(begin_id, []).append((position, end_id))
+    chunks, chunk, count = [], [], 0
+    for begin_id, targets in groups.items():
+        chunk.append((begin_id, targets))
+        count += len(targets)
+        if count >= chunk_size:
+            chunks.append(chunk)
+            chunk, count = [], 0
+    if chunk:
+        chunks.append(chunk)
+
+    workers = os.cpu_count() if workers is None else workers
+    if workers <= 1:
+        state = (graph, algorithm, metric, coupon)
+        completed = (_route_chunk(state, chunk) for chunk in chunks)
+    else:
+        completed = _route_pool(chunks, workers, (graph, algorithm, metric, coupon))
+
+    if not ordered:
+        for results in completed:
+            yield from results
+        return
+    pending, position = {}, 0
+    for results in completed:
+        pending.update(results)
+        while position in pending:
+            yield pending.pop(position)
+            position += 1
+
+
+def _route_pool(chunks: List[List[Tuple[str, List[Tuple[int, str]]]]], workers: int,
+                state: Tuple[Graph, str, Any, Any]) -> Iterator[List[Tuple[int, Tuple[List[str], float]]]]:
+    """
+    Runs route_batch chunks on a ProcessPoolExecutor, keeping at most two chunks per worker in flight
+    :param chunks: list of chunks, each a list of (begin_id, [(position, end_id)]) groups
+    :param workers: number of worker processes
+    :param state: (graph, algorithm, metric, coupon) installed in every worker by _route_worker_init
+    :return: iterator over the results of each chunk, in completion order
+    """
+    with futures.ProcessPoolExecutor(max_workers=workers, initializer=_route_worker_init,
+                                     initargs=state) as executor:
+        remaining = iter(chunks)
+        running = {executor.submit(_route_worker, chunk) for chunk in itertools.islice(remaining, 2 * workers)}
+        while running:
+            done, running = futures.wait(running, return_when=futures.FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+                for chunk in itertools.islice(remaining, 1):
+                    running.add(executor.submit(_route_worker, chunk))
+
+
+def _route_worker_init(graph: Graph, algorithm: str, metric: Callable[[Vertex, Vertex], float],
+                       coupon: Tuple[Callable[[str], bool], float]) -> None:
+    """
+    ProcessPoolExecutor initializer storing the route_batch state in a worker process
+    :return: None
+    """
+    global _ROUTE_BATCH_STATE
+    _ROUTE_BATCH_STATE = (graph, algorithm, metric, coupon)
+
+
+def _route_worker(chunk: List[Tuple[str, List[Tuple[int, str]]]]) -> List[Tuple[int, Tuple[List[str], float]]]:
+    """
+    Answers one route_batch chunk inside a worker process
+    :param chunk: list of (begin_id, [(position, end_id)]) groups
+    :return: list of (position, (path, distance)) results
+    """
+    return _route_chunk(_ROUTE_BATCH_STATE, chunk)
+
+
+def _route_chunk(state: Tuple[Graph, str, Any, Any],
+                 chunk: List[Tuple[str, List[Tuple[int, str]]]]) -> List[Tuple[int, Tuple[List[str], float]]]:
+    """
+    Answers the queries of one route_batch chunk
+    :param state: (graph, algorithm, metric, coupon)
+    :param chunk: list of (begin_id, [(position, end_id)]) groups
+    :return: list of (position, (path, distance)) results
+    """
+    graph, algorithm, metric, coupon = state
+    results = []
+    for begin_id, targets in chunk:
+        if algorithm == 'dijkstra' and len(targets) > 1 and isinstance(graph, Graph):
+            tree = graph.shortest_path_tree(begin_id, [end_id for _, end_id in targets])
+            results.extend((position, tree.path_to(end_id)) for position, end_id in targets)
+            continue
+        results.extend((position, route_query(graph, algorithm, begin_id, end_id, metric, coupon))
+                       for position, end_id in targets)
+    return results
+
+
+def route_query(graph: Graph, algorithm: str, begin_id: str, end_id: str,
+                metric: Callable[[Vertex, Vertex], float] = None,
+                coupon: Tuple[Callable[[str], bool], float] = None) -> Tuple[List[str], float]:
+    """
+    Answers one route query by algorithm name, as used by route_batch and route_service
+    :param graph: graph to be searched (a Graph or a CSRGraph)
+    :param algorithm: 'dijkstra', 'a_star' (needs metric) or 'coupon' (tollway_algorithm_again,
+                      needs metric and coupon)
+    :param begin_id: a string representing the starting vertex
+    :param end_id: a string representing the ending vertex
+    :param metric: a callable that returns the taxicab or euclidean distance from one vertex to another
+    :param coupon: a tuple containing the coupon predicate on vertex ids and the cost multiplier
+    :return: a tuple containing the path from begin_id to end_id and its weight, or ([], 0)
+    """
+    check_route_algorithm(algorithm, metric, coupon)
+    if algorithm == 'dijkstra':
+        return graph.dijkstra(begin_id, end_id)
+    if algorithm == 'a_star':
+        return graph.a_star(begin_id, end_id, metric)
+    return tollway_algorithm_again(graph, begin_id, end_id, metric, coupon)
+
+
+def check_route_algorithm(algorithm: str, metric: Callable[[Vertex, Vertex], float],
+                          coupon: Tuple[Callable[[str], bool], float]) -> None:
+    """
+    Validates the algorithm name and arguments of a route query
+    :param algorithm: one of ROUTE_BATCH_ALGORITHMS
+    :param metric: metric callable or None
+    :param coupon: coupon tuple or None
+    :return: None; raises ValueError if the query cannot be answered
+    """
+    if algorithm not in ROUTE_BATCH_ALGORITHMS:
+        raise ValueError(f"unknown algorithm {algorithm!r}; expected one of {ROUTE_BATCH_ALGORITHMS}")
+    if algorithm != 'dijkstra' and metric is None:
+        raise ValueError(f"{algorithm} queries need a metric")
+    if algorithm == 'coupon' and coupon is None:
+        raise ValueError("coupon queries need a coupon")
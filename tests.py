@@ -2,8 +2,18 @@ import os
 import unittest, string, math, random, cProfile
 from xml.dom import minidom
 from numpy import matrix
+import numpy as np
+import tempfile
+import gc
+import pickle
+from concurrent import futures
+import asyncio
+import threading
 
-from solution import Graph, Vertex, tollway_algorithm_again
+from solution import Graph, Vertex, tollway_algorithm_again, CSRGraph, detect_graph_format, \
+    IndexedHeap, BucketQueue, PriorityQueue, ContractionHierarchy, coupon_route, dijkstra_distances, route_batch, \
+    SearchContext, register_vectorized_metric, VECTORIZED_METRICS, coordinates_path, SearchStats, BucketRangeError
+from route_service import RouteService, LocalClient
 
 
 class GraphTests(unittest.TestCase):
@@ -644,6 +654,1088 @@ class GraphTests(unittest.TestCase):
     End Graph Part 2 Tests
     """
 
+    """
+    Begin Graph Backend Tests
+    """
+
+    def test_csr(self):
+        # (1) test empty graph and missing vertices
+        csr = Graph().to_csr()
+        self.assertEqual(([], 0), csr.dijkstra('a', 'b'))
+        graph = Graph()
+        graph.add_to_graph('a', 'b', 331)
+        csr = graph.to_csr()
+        self.assertEqual(([], 0), csr.dijkstra('b', 'a'))
+        self.assertEqual(([], 0), csr.a_star('a', 'c', lambda v1, v2: 0))
+        self.assertEqual((['a', 'b'], 331), csr.dijkstra('a', 'b'))
+
+        # (2) test interning and round trip back to a Graph
+        graph = Graph(csvf='test_csvs/astar/tollway_graph_csv.csv')
+        csr = graph.to_csr()
+        self.assertEqual(list(graph.vertices), csr.ids)
+        self.assertEqual(len(graph.get_all_edges()), len(csr.indices))
+        self.assertEqual(graph, csr.to_graph())
+
+        # (3) test that every pairwise search matches the Graph searches exactly
+        for csvf in ['test_csvs/astar/tollway_graph_csv.csv', 'test_csvs/astar/test_astar_2.csv',
+                     'test_csvs/astar/test_astar_3.csv']:
+            graph = Graph(csvf=csvf)
+            for i, vertex in enumerate(graph.vertices.values()):
+                vertex.x, vertex.y = (i * 7) % 11, (i * 5) % 13
+            csr = graph.to_csr()
+            for begin in graph.vertices:
+                for end in graph.vertices:
+                    self.assertEqual(graph.dijkstra(begin, end), csr.dijkstra(begin, end))
+                    self.assertEqual(graph.a_star(begin, end, Vertex.euclidean_distance),
+                                     csr.a_star(begin, end, Vertex.euclidean_distance))
+                    self.assertEqual(graph.a_star(begin, end, Vertex.taxicab_distance),
+                                     csr.a_star(begin, end, Vertex.taxicab_distance))
+                    graph.reset_vertices()
+
+    def test_csv2graph(self):
+        # (1) test streamed csvs match the dense matrix construction, for both null conventions
+        csvfs = ['test_csvs/astar/tollway_graph_csv.csv', 'test_csvs/astar/test_astar_2.csv',
+                 'test_csvs/equirelation/random_graph_equirelation_1.csv',
+                 'test_csvs/equirelation/random_graph_equirelation_4_solution.csv']
+        for csvf in csvfs:
+            matrix = np.loadtxt(csvf, delimiter=',', dtype=str).tolist()
+            expected = Graph(matrix=matrix)
+            actual = Graph(csvf=csvf)
+            self.assertEqual(expected, actual)
+            self.assertEqual(list(expected.vertices), list(actual.vertices))
+            for v_id, vertex in expected.vertices.items():
+                self.assertEqual(list(vertex.adj.items()), list(actual.vertices[v_id].adj.items()))
+
+        # (2) test progress callback reports every chunk and the final row
+        reports = []
+        graph = Graph()
+        graph.csv2graph('test_csvs/astar/tollway_graph_csv.csv', lambda read, total: reports.append((read, total)),
+                        chunk_size=8)
+        self.assertEqual([(8, 20), (16, 20), (20, 20)], reports)
+        self.assertEqual(Graph(csvf='test_csvs/astar/tollway_graph_csv.csv'), graph)
+
+    def test_graph_formats(self):
+        graph = Graph(csvf='test_csvs/astar/tollway_graph_csv.csv')
+        graph.add_to_graph('Isolated')
+        for i, vertex in enumerate(graph.vertices.values()):
+            vertex.x, vertex.y = i / 3, -i
+        with tempfile.TemporaryDirectory() as tmp:
+            # (1) test edge list round trip keeps coordinates and isolated vertices
+            graph.graph2edgelist(os.path.join(tmp, 'graph.csv'))
+            self.assertEqual('edgelist', detect_graph_format(os.path.join(tmp, 'graph.csv')))
+            actual = Graph(csvf=os.path.join(tmp, 'graph.csv'))
+            self.assertEqual(graph, actual)
+            self.assertEqual(list(graph.vertices), list(actual.vertices))
+            self.assertEqual([(v.x, v.y) for v in graph.vertices.values()],
+                             [(v.x, v.y) for v in actual.vertices.values()])
+
+            # (2) test edge list without coordinates
+            graph.graph2edgelist(os.path.join(tmp, 'bare.csv'), coordinates=False)
+            actual = Graph(csvf=os.path.join(tmp, 'bare.csv'))
+            self.assertEqual(graph, actual)
+            self.assertTrue(all(v.x == 0 and v.y == 0 for v in actual.vertices.values()))
+
+            # (3) test binary round trip
+            graph.graph2npz(os.path.join(tmp, 'graph.npz'))
+            self.assertEqual('npz', detect_graph_format(os.path.join(tmp, 'graph.npz')))
+            actual = Graph(csvf=os.path.join(tmp, 'graph.npz'))
+            self.assertEqual(graph, actual)
+            self.assertEqual([(v.x, v.y) for v in graph.vertices.values()],
+                             [(v.x, v.y) for v in actual.vertices.values()])
+            csr = CSRGraph.load(os.path.join(tmp, 'graph.npz'))
+            self.assertEqual(graph.dijkstra('Joliet', 'Chicago'), csr.dijkstra('Joliet', 'Chicago'))
+
+            # (4) test matrix csv is still detected
+            graph.graph2csv(os.path.join(tmp, 'matrix.csv'))
+            self.assertEqual('matrix', detect_graph_format(os.path.join(tmp, 'matrix.csv')))
+            self.assertEqual(graph, Graph(csvf=os.path.join(tmp, 'matrix.csv')))
+
+    def test_csr_open(self):
+        graph = Graph(csvf='test_csvs/astar/tollway_graph_csv.csv')
+        positions = [(0, 0), (2, 0), (4, 0), (7, 0), (10, 0), (12, 0), (2, 5), (6, 4), (12, 5), (5, 9), (8, 8), (12, 8),
+                     (8, 10), (0, 2),
+                     (4, 2), (9, 2), (9, -2), (7, 6), (8, 11), (14, 8)]
+        for index, v_id in enumerate(list(graph.vertices)):
+            graph.vertices[v_id].x, graph.vertices[v_id].y = positions[index]
+
+        with tempfile.TemporaryDirectory() as tmp:
+            graph.graph2npz(os.path.join(tmp, 'graph.npz'))
+            csr = CSRGraph.open(os.path.join(tmp, 'graph.npz'))
+
+            # (1) test arrays are read-only memory maps and ids are found without an index dict
+            self.assertIsInstance(csr.weights, np.memmap)
+            self.assertFalse(csr.weights.flags.writeable)
+            self.assertIsNone(csr.index)
+            for i, v_id in enumerate(graph.vertices):
+                self.assertEqual(i, csr.lookup(v_id))
+            self.assertEqual(-1, csr.lookup('Springfield'))
+            self.assertEqual(([], 0), csr.dijkstra('Springfield', 'Chicago'))
+
+            # (2) test all searches match the in-memory graph
+            for begin in graph.vertices:
+                for end in graph.vertices:
+                    self.assertEqual(graph.dijkstra(begin, end), csr.dijkstra(begin, end))
+                    self.assertEqual(graph.a_star(begin, end, Vertex.euclidean_distance),
+                                     csr.a_star(begin, end, Vertex.euclidean_distance))
+                    graph.reset_vertices()
+            coupon = (lambda v_id: False, 1)
+            self.assertEqual(tollway_algorithm_again(graph, 'Joliet', 'Chicago', Vertex.taxicab_distance, coupon),
+                             tollway_algorithm_again(csr, 'Joliet', 'Chicago', Vertex.taxicab_distance, coupon))
+            self.assertEqual(graph, csr.to_graph())
+            del csr
+
+    def test_indexed_heap(self):
+        # (1) test pops come out in (priority, push order) order after arbitrary updates
+        random.seed(331)
+        heap = IndexedHeap(100)
+        expected = {}
+        for count in range(300):
+            v, priority = random.randrange(100), random.randint(0, 20)
+            if v in heap:
+                heap.update(priority, v)
+            else:
+                heap.push(priority, v)
+            expected[v] = (priority, count)
+        self.assertEqual(len(expected), len(heap))
+        actual = []
+        while not heap.empty():
+            actual.append(heap.pop())
+        self.assertEqual([(expected[v][0], v) for v in sorted(expected, key=expected.get)], actual)
+        self.assertNotIn(actual[0][1], heap)
+
+        # (2) test CSR searches driven by the indexed heap match the Graph searches
+        for csvf in ['test_csvs/astar/tollway_graph_csv.csv', 'test_csvs/astar/test_astar_3.csv']:
+            graph = Graph(csvf=csvf)
+            for i, vertex in enumerate(graph.vertices.values()):
+                vertex.x, vertex.y = (i * 7) % 11, (i * 5) % 13
+            csr = graph.to_csr()
+            for begin in graph.vertices:
+                for end in graph.vertices:
+                    self.assertEqual(graph.dijkstra(begin, end), csr.dijkstra(begin, end, queue='indexed'))
+                    self.assertEqual(graph.a_star(begin, end, Vertex.taxicab_distance),
+                                     csr.a_star(begin, end, Vertex.taxicab_distance, queue='indexed'))
+                    graph.reset_vertices()
+        self.assertRaises(ValueError, csr.dijkstra, 'a', 'b', 'fibonacci')
+
+    def test_bucket_queue(self):
+        # (1) test auto selection follows the edge weights
+        graph = Graph(csvf='test_csvs/astar/tollway_graph_csv.csv')
+        self.assertEqual(17, graph.integer_weight_bound())
+        self.assertIsInstance(graph.search_queue(), BucketQueue)
+        self.assertIsInstance(Graph(csvf='test_csvs/astar/test_astar_2.csv').search_queue(), PriorityQueue)
+        self.assertIsInstance(graph.search_queue('heap'), PriorityQueue)
+        graph.add_to_graph('A', 'B', 8.5)
+        self.assertIsNone(graph.integer_weight_bound())
+        self.assertIsInstance(graph.search_queue(), PriorityQueue)
+        self.assertRaises(ValueError, graph.search_queue, 'bucket')
+        graph.add_to_graph('A', 'B', 8)
+        self.assertIsInstance(graph.search_queue(), BucketQueue)
+
+        # (2) test bucket queue searches match heap searches exactly, including ties and zero weights
+        for csvf in ['test_csvs/astar/tollway_graph_csv.csv', 'test_csvs/astar/test_astar_3.csv']:
+            graph = Graph(csvf=csvf)
+            for begin in graph.vertices:
+                for end in graph.vertices:
+                    expected = graph.dijkstra(begin, end, queue='heap')
+                    graph.reset_vertices()
+                    self.assertEqual(expected, graph.dijkstra(begin, end, queue='bucket'))
+                    graph.reset_vertices()
+
+        # (3) test weights edited directly on Vertex.adj fall back to the heap instead of misordering buckets
+        graph = Graph()
+        for begin, end, weight in [('s', 't', 1), ('s', 'a', 1), ('a', 't', 1)]:
+            graph.add_to_graph(begin, end, weight)
+        self.assertEqual((['s', 't'], 1), graph.dijkstra('s', 't'))
+        graph.vertices['s'].adj['t'] = 3
+        self.assertEqual((['s', 'a', 't'], 2), graph.dijkstra('s', 't'))
+        self.assertEqual((['s', 'a', 't'], 2), graph.shortest_path_tree('s').path_to('t'))
+        self.assertEqual(3, graph.integer_weight_bound())
+        graph.vertices['a'].adj['t'] = 0.5
+        self.assertEqual((['s', 'a', 't'], 1.5), graph.dijkstra('s', 't', queue='bucket'))
+        self.assertRaises(BucketRangeError, BucketQueue(2).push, 3, Vertex('v'))
+
+        # (4) test a search that falls back reports the same stats as a heap search alone
+        reports = []
+        for queue in ['auto', 'heap']:
+            graph = Graph()
+            for begin, end, weight in [('s', 't', 1), ('s', 'a', 1), ('a', 't', 1), ('t', 'b', 1)]:
+                graph.add_to_graph(begin, end, weight)
+            graph.dijkstra('s', 'b')
+            graph.vertices['s'].adj['t'] = 3
+            stats = SearchStats()
+            self.assertEqual((['s', 'a', 't', 'b'], 3), graph.dijkstra('s', 'b', queue, SearchContext(stats=stats)))
+            report = stats.as_dict()
+            self.assertEqual({'setup', 'search', 'path'}, set(report.pop('phase_seconds')))
+            reports.append(report)
+        self.assertEqual(reports[1], reports[0])
+        self.assertEqual(1, reports[0]['searches'])
+
+    def test_shortest_path_tree(self):
+        # (1) test missing source and unreachable targets
+        graph = Graph()
+        self.assertEqual(([], 0), graph.shortest_path_tree('a').path_to('b'))
+        graph.add_to_graph('a', 'b', 331)
+        graph.add_to_graph('c')
+        tree = graph.shortest_path_tree('a')
+        self.assertEqual((['a'], 0), tree.path_to('a'))
+        self.assertEqual((['a', 'b'], 331), tree.path_to('b'))
+        self.assertEqual(([], 0), tree.path_to('c'))
+        self.assertEqual(math.inf, tree.distance('c'))
+        self.assertNotIn('c', tree)
+
+        # (2) test one-to-all trees reproduce every point-to-point dijkstra
+        for csvf in ['test_csvs/astar/tollway_graph_csv.csv', 'test_csvs/astar/test_astar_2.csv']:
+            graph = Graph(csvf=csvf)
+            for begin in graph.vertices:
+                tree = graph.shortest_path_tree(begin)
+                graph.reset_vertices()
+                for end in graph.vertices:
+                    self.assertEqual(graph.dijkstra(begin, end), tree.path_to(end))
+                    graph.reset_vertices()
+
+        # (3) test one-to-many stops once the targets are settled
+        graph = Graph(csvf='test_csvs/astar/tollway_graph_csv.csv')
+        tree = graph.shortest_path_tree('Franklin Grove', targets=['A', 'B'])
+        self.assertEqual({'Franklin Grove', 'A', 'B'}, set(tree.back_edges))
+        self.assertEqual({'A': (['Franklin Grove', 'A'], 0), 'B': (['Franklin Grove', 'A', 'B'], 8)},
+                         tree.paths(['A', 'B']))
+
+    def test_bidirectional(self):
+        # (1) test edge cases
+        graph = Graph()
+        self.assertEqual(([], 0), graph.bidirectional_dijkstra('a', 'b'))
+        graph.add_to_graph('a', 'b', 331)
+        self.assertEqual((['a', 'b'], 331), graph.bidirectional_dijkstra('a', 'b'))
+        self.assertEqual(([], 0), graph.bidirectional_dijkstra('b', 'a'))
+        self.assertEqual(([], 0), graph.bidirectional_a_star('b', 'a', Vertex.euclidean_distance))
+        self.assertEqual({'a': {}, 'b': {'a': 331}}, graph.reverse_adjacency())
+        graph.add_to_graph('b', 'a', 1)
+        self.assertEqual({'a': {'b': 1}, 'b': {'a': 331}}, graph.reverse_adjacency())
+
+        def is_valid_path(graph, search_result):
+            path, dist = search_result
+            length = sum(graph.get_edge_by_ids(path[i], path[i + 1])[2] for i in range(len(path) - 1))
+            return abs(length - dist) < 10 ** -8
+
+        # (2) test every pair finds a shortest path, with and without potentials
+        graph = Graph(csvf='test_csvs/astar/tollway_graph_csv.csv')
+        positions = [(0, 0), (2, 0), (4, 0), (7, 0), (10, 0), (12, 0), (2, 5), (6, 4), (12, 5), (5, 9), (8, 8), (12, 8),
+                     (8, 10), (0, 2),
+                     (4, 2), (9, 2), (9, -2), (7, 6), (8, 11), (14, 8)]
+        for index, v_id in enumerate(list(graph.vertices)):
+            graph.vertices[v_id].x, graph.vertices[v_id].y = positions[index]
+        for csv_graph in [graph, Graph(csvf='test_csvs/astar/test_astar_2.csv')]:
+            for begin in csv_graph.vertices:
+                for end in csv_graph.vertices:
+                    expected = csv_graph.dijkstra(begin, end)
+                    csv_graph.reset_vertices()
+                    for actual in [csv_graph.bidirectional_dijkstra(begin, end),
+                                   csv_graph.bidirectional_a_star(begin, end, Vertex.taxicab_distance)]:
+                        self.assertAlmostEqual(expected[1], actual[1])
+                        self.assertEqual(bool(expected[0]), bool(actual[0]))
+                        self.assertTrue(is_valid_path(csv_graph, actual))
+                        if actual[0]:
+                            self.assertEqual((begin, end), (actual[0][0], actual[0][-1]))
+        self.assertEqual((['Franklin Grove', 'A', 'B', 'G', 'J', 'M', 'Northbrook'], 22),
+                         graph.bidirectional_a_star('Franklin Grove', 'Northbrook', Vertex.euclidean_distance))
+
+    def test_contraction_hierarchy(self):
+        # (1) test edge cases
+        graph = Graph()
+        self.assertEqual(([], 0), graph.contraction_hierarchy().query('a', 'b'))
+        graph.add_to_graph('a', 'b', 331)
+        graph.add_to_graph('c')
+        hierarchy = graph.contraction_hierarchy()
+        self.assertEqual((['a', 'b'], 331), hierarchy.query('a', 'b'))
+        self.assertEqual(([], 0), hierarchy.query('b', 'a'))
+        self.assertEqual(([], 0), hierarchy.query('a', 'c'))
+        self.assertEqual((['a'], 0), hierarchy.query('a', 'a'))
+
+        def is_valid_path(graph, search_result):
+            path, dist = search_result
+            length = sum(graph.get_edge_by_ids(path[i], path[i + 1])[2] for i in range(len(path) - 1))
+            return abs(length - dist) < 10 ** -8
+
+        # (2) test every query on the bundled csvs against dijkstra, before and after serialization
+        for csvf in ['test_csvs/astar/tollway_graph_csv.csv', 'test_csvs/astar/test_astar_2.csv',
+                     'test_csvs/astar/test_astar_3.csv', 'test_csvs/equirelation/random_graph_equirelation_1.csv']:
+            graph = Graph(csvf=csvf)
+            hierarchy = graph.contraction_hierarchy()
+            with tempfile.TemporaryDirectory() as tmp:
+                hierarchy.save(os.path.join(tmp, 'ch.npz'))
+                loaded = ContractionHierarchy.load(os.path.join(tmp, 'ch.npz'))
+            for begin in graph.vertices:
+                for end in graph.vertices:
+                    expected = graph.dijkstra(begin, end)
+                    graph.reset_vertices()
+                    for actual in [hierarchy.query(begin, end), loaded.query(begin, end)]:
+                        self.assertAlmostEqual(expected[1], actual[1])
+                        self.assertEqual(bool(expected[0]), bool(actual[0]))
+                        self.assertTrue(is_valid_path(graph, actual))
+                        if actual[0]:
+                            self.assertEqual((begin, end), (actual[0][0], actual[0][-1]))
+
+    def test_landmarks(self):
+        # (1) test edge cases
+        graph = Graph()
+        self.assertEqual([], graph.landmarks().landmarks)
+        graph.add_to_graph('a', 'b', 331)
+        graph.add_to_graph('c')
+        alt = graph.landmarks(count=2)
+        self.assertEqual(2, len(alt.landmarks))
+        self.assertEqual((['a', 'b'], 331), graph.a_star('a', 'b', alt))
+        self.assertEqual(([], 0), graph.a_star('b', 'a', alt))
+
+        # (2) test bounds are admissible and a_star with ALT stays optimal without coordinates
+        for csvf in ['test_csvs/astar/tollway_graph_csv.csv', 'test_csvs/astar/test_astar_2.csv']:
+            graph = Graph(csvf=csvf)
+            alt = graph.landmarks(count=3)
+            self.assertEqual(3, len(set(alt.landmarks)))
+            for begin in graph.vertices:
+                tree = graph.shortest_path_tree(begin)
+                for end in graph.vertices:
+                    self.assertLessEqual(alt.bound(begin, end), tree.distance(end) + 10 ** -8)
+                    actual = graph.a_star(begin, end, alt)
+                    graph.reset_vertices()
+                    self.assertAlmostEqual(tree.distance(end) if end in tree else 0, actual[1])
+
+        # (3) test the metric plugs into tollway_algorithm_again
+        graph = Graph(csvf='test_csvs/astar/tollway_graph_csv.csv')
+        coupon = (lambda v_id: False, 1)
+        self.assertEqual((['Franklin Grove', 'A', 'B', 'G', 'J', 'M', 'Northbrook'], 22),
+                         tollway_algorithm_again(graph, 'Franklin Grove', 'Northbrook', graph.landmarks(), coupon))
+
+    def test_coupon_route(self):
+        graph = Graph(csvf='test_csvs/astar/tollway_graph_csv.csv')
+
+        # (1) test discounted roads are reported and unlimited coupons match tollway_algorithm_again
+        better_coupon = (lambda v_id: v_id in ['A', 'J', 'K'], 0.2)
+        expected = (['Belvidere', 'K', 'J', 'M', 'Northbrook'], 1.6, [('K', 'J'), ('J', 'M')])
+        self.assertEqual(expected, coupon_route(graph, 'Belvidere', 'Northbrook', lambda v1, v2: 0, better_coupon))
+        self.assertEqual(expected[:2], tollway_algorithm_again(graph, 'Belvidere', 'Northbrook',
+                                                               lambda v1, v2: 0, better_coupon))
+        self.assertEqual(([], 0, []), coupon_route(graph, 'Belvidere', 'Springfield', lambda v1, v2: 0,
+                                                   better_coupon))
+
+        # (2) test zero coupons is plain dijkstra and the graph is never modified
+        before = Graph(csvf='test_csvs/astar/tollway_graph_csv.csv')
+        half_off = (lambda v_id: True, 0.5)
+        for begin in ['Franklin Grove', 'Joliet', 'Chicago']:
+            for end in graph.vertices:
+                path, dist, discounted = coupon_route(graph, begin, end, lambda v1, v2: 0, half_off, max_coupons=0)
+                self.assertEqual(graph.dijkstra(begin, end), (path, dist))
+                self.assertEqual([], discounted)
+                graph.reset_vertices()
+        self.assertEqual(before, graph)
+
+        # (3) test one coupon against trying every discounted road separately
+        reverse = graph.reverse_adjacency()
+        for begin in ['Franklin Grove', 'Joliet', 'Chicago', 'Belvidere']:
+            from_begin = graph.shortest_path_tree(begin)
+            for end in graph.vertices:
+                to_end = dijkstra_distances(reverse, end)
+                best = from_begin.distance(end)
+                for u, v, weight in graph.get_all_edges():
+                    best = min(best, from_begin.distance(u) + weight * 0.5 + to_end.get(v, math.inf))
+                path, dist, discounted = coupon_route(graph, begin, end, lambda v1, v2: 0, half_off, max_coupons=1)
+                self.assertAlmostEqual(best if best < math.inf else 0, dist)
+                self.assertLessEqual(len(discounted), 1)
+                self.assertEqual(bool(discounted), dist < from_begin.distance(end))
+
+        # (4) test more coupons never cost more, and CSR graphs give the same routes
+        csr = graph.to_csr()
+        for k in range(4):
+            fewer = coupon_route(graph, 'Joliet', 'Chicago', Vertex.taxicab_distance, half_off, max_coupons=k)
+            more = coupon_route(graph, 'Joliet', 'Chicago', Vertex.taxicab_distance, half_off, max_coupons=k + 1)
+            self.assertLessEqual(more[1], fewer[1])
+            self.assertEqual(k + 1, len(more[2]))
+            self.assertEqual(more, coupon_route(csr, 'Joliet', 'Chicago', Vertex.taxicab_distance, half_off,
+                                                max_coupons=k + 1))
+
+        # (5) test free-pass coupons with an ALT metric, whose unreachable bounds are infinite
+        random.seed(331)
+        free_pass = (lambda v_id: int(v_id) % 3 == 0, 0)
+        for _ in range(100):
+            graph, free = Graph(), Graph()
+            for v_id in range(12):
+                graph.add_to_graph(str(v_id))
+                free.add_to_graph(str(v_id))
+            for _ in range(18):
+                begin, end, weight = str(random.randrange(12)), str(random.randrange(12)), random.randint(1, 9)
+                graph.add_to_graph(begin, end, weight)
+                free.add_to_graph(begin, end, 0 if free_pass[0](begin) else weight)
+            landmarks = graph.landmarks(3)
+            for begin in graph.vertices:
+                for end in graph.vertices:
+                    self.assertEqual(free.dijkstra(begin, end)[1],
+                                     coupon_route(graph, begin, end, landmarks, free_pass)[1])
+                    self.assertEqual(graph.dijkstra(begin, end)[1],
+                                     coupon_route(graph, begin, end, landmarks, free_pass, max_coupons=0)[1])
+
+    def test_predicate_mask(self):
+        graph = Graph(csvf='test_csvs/astar/tollway_graph_csv.csv')
+        calls = []
+
+        def short_name(v_id):
+            calls.append(v_id)
+            return len(v_id) <= 5
+
+        # (1) test repeated coupon queries evaluate the predicate once per vertex
+        coupon = (short_name, 0.5)
+        expected = tollway_algorithm_again(graph, 'Northbrook', 'Franklin Grove', Vertex.taxicab_distance, coupon)
+        self.assertEqual((['Northbrook', 'M', 'J', 'G', 'B', 'A', 'Franklin Grove'], 11.0), expected)
+        self.assertEqual(len(calls), len(set(calls)))
+        first = len(calls)
+        for _ in range(3):
+            self.assertEqual(expected, tollway_algorithm_again(graph, 'Northbrook', 'Franklin Grove',
+                                                               Vertex.taxicab_distance, coupon))
+        self.assertEqual(first, len(calls))
+        self.assertIs(graph.predicate_mask(short_name), graph.predicate_mask(short_name))
+        self.assertEqual(first, graph.predicate_mask(short_name).evaluations)
+
+        # (2) test full evaluation, new vertices and distinct predicates
+        mask = graph.predicate_mask(short_name).evaluate(graph.vertices)
+        self.assertEqual([len(v_id) <= 5 for v_id in graph.vertices], mask.tolist())
+        self.assertEqual(graph.size, len(calls))
+        graph.add_to_graph('Z')
+        self.assertTrue(graph.predicate_mask(short_name)('Z'))
+        self.assertEqual(graph.size, len(calls))
+        self.assertIsNot(graph.predicate_mask(short_name), graph.predicate_mask(lambda v_id: True))
+
+        # (3) test masks on CSR graphs and expiry with their predicate
+        csr = graph.to_csr()
+        self.assertFalse(csr.predicate_mask(short_name)('Northbrook'))
+        self.assertTrue(csr.predicate_mask(str.isupper)('Z'))
+        del short_name, coupon, mask
+        gc.collect()
+        self.assertEqual(0, len(graph._predicate_masks.weak))
+
+    def test_route_batch(self):
+        graph = Graph(csvf='test_csvs/astar/test_astar_2.csv')
+        queries = [(begin, end) for begin in list(graph.vertices)[:6] for end in graph.vertices] + [('a', 'missing')]
+        random.Random(331).shuffle(queries)
+
+        # (1) test in-process and pooled dijkstra match one query at a time, in order and as completed
+        expected = [graph.dijkstra(begin, end) for begin, end in queries]
+        self.assertEqual(expected, list(route_batch(graph, queries, workers=0)))
+        self.assertEqual(expected, list(route_batch(graph, queries, workers=2, chunk_size=20)))
+        unordered = list(route_batch(graph, queries, workers=2, ordered=False, chunk_size=20))
+        self.assertEqual(list(enumerate(expected)), sorted(unordered, key=lambda item: item[0]))
+
+        # (2) test a_star and coupon queries, on Graph and CSRGraph
+        csr = graph.to_csr()
+        expected = [graph.a_star(begin, end, Vertex.euclidean_distance) for begin, end in queries[:60]]
+        self.assertEqual(expected, list(route_batch(graph, queries[:60], 'a_star', Vertex.euclidean_distance,
+                                                    workers=2, chunk_size=8)))
+        self.assertEqual(expected, list(route_batch(csr, queries[:60], 'a_star', Vertex.euclidean_distance,
+                                                    workers=2, chunk_size=8)))
+        coupon = (lambda v_id: v_id in 'aeiou', 0.5)
+        expected = [tollway_algorithm_again(graph, begin, end, Vertex.taxicab_distance, coupon)
+                    for begin, end in queries[:60]]
+        self.assertEqual(expected, list(route_batch(graph, queries[:60], 'coupon', Vertex.taxicab_distance, coupon,
+                                                    workers=2)))
+
+        # (3) test invalid requests and pickling the graph for spawned workers
+        self.assertEqual([], list(route_batch(graph, [], workers=2)))
+        with self.assertRaises(ValueError):
+            list(route_batch(graph, queries, 'bfs'))
+        with self.assertRaises(ValueError):
+            list(route_batch(graph, queries, 'a_star'))
+        graph.predicate_mask(coupon[0])('a')
+        self.assertEqual(graph, pickle.loads(pickle.dumps(graph)))
+
+    def test_search_context(self):
+        graph = Graph(csvf='test_csvs/astar/test_astar_3.csv')
+        before = Graph(csvf='test_csvs/astar/test_astar_3.csv')
+        queries = [(begin, end) for begin in list(graph.vertices)[:8] for end in graph.vertices]
+        expected = [(graph.dijkstra(begin, end), graph.a_star(begin, end, Vertex.euclidean_distance))
+                    for begin, end in queries]
+
+        # (1) test searches leave the graph untouched and give the same results from many threads
+        self.assertEqual(before, graph)
+        with futures.ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(lambda q: (graph.dijkstra(*q), graph.a_star(*q, Vertex.euclidean_distance)),
+                                        queries * 4))
+        self.assertEqual(expected * 4, results)
+        self.assertEqual(before, graph)
+
+        # (2) test recording visited vertices for plot
+        context = SearchContext(record_visited=True)
+        self.assertEqual(expected[5][0], graph.dijkstra(*queries[5], context=context))
+        self.assertEqual(queries[5][1], context.visited[-1])
+        self.assertEqual(len(set(context.visited)), len(context.visited))
+        self.assertEqual(expected[5][0][1], context.path[queries[5][1]][1])
+        context.mark_visited(graph)
+        self.assertEqual(set(context.visited), {v_id for v_id, v in graph.vertices.items() if v.visited})
+        graph.reset_vertices()
+        self.assertEqual(before, graph)
+        with self.assertRaises(ValueError):
+            SearchContext().mark_visited(graph)
+
+    def test_route_service(self):
+        graph = Graph(csvf='test_csvs/astar/test_astar_2.csv')
+        queries = [(begin, end) for begin in list(graph.vertices)[:4] for end in graph.vertices]
+        coupon = (lambda v_id: v_id in 'aeiou', 0.5)
+
+        async def scenario():
+            async with RouteService(graph, concurrency=3, max_pending=4) as service:
+                client = LocalClient(service)
+
+                # (1) test every algorithm matches a direct call, with more requests than queue room
+                results = await client.route_many(queries * 2)
+                self.assertEqual([graph.dijkstra(*q) for q in queries] * 2, results)
+                self.assertEqual(graph.a_star('a', 'z', Vertex.euclidean_distance),
+                                 await client.a_star('a', 'z', Vertex.euclidean_distance))
+                self.assertEqual(tollway_algorithm_again(graph, 'a', 'z', Vertex.taxicab_distance, coupon),
+                                 await client.tollway('a', 'z', Vertex.taxicab_distance, coupon))
+
+                # (2) test identical in-flight requests are coalesced into one search
+                before = service.stats()
+                same = await asyncio.gather(*(client.dijkstra('b', 'y') for _ in range(10)))
+                self.assertEqual([graph.dijkstra('b', 'y')] * 10, same)
+                self.assertIsNot(same[0][0], same[1][0])
+                stats = service.stats()
+                self.assertEqual(before['completed'] + 1, stats['completed'])
+                self.assertEqual(before['coalesced'] + 9, stats['coalesced'])
+                self.assertEqual(0, stats['in_flight'])
+
+                # (3) test invalid requests fail without stopping the service
+                with self.assertRaises(ValueError):
+                    await service.route('bfs', 'a', 'b')
+                self.assertEqual(([], 0), await client.dijkstra('a', 'missing'))
+
+        async def cancelled_while_queue_full():
+            release = threading.Event()
+
+            def blocked(v1: Vertex, v2: Vertex) -> float:
+                release.wait(10)
+                return 0
+
+            async with RouteService(graph, concurrency=1, max_pending=1) as service:
+                try:
+                    running = asyncio.create_task(service.route('a_star', 'a', 'z', blocked))
+                    await asyncio.sleep(0.05)
+                    queued = asyncio.create_task(service.route('dijkstra', 'a', 'z'))
+                    await asyncio.sleep(0.05)
+                    first, second = (asyncio.create_task(service.route('dijkstra', 'b', 'y')) for _ in range(2))
+                    dropped = [asyncio.create_task(service.route('dijkstra', 'c', 'x')) for _ in range(2)]
+                    await asyncio.sleep(0.05)
+
+                    # (4) test a saturated service holds new distinct callers back instead of buffering them
+                    self.assertEqual(1, service.stats()['pending'])
+                    self.assertEqual(2, service.stats()['in_flight'])
+                    self.assertFalse(any(task.done() for task in [first, second] + dropped))
+
+                    # (5) test a caller cancelled while held back leaves identical callers waiting unharmed
+                    first.cancel()
+                    for task in dropped:
+                        task.cancel()
+                    await asyncio.sleep(0.05)
+                    self.assertEqual(2, service.stats()['in_flight'])
+                finally:
+                    release.set()
+                self.assertEqual(graph.dijkstra('b', 'y'), await second)
+                with self.assertRaises(asyncio.CancelledError):
+                    await first
+                self.assertEqual(graph.a_star('a', 'z', blocked), await running)
+                self.assertEqual(graph.dijkstra('a', 'z'), await queued)
+                self.assertEqual(3, service.stats()['completed'])
+                self.assertEqual(0, service.stats()['in_flight'])
+
+        asyncio.run(scenario())
+        asyncio.run(cancelled_while_queue_full())
+        with self.assertRaises(RuntimeError):
+            asyncio.run(RouteService(graph).route('dijkstra', 'a', 'b'))
+
+    def test_route_cache(self):
+        graph = Graph(csvf='test_csvs/astar/tollway_graph_csv.csv')
+        plain = Graph(csvf='test_csvs/astar/tollway_graph_csv.csv')
+        cache = graph.enable_route_cache(maxsize=3)
+        coupon = (lambda v_id: v_id in ['A', 'J', 'K'], 0.2)
+
+        # (1) test hits return equal, independent results for every algorithm
+        for _ in range(2):
+            self.assertEqual(plain.dijkstra('Belvidere', 'Northbrook'), graph.dijkstra('Belvidere', 'Northbrook'))
+            self.assertEqual(plain.a_star('Joliet', 'Chicago', Vertex.taxicab_distance),
+                             graph.a_star('Joliet', 'Chicago', Vertex.taxicab_distance))
+            self.assertEqual(tollway_algorithm_again(plain, 'Belvidere', 'Northbrook', Vertex.taxicab_distance, coupon),
+                             tollway_algorithm_again(graph, 'Belvidere', 'Northbrook', Vertex.taxicab_distance, coupon))
+        self.assertEqual({'hits': 3, 'misses': 3, 'evictions': 0, 'invalidations': 0, 'size': 3}, cache.stats())
+        graph.dijkstra('Belvidere', 'Northbrook')[0].append('mutated')
+        self.assertEqual(plain.dijkstra('Belvidere', 'Northbrook'), graph.dijkstra('Belvidere', 'Northbrook'))
+
+        # (2) test the key includes the metric and coupon policy, and the least recently used entry is evicted
+        self.assertEqual(plain.a_star('Joliet', 'Chicago', Vertex.euclidean_distance),
+                         graph.a_star('Joliet', 'Chicago', Vertex.euclidean_distance))
+        coupon_route(graph, 'Belvidere', 'Northbrook', Vertex.taxicab_distance, coupon, max_coupons=1)
+        self.assertEqual(2, cache.evictions)
+        graph.dijkstra('Belvidere', 'Northbrook')
+        self.assertEqual(5, cache.misses)  # still cached: it was used more recently than the evicted entries
+
+        # (3) test mutations invalidate, while re-adding an unchanged edge does not
+        graph.add_to_graph('K', 'J', 4.0)
+        graph.dijkstra('Belvidere', 'Northbrook')
+        self.assertEqual(0, cache.invalidations)
+        for change in [('K', 'J', 0.5), ('Nowhere',)]:
+            graph.add_to_graph(*change)
+            plain.add_to_graph(*change)
+            self.assertEqual(plain.dijkstra('Belvidere', 'Northbrook'), graph.dijkstra('Belvidere', 'Northbrook'))
+        self.assertEqual(2, cache.invalidations)
+        self.assertEqual(1, len(cache))
+
+        # (4) test searches with a context bypass the cache, and disabling it
+        hits = cache.hits
+        graph.dijkstra('Belvidere', 'Northbrook', context=SearchContext())
+        self.assertEqual(hits, cache.hits)
+        graph.disable_route_cache()
+        self.assertIsNone(graph.route_cache)
+        self.assertEqual(graph, pickle.loads(pickle.dumps(graph)))
+
+    def test_dynamic_shortest_path_tree(self):
+        random.seed(331)
+        for csvf in ['test_csvs/astar/tollway_graph_csv.csv', 'test_csvs/astar/test_astar_3.csv']:
+            graph = Graph(csvf=csvf)
+            ids = list(graph.vertices)
+            edges = list(graph.get_all_edges())
+            tree = graph.dynamic_shortest_path_tree(ids[0])
+
+            # (1) test random increases, decreases and new edges keep every distance exact
+            for _ in range(200):
+                begin, end, _ = random.choice(edges) if random.random() < 0.8 else (*random.sample(ids, 2), None)
+                tree.set_weight(begin, end, random.choice([random.uniform(0, 5), random.uniform(1, 1000)]))
+                fresh = graph.shortest_path_tree(ids[0])
+                self.assertEqual(set(fresh.back_edges), set(tree.back_edges))
+                for v_id in ids:
+                    self.assertAlmostEqual(fresh.distance(v_id), tree.distance(v_id))
+                    self.assertAlmostEqual(fresh.distance(v_id), tree.path_to(v_id)[1])
+
+        # (2) test updates only touch the affected region
+        graph = Graph()
+        for i in range(100):
+            graph.add_to_graph(str(i), str(i + 1), 1)
+        tree = graph.dynamic_shortest_path_tree('0')
+        self.assertEqual(1, tree.set_weight('99', '100', 5))
+        self.assertEqual(0, tree.set_weight('50', '49', 5))
+        self.assertEqual(3, tree.set_weight('97', '98', 2))
+        self.assertEqual(3, tree.set_weight('97', '98', 1))
+        self.assertEqual(2, tree.set_weight('0', '99', 98.5))
+        self.assertEqual((['0', '99', '100'], 103.5), tree.path_to('100'))
+
+        # (3) test re-settling a large subtree, and other mutations trigger a rebuild
+        self.assertEqual(98, tree.set_weight('0', '1', 200))
+        self.assertEqual(297, tree.distance('98'))
+        self.assertEqual((['0', '99', '100'], 103.5), tree.path_to('100'))
+        graph.add_to_graph('0', '1', 1)
+        tree.set_weight('new', '0', 1)
+        self.assertEqual(graph.shortest_path_tree('0').back_edges, tree.back_edges)
+        self.assertNotIn('new', tree)
+
+    def test_all_pairs_shortest_paths(self):
+        # (1) test every pair matches dijkstra on the dense fixtures
+        for csvf in ['test_csvs/astar/test_astar_2.csv', 'test_csvs/astar/tollway_graph_csv.csv',
+                     'test_csvs/equirelation/random_graph_equirelation_1.csv']:
+            graph = Graph(csvf=csvf)
+            table = graph.all_pairs_shortest_paths()
+            for begin in graph.vertices:
+                for end in graph.vertices:
+                    path, dist = graph.dijkstra(begin, end)
+                    self.assertAlmostEqual(dist, table.path(begin, end)[1])
+                    self.assertEqual(bool(path), bool(table.path(begin, end)[0]))
+                    self.assertAlmostEqual(dist if path else math.inf, table.distance(begin, end))
+
+        # (2) test the weight array and predecessor matrix on a small graph
+        graph = Graph()
+        for begin, end, weight in [('a', 'b', 4), ('a', 'c', 1), ('c', 'b', 2), ('b', 'd', 1), ('d', 'd', 3)]:
+            graph.add_to_graph(begin, end, weight)
+        graph.add_to_graph('e')
+        weights = graph.weight_array()
+        self.assertEqual([[None if w == math.inf else w for w in row] for row in weights.tolist()],
+                         [row[1:] for row in graph.graph2matrix()[1:]])
+        table = graph.all_pairs_shortest_paths()
+        self.assertEqual((['a', 'c', 'b', 'd'], 4), table.path('a', 'd'))
+        self.assertEqual((['d'], 0), table.path('d', 'd'))
+        self.assertEqual(([], 0), table.path('d', 'a'))
+        self.assertEqual(([], 0), table.path('a', 'missing'))
+        self.assertEqual([-1, 2, 0, 1, -1], table.pred[0].tolist())
+        self.assertEqual(0, Graph().all_pairs_shortest_paths().dist.size)
+
+    def test_reachability(self):
+        # (1) test the equivalence closure reproduces the shipped solution matrices
+        with tempfile.TemporaryDirectory() as directory:
+            for i in range(1, 5):
+                graph = Graph(csvf=f'test_csvs/equirelation/random_graph_equirelation_{i}.csv')
+                solution = Graph(csvf=f'test_csvs/equirelation/random_graph_equirelation_{i}_solution.csv')
+                relation = graph.equivalence_closure()
+                relation.to_csv(os.path.join(directory, 'relation.csv'))
+                self.assertEqual(solution, Graph(csvf=os.path.join(directory, 'relation.csv')))
+                from_matrix = Graph()
+                from_matrix.matrix2graph(relation.to_matrix())
+                self.assertEqual(solution, from_matrix)
+
+        # (2) test components come out in reverse topological order
+        graph = Graph(csvf='test_csvs/astar/tollway_graph_csv.csv')
+        components = graph.strongly_connected_components()
+        self.assertEqual(sorted(graph.vertices), sorted(v_id for c in components for v_id in c))
+        position = {v_id: c for c, members in enumerate(components) for v_id in members}
+        for begin, end, _ in graph.get_all_edges():
+            self.assertGreaterEqual(position[begin], position[end])
+
+        # (3) test the transitive closure against searching from every vertex
+        random.seed(331)
+        graph = Graph()
+        for _ in range(300):
+            graph.add_to_graph(str(random.randrange(150)), str(random.randrange(150)))
+        closure, reflexive = graph.transitive_closure(), graph.transitive_closure(reflexive=True)
+        reaches = {v_id: set(graph.shortest_path_tree(v_id).back_edges) for v_id in graph.vertices}
+        for begin in graph.vertices:
+            on_cycle = any(begin in reaches[adj] for adj in graph.vertices[begin].adj)
+            for end in graph.vertices:
+                expected = end in reaches[begin] and (begin != end or on_cycle)
+                self.assertEqual(expected, closure.related(begin, end))
+                self.assertEqual(expected or begin == end, reflexive.related(begin, end))
+            self.assertEqual([closure.related(begin, end) for end in graph.vertices], closure.row(begin).tolist())
+        self.assertFalse(closure.related('0', 'missing'))
+        self.assertIsNone(Graph().transitive_closure().to_matrix())
+
+    def test_condensation(self):
+        random.seed(331)
+        graph = Graph()
+        for _ in range(250):
+            graph.add_to_graph(str(random.randrange(120)), str(random.randrange(120)), random.randint(1, 9))
+        condensation = graph.condensation()
+
+        # (1) test the DAG links components in reverse topological order, and can_reach never rejects a path
+        self.assertIs(condensation, graph.condensation())
+        self.assertGreater(len(condensation.components), 1)
+        for c, successors in enumerate(condensation.dag):
+            self.assertTrue(all(d < c for d in successors))
+        impossible, rejected = [], []
+        for begin in graph.vertices:
+            reached = graph.shortest_path_tree(begin)
+            for end in graph.vertices:
+                if end in reached:
+                    self.assertTrue(condensation.can_reach(begin, end))
+                else:
+                    impossible.append((begin, end))
+                    if not condensation.can_reach(begin, end):
+                        rejected.append((begin, end))
+        self.assertGreater(len(rejected), 0.9 * len(impossible))
+
+        # (2) test impossible queries are rejected without searching, or found impossible by the search
+        for begin, end in impossible[::50]:
+            self.assertEqual(([], 0), graph.dijkstra(begin, end))
+        for begin, end in rejected[::50]:
+            context = SearchContext(record_visited=True)
+            self.assertEqual(([], 0), graph.dijkstra(begin, end, context=context))
+            self.assertEqual(([], 0), graph.a_star(begin, end, Vertex.euclidean_distance, context=context))
+            self.assertEqual([], context.visited)
+            self.assertEqual(([], 0), tollway_algorithm_again(graph, begin, end, Vertex.taxicab_distance,
+                                                              (lambda v_id: True, 0.5)))
+
+        # (3) test mutations refresh the condensation
+        begin, end = impossible[0]
+        graph.add_to_graph(begin, end, 1)
+        self.assertIsNot(condensation, graph.condensation())
+        self.assertTrue(graph.condensation().can_reach(begin, end))
+        self.assertEqual(([begin, end], 1), graph.dijkstra(begin, end))
+
+        # (4) test weight changes keep the condensation
+        condensation = graph.condensation()
+        graph.add_to_graph(begin, end, 2)
+        self.assertIs(condensation, graph.condensation())
+
+        # (5) test edges added straight to Vertex.adj are searched once the caches are invalidated
+        graph = Graph()
+        graph.add_to_graph('a', 'b', 1)
+        graph.add_to_graph('c')
+        self.assertEqual(([], 0), graph.dijkstra('a', 'c'))
+        graph.vertices['b'].adj['c'] = 2
+        graph.invalidate_caches()
+        self.assertEqual((['a', 'b', 'c'], 3), graph.dijkstra('a', 'c'))
+        self.assertEqual((['a', 'b', 'c'], 3), graph.a_star('a', 'c', Vertex.euclidean_distance))
+        self.assertEqual((['a', 'b', 'c'], 3), tollway_algorithm_again(graph, 'a', 'c', Vertex.taxicab_distance,
+                                                                       (lambda v_id: False, 0.5)))
+
+    def test_vectorized_heuristic(self):
+        graph = Graph(csvf='test_csvs/astar/test_astar_3.csv')
+        random.seed(331)
+        for vertex in graph.vertices.values():
+            vertex.x, vertex.y = random.uniform(0, 100), random.uniform(0, 100)
+        csr = graph.to_csr()
+
+        # (1) test the vectorized euclidean and taxicab metrics give the same routes as calling them
+        for metric in [Vertex.euclidean_distance, Vertex.taxicab_distance]:
+            table = graph.heuristic_table('a', metric)
+            np.testing.assert_allclose([metric(vertex, graph.vertices['a']) for vertex in graph.vertices.values()],
+                                       table)
+            self.assertEqual(table, csr.heuristic_table('a', metric))
+            for begin in list(graph.vertices)[:5]:
+                for end in graph.vertices:
+                    expected = graph.a_star(begin, end, lambda v1, v2: metric(v1, v2))
+                    self.assertEqual(expected, graph.a_star(begin, end, metric))
+                    self.assertEqual(expected, csr.a_star(begin, end, metric))
+
+        # (2) test registered metrics replace per-vertex calls, and unhashable metrics fall back to calls
+        calls = []
+
+        def chebyshev(v1: Vertex, v2: Vertex) -> float:
+            calls.append(v1.id)
+            return max(abs(v1.x - v2.x), abs(v1.y - v2.y))
+
+        register_vectorized_metric(chebyshev, lambda x, y, tx, ty: np.maximum(np.abs(x - tx), np.abs(y - ty)))
+        try:
+            expected = graph.a_star('a', 'z', lambda v1, v2: chebyshev(v1, v2))
+            calls.clear()
+            self.assertEqual(expected, graph.a_star('a', 'z', chebyshev))
+            self.assertEqual(expected[:2], tollway_algorithm_again(graph, 'a', 'z', chebyshev, (lambda v_id: False, 1)))
+            self.assertEqual([], calls)
+        finally:
+            del VECTORIZED_METRICS[chebyshev]
+
+        class Unhashable:
+            __hash__ = None
+
+            def __call__(self, v1: Vertex, v2: Vertex) -> float:
+                return Vertex.euclidean_distance(v1, v2)
+
+        self.assertIsNone(graph.heuristic_table('a', Unhashable()))
+        self.assertEqual(graph.a_star('a', 'z', Vertex.euclidean_distance), graph.a_star('a', 'z', Unhashable()))
+
+        # (3) test packed coordinates follow added vertices
+        graph.vertices['far'] = Vertex('far', 1000, 1000)
+        graph.add_to_graph('z', 'far', 1)
+        self.assertEqual(len(graph.vertices), len(graph.coordinate_arrays()[0]))
+        self.assertEqual((['z', 'far'], 1), graph.a_star('z', 'far', Vertex.euclidean_distance))
+
+        # (4) test moved vertices replace the packed coordinates, whether moved through set_coordinates or
+        # assigned directly and declared with invalidate_caches, while other mutations keep them packed
+        line = Graph()
+        for i in range(5):
+            line.add_to_graph(str(i), str(i + 1), 1)
+        self.assertEqual([0] * 6, line.heuristic_table('5', Vertex.euclidean_distance))
+        for i, v_id in enumerate(line.vertices):
+            line.set_coordinates(v_id, i, 0)
+        self.assertEqual([0, 1, 2, 3, 4, 5], line.coordinate_arrays()[0].tolist())
+        x, _ = line.coordinate_arrays()
+        line.add_to_graph('0', '5', 9)
+        self.assertIs(x, line.coordinate_arrays()[0])
+        line.vertices['0'].y = 1
+        self.assertEqual([0] * 6, line.coordinate_arrays()[1].tolist())
+        line.invalidate_caches()
+        self.assertEqual([1, 0, 0, 0, 0, 0], line.coordinate_arrays()[1].tolist())
+        line.vertices['0'].y = 0
+        line.invalidate_caches()
+        self.assertEqual([5, 4, 3, 2, 1, 0], line.heuristic_table('5', Vertex.euclidean_distance))
+        self.assertEqual((['0', '1', '2', '3', '4', '5'], 5), line.a_star('0', '5', Vertex.euclidean_distance))
+
+    def test_bulk_construction(self):
+        random.seed(331)
+        edges = [(random.choice('abcdefgh'), random.choice('abcdefgh'), random.randint(1, 9)) for _ in range(100)]
+
+        def same(graph, other):
+            return list(graph.vertices) == list(other.vertices) and \
+                all(list(v.adj.items()) == list(other.vertices[v_id].adj.items()) for v_id, v in graph.vertices.items())
+
+        # (1) test edges2graph and arrays2graph equal add_to_graph, repeated edges keeping their last weight
+        expected = Graph()
+        for v_id in 'zy':
+            expected.add_to_graph(v_id)
+        for begin, end, weight in edges:
+            expected.add_to_graph(begin, end, weight)
+        graph = Graph()
+        graph.edges2graph(edges, ids='zy')
+        self.assertTrue(same(expected, graph))
+        self.assertEqual(expected, graph)
+        self.assertEqual(expected.size, graph.size)
+        begins, ends, weights = (np.array(column) for column in zip(*edges))
+        graph = Graph()
+        graph.arrays2graph(begins, ends, weights, ids=np.array(['z', 'y']))
+        self.assertTrue(same(expected, graph))
+        self.assertEqual(expected.dijkstra('a', 'h'), graph.dijkstra('a', 'h'))
+
+        # (2) test numeric ids, coordinates and adding to an existing graph
+        graph = Graph()
+        graph.arrays2graph(np.array([3, 1]), np.array([1, 2]), [0.5, 1.5], ids=np.array([2, 1, 3]),
+                           x=[0, 1, 2], y=np.array([5, 6, 7]))
+        self.assertEqual([2, 1, 3], list(graph.vertices))
+        self.assertEqual((2.0, 7.0), (graph.vertices[3].x, graph.vertices[3].y))
+        graph.edges2graph([(1, 4, 2.0), (3, 1, 0.25)])
+        self.assertEqual(4, graph.size)
+        self.assertEqual({1: 0.25}, graph.vertices[3].adj)
+        self.assertEqual(([3, 1, 4], 2.25), graph.dijkstra(3, 4))
+        graph.edges2graph([])
+        self.assertEqual(4, graph.size)
+        graph = Graph()
+        graph.arrays2graph(np.array([10 ** 12, 0, 10 ** 12]), np.array([0, 7, 0]), np.array([1.5, 2.0, 3.0]))
+        self.assertEqual([10 ** 12, 0, 7], list(graph.vertices))
+        self.assertEqual({0: 3.0}, graph.vertices[10 ** 12].adj)
+
+        # (3) test mismatched columns and coordinates raise
+        with self.assertRaises(ValueError):
+            graph.arrays2graph(['a'], ['b', 'c'], [1])
+        with self.assertRaises(ValueError):
+            graph.arrays2graph(['a'], ['b'], [1], ids=['a'], x=[1])
+        with self.assertRaises(ValueError):
+            graph.arrays2graph(['a'], ['b'], [1], x=[1], y=[2])
+
+        # (4) test matrix2graph round trips through the bulk path
+        matrix = expected.graph2matrix()
+        graph = Graph()
+        graph.matrix2graph(matrix)
+        self.assertEqual(expected, graph)
+        self.assertEqual(matrix, graph.graph2matrix())
+
+    def test_coordinate_sidecar(self):
+        graph = Graph()
+        for x in range(12):
+            for y in range(12):
+                for dx, dy in ((1, 0), (0, 1), (-1, 0), (0, -1)):
+                    if 0 <= x + dx < 12 and 0 <= y + dy < 12:
+                        graph.add_to_graph(f"{x},{y}", f"{x + dx},{y + dy}", 1)
+        for v_id, vertex in graph.vertices.items():
+            vertex.x, vertex.y = map(float, v_id.split(','))
+        with tempfile.TemporaryDirectory() as tmp:
+            # (1) test matrix csv round trip keeps coordinates through the sidecar, ids with commas included
+            filepath = os.path.join(tmp, 'grid.csv')
+            graph.graph2csv(filepath)
+            self.assertEqual(os.path.join(tmp, 'grid.xy.csv'), coordinates_path(filepath))
+            self.assertTrue(os.path.exists(coordinates_path(filepath)))
+            self.assertEqual('matrix', detect_graph_format(filepath))
+            actual = Graph(csvf=filepath)
+            self.assertEqual(graph, actual)
+            self.assertEqual([(v.x, v.y) for v in graph.vertices.values()],
+                             [(v.x, v.y) for v in actual.vertices.values()])
+
+            # (2) test a_star on the loaded graph prunes with the euclidean heuristic
+            expected, pruned = SearchContext(record_visited=True), SearchContext(record_visited=True)
+            self.assertEqual(actual.dijkstra('0,0', '5,5', context=expected)[1],
+                             actual.a_star('0,0', '5,5', Vertex.euclidean_distance, context=pruned)[1])
+            self.assertLess(len(pruned.visited), len(expected.visited))
+            bare = Graph()
+            bare.csv2graph(filepath, coordinates=False)
+            self.assertTrue(all(v.x == 0 and v.y == 0 for v in bare.vertices.values()))
+
+            # (3) test coordinates can be passed to matrix2graph and stale sidecars are removed
+            matrix = graph.graph2matrix()
+            rebuilt = Graph()
+            rebuilt.matrix2graph(matrix, x=[v.x for v in graph.vertices.values()],
+                                 y=[v.y for v in graph.vertices.values()])
+            self.assertEqual((3.0, 4.0), (rebuilt.vertices['3,4'].x, rebuilt.vertices['3,4'].y))
+            for vertex in graph.vertices.values():
+                vertex.x = vertex.y = 0
+            graph.graph2csv(filepath)
+            self.assertFalse(os.path.exists(coordinates_path(filepath)))
+
+    def test_spatial_index(self):
+        random.seed(331)
+        graph = Graph()
+        for i in range(300):
+            graph.vertices[str(i)] = Vertex(str(i), random.uniform(-50, 50), random.choice([0, random.uniform(0, 10)]))
+            graph.size += 1
+        for i in range(299):
+            graph.add_to_graph(str(i), str(i + 1), 1)
+            graph.add_to_graph(str(i + 1), str(i), 1)
+        index = graph.spatial_index()
+
+        # (1) test k-nearest and radius queries match a scan over every vertex, inside and outside the grid
+        for _ in range(50):
+            point = Vertex('point', random.uniform(-80, 80), random.uniform(-20, 30))
+            scan = sorted((point.euclidean_distance(v), int(v_id)) for v_id, v in graph.vertices.items())
+            nearest = index.nearest(point.x, point.y, 5)
+            self.assertEqual([str(v_id) for _, v_id in scan[:5]], [v_id for v_id, _ in nearest])
+            np.testing.assert_allclose([distance for distance, _ in scan[:5]], [distance for _, distance in nearest])
+            within = index.within(point.x, point.y, 6)
+            self.assertEqual([str(v_id) for distance, v_id in scan if distance <= 6 - 1e-9],
+                             [v_id for v_id, distance in within if distance <= 6 - 1e-9])
+        self.assertEqual(300, len(index.nearest(0, 0, 1000)))
+        self.assertEqual([], index.nearest(0, 0, 0))
+        self.assertEqual([], index.within(0, 0, -1))
+
+        # (2) test searches between points snap both ends to their nearest vertices
+        begin, end = graph.vertices['10'], graph.vertices['200']
+        self.assertEqual('10', graph.nearest_vertex(begin.x + 1e-6, begin.y))
+        expected = graph.dijkstra('10', '200')
+        self.assertEqual(expected, graph.dijkstra_xy((begin.x, begin.y + 1e-6), (end.x, end.y - 1e-6)))
+        self.assertEqual(expected, graph.a_star_xy((begin.x, begin.y), (end.x, end.y), Vertex.taxicab_distance))
+        csr = graph.to_csr()
+        self.assertEqual(expected, csr.dijkstra_xy((begin.x, begin.y), (end.x, end.y)))
+        self.assertEqual(expected, csr.a_star_xy((begin.x, begin.y), (end.x, end.y), Vertex.taxicab_distance))
+
+        # (3) test the index is rebuilt after vertices are added, and empty graphs snap to nothing
+        graph.add_to_graph('far', '0', 1)
+        graph.vertices['far'].x = 1000
+        self.assertEqual('far', graph.nearest_vertex(900, 0))
+        self.assertIsNone(Graph().nearest_vertex(0, 0))
+        self.assertEqual(([], 0), Graph().dijkstra_xy((0, 0), (1, 1)))
+
+        # (4) test moved vertices are found where they now are, and other mutations keep the index
+        graph = Graph(csvf='test_csvs/astar/tollway_graph_csv.csv')
+        graph.nearest_vertex(0, 0)
+        for i, v_id in enumerate(graph.vertices):
+            graph.set_coordinates(v_id, i, i)
+        self.assertEqual('F', graph.nearest_vertex(5, 5))
+        index = graph.spatial_index()
+        graph.add_to_graph('A', 'F', 1)
+        self.assertIs(index, graph.spatial_index())
+        graph.vertices['A'].x, graph.vertices['A'].y = 30, 30
+        graph.invalidate_caches()
+        self.assertEqual('A', graph.nearest_vertex(29, 29))
+
+    def test_search_stats(self):
+        graph = Graph(csvf='test_csvs/astar/test_astar_3.csv')
+        random.seed(331)
+        for vertex in graph.vertices.values():
+            vertex.x, vertex.y = random.uniform(0, 100), random.uniform(0, 100)
+        graph.enable_route_cache()
+
+        # (1) test instrumented searches return the same results and count what they settled and pushed
+        shortest, heuristic = graph.dijkstra('a', 'z'), graph.a_star('a', 'z', Vertex.euclidean_distance)
+        for search, expected in [(lambda context: graph.dijkstra('a', 'z', 'heap', context), shortest),
+                                 (lambda context: graph.dijkstra('a', 'z', 'bucket', context), shortest),
+                                 (lambda context: graph.a_star('a', 'z', Vertex.euclidean_distance, context),
+                                  heuristic)]:
+            reports = []
+            stats = SearchStats(callback=reports.append)
+            context = SearchContext(record_visited=True, stats=stats)
+            self.assertEqual(expected, search(context))
+            self.assertEqual([stats.as_dict()], reports)
+            report = reports[0]
+            self.assertEqual(1, report['searches'])
+            self.assertEqual(len(context.visited), report['settled'])
+            self.assertEqual(sum(len(graph.vertices[v_id].adj) for v_id in context.visited[:-1]), report['relaxed'])
+            # every entry added was settled, popped as stale, or is still queued; only updates leave stale entries
+            self.assertLessEqual(report['settled'] + report['stale_pops'], report['pushes'] + report['updates'])
+            self.assertLessEqual(report['stale_pops'], report['updates'])
+            self.assertGreater(report['peak_heap'], 0)
+            self.assertTrue({'setup', 'search', 'path'} <= set(report['phase_seconds']))
+            self.assertTrue(all(seconds >= 0 for seconds in report['phase_seconds'].values()))
+
+        # (2) test tollway counts come from its lazy heap, and counters add up over searches
+        stats = SearchStats()
+        expected = tollway_algorithm_again(graph, 'a', 'z', Vertex.euclidean_distance, (lambda v_id: v_id < 'm', 0.5))
+        self.assertEqual(expected, tollway_algorithm_again(graph, 'a', 'z', Vertex.euclidean_distance,
+                                                           (lambda v_id: v_id < 'm', 0.5), stats))
+        first = stats.as_dict()
+        self.assertEqual(0, first['updates'])
+        self.assertGreaterEqual(first['pushes'], first['settled'] + first['stale_pops'])
+        self.assertIn('heuristic', first['phase_seconds'])
+        graph.a_star('a', 'z', Vertex.euclidean_distance, SearchContext(stats=stats))
+        self.assertEqual(2, stats.searches)
+        self.assertGreater(stats.settled, first['settled'])
+
+        # (3) test rejected searches are reported with only a setup phase, and reset zeroes everything
+        stats.reset()
+        graph.add_to_graph('island')
+        self.assertEqual(([], 0), graph.dijkstra('a', 'island', context=SearchContext(stats=stats)))
+        self.assertEqual({'searches': 1, 'settled': 0, 'relaxed': 0, 'pushes': 0, 'updates': 0, 'stale_pops': 0,
+                          'peak_heap': 0}, {key: value for key, value in stats.as_dict().items()
+                                            if key != 'phase_seconds'})
+        self.assertEqual(['setup'], list(stats.as_dict()['phase_seconds']))
+
+    """
+    End Graph Backend Tests
+    """
+
 
 if __name__ == '__main__':
     unittest.main()